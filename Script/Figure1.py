@@ -1,6 +1,7 @@
 import altair as alt
-alt.data_transformers.enable("vegafusion")
 import polars as pl
+from export import export_chart
+from schemas import to_enum, plain_labels
 ## -------- ##
 ## FIGURE 1A ##
 def Fraction_plot(df, sorted_value, save_name='Figure1A',
@@ -48,7 +49,7 @@ def Fraction_plot(df, sorted_value, save_name='Figure1A',
     """
     color_scale = alt.Scale(scheme="pastel1")
     
-    plot = alt.Chart(df, title="Fraction of Genetic Variants across Different Genomic Regions").mark_bar().encode(
+    plot = alt.Chart(plain_labels(df), title="Fraction of Genetic Variants across Different Genomic Regions").mark_bar().encode(
         y=alt.Y(y, title="", sort=sorted_value, axis=alt.Axis(grid=True,ticks=False)),
         x=alt.X(x, title="Fraction [%]").stack("normalize"),
         color=alt.Color(color, scale=color_scale, title="Region",
@@ -63,8 +64,7 @@ def Fraction_plot(df, sorted_value, save_name='Figure1A',
     )
 
     # Save
-    plot.save(f'{save_name}.svg', engine='vl-convert', ppi=300)
-    plot.save(f'{save_name}.png', engine='vl-convert', ppi=300)
+    export_chart(plot, save_name, ppi=300)
     
     return plot
 
@@ -82,6 +82,7 @@ def Data_processing(df, chr_map):
 
     chr_map : polars.DataFrame
         A mapping dataframe used to join with the main data to add chromosome information.
+        With the Enum-keyed map from `schemas.chromosome_keys`, the join runs on integer chromosome codes.
 
     Returns:
     --------
@@ -92,24 +93,84 @@ def Data_processing(df, chr_map):
     ------
     - The function computes normalized variant density by dividing the variant count by the genomic length.
     - The final dataframe is filtered to exclude mitochondrial chromosome data.
+    - `df` may be a LazyFrame; the mapping is then joined lazily.
 
     Example Usage:
     --------------
     >>> processed_df = Data_processing(df, chr_map)
     
     """
+    # Drop MT from the small mapping table rather than from every window
+    chromosomes = chr_map.filter(pl.col('column_3').cast(pl.Utf8) != "MT")
+    seq_type = chromosomes.schema['column_1']
+    if isinstance(df, pl.LazyFrame):
+        chromosomes = chromosomes.lazy()
+
     # Add normalized variant density
-    proc_df = df.with_columns(Norm_Var_Den=pl.col('column_4') / (pl.col('column_3') - pl.col('column_2')))
+    proc_df = df.with_columns(to_enum('column_1', seq_type), Norm_Var_Den=pl.col('column_4') / (pl.col('column_3') - pl.col('column_2')))
 
     # Process and filter data
     plot_df = proc_df.with_columns(
         Percent_den=pl.col('Norm_Var_Den') * 100
-    ).join(chr_map, 'column_1').filter(pl.col('column_3_right') != "MT")
+    ).join(chromosomes, 'column_1')
     
     return plot_df
 
 
-def Plot_VarChr(df, sorted_value, save_name='Figure1B', y="Percent_den:Q", x='column_3_right', color='column_3_right:N', title='Variant occurrence per chromosome with resolution of 10Kb'):
+def Reduce_density(df, x='column_3_right', y='Percent_den', mode='histogram', bins=200):
+    """
+    Function to summarize per-chromosome variant density into a fixed-size table before charting.
+
+    Parameters:
+    -----------
+    df : polars.DataFrame
+        The processed window table from `Data_processing`.
+
+    x : str, optional (default: 'column_3_right')
+        The column holding the chromosome labels.
+
+    y : str, optional (default: 'Percent_den')
+        The column holding the density values to summarize.
+
+    mode : str, optional (default: 'histogram')
+        'histogram' bins the values of each chromosome into `bins` equal-width bins over the genome-wide range.
+        'quantile' keeps the 5th, 25th, 50th, 75th and 95th percentiles of each chromosome.
+
+    bins : int, optional (default: 200)
+        Number of density bins in 'histogram' mode.
+
+    Returns:
+    --------
+    polars.DataFrame
+        At most `bins` rows per chromosome in 'histogram' mode (columns bin_start, bin_end, Count),
+        one row per chromosome in 'quantile' mode (columns q05, q25, median, q75, q95, Count).
+
+    Example Usage:
+    --------------
+    >>> summary = Reduce_density(Data_processing(df, chr_map), bins=100)
+    
+    """
+    value = pl.col(y)
+    df = df.select(x, y).drop_nulls()
+    if mode == 'quantile':
+        return df.group_by(x).agg(
+            q05=value.quantile(0.05), q25=value.quantile(0.25), median=value.median(),
+            q75=value.quantile(0.75), q95=value.quantile(0.95), Count=pl.len()
+        )
+    if mode != 'histogram':
+        raise ValueError(f"Unknown reduction mode: {mode!r} (expected 'histogram' or 'quantile')")
+
+    low, high = df[y].min(), df[y].max()
+    width = (high - low) / bins if high is not None and high > low else 1.0
+    return df.with_columns(
+        bin=((value - low) / width).floor().clip(0, bins - 1).cast(pl.UInt32)
+    ).group_by(x, 'bin').agg(Count=pl.len()).with_columns(
+        bin_start=low + pl.col('bin') * width,
+        bin_end=low + (pl.col('bin') + 1) * width
+    ).sort(x, 'bin')
+
+
+def Plot_VarChr(df, sorted_value, save_name='Figure1B', y="Percent_den:Q", x='column_3_right', color='column_3_right:N', title='Variant occurrence per chromosome with resolution of 10Kb', mode='points', bins=200, region=None):
     """
     Function to create a scatter plot representing the percentage of variant occurrences per chromosome.
 
@@ -123,6 +184,7 @@ def Plot_VarChr(df, sorted_value, save_name='Figure1B', y="Percent_den:Q", x='co
 
     save_name : str, optional (default: 'Figure1B')
         The filename used to save the generated plot. The plot will be saved in both .svg and .png formats.
+        None returns the chart without saving it.
 
     y : str, optional (default: 'Percent_den:Q')
         The column to be used for the y-axis, representing the percentage density of variants.
@@ -136,6 +198,17 @@ def Plot_VarChr(df, sorted_value, save_name='Figure1B', y="Percent_den:Q", x='co
     title : str, optional (default: 'Variant occurrence per chromosome with resolution of 10Kb')
         The title of the plot.
 
+    mode : str, optional (default: 'points')
+        'points' draws every window as a jittered circle. 'histogram' and 'quantile' first summarize the windows
+        with `Reduce_density`, so the chart size no longer grows with the number of windows.
+
+    bins : int, optional (default: 200)
+        Number of density bins per chromosome in 'histogram' mode.
+
+    region : str, optional (default: None)
+        Only draw the windows overlapping this region, e.g. 'chr7' or 'chr7:40-60Mb' (chromosome label as in
+        Genome_text.tsv), and add it to the title. None draws every chromosome.
+
     Returns:
     --------
     altair.Chart
@@ -144,6 +217,8 @@ def Plot_VarChr(df, sorted_value, save_name='Figure1B', y="Percent_den:Q", x='co
     Notes:
     ------
     - The plot displays variant occurrences with a jitter effect to avoid overlapping points.
+    - In 'histogram' mode each chromosome is drawn as a strip of density bins whose opacity follows the number of windows.
+    - In 'quantile' mode each chromosome is drawn as a 5-95% whisker, a 25-75% box and a median tick.
     - The generated plot uses category20b colors and is saved at a resolution suitable for publication.
 
     Example Usage:
@@ -152,23 +227,48 @@ def Plot_VarChr(df, sorted_value, save_name='Figure1B', y="Percent_den:Q", x='co
     
     """
     
+    if region:
+        from store import in_region, format_region
+        df = df.filter(in_region(region, x, 'column_2', 'column_3'))
+        title = f'{title} ({format_region(region)})'
+
     # Set color and sort labels
     color_scale = alt.Scale(scheme="category20b")
 
-    # Create plot
-    plot = alt.Chart(df, title=title).mark_circle(size=8).encode(
-        y=alt.Y(y, title="Percentage of Variant"),
-        x=alt.X(x, title="Chromosome", axis=alt.Axis(grid=True, labelAngle=-45, ticks=False),
-                sort=sorted_value),
-        xOffset="jitter:Q",
-        color=alt.Color(color, legend=None, scale=color_scale)
-    ).transform_calculate(
-        jitter="sqrt(-2*log(random()))*cos(2*PI*random())"
-    )
+    x_axis = alt.X(x, title="Chromosome", axis=alt.Axis(grid=True, labelAngle=-45, ticks=False), sort=sorted_value)
+    color_enc = alt.Color(color, legend=None, scale=color_scale)
 
-    # Save
-    plot.save(f'{save_name}.svg', engine='vl-convert', ppi=300)
-    plot.save(f'{save_name}.png', engine='vl-convert', ppi=300)
+    # Create plot
+    if mode == 'points':
+        plot = alt.Chart(plain_labels(df), title=title).mark_circle(size=8).encode(
+            y=alt.Y(y, title="Percentage of Variant"),
+            x=x_axis,
+            xOffset="jitter:Q",
+            color=color_enc
+        ).transform_calculate(
+            jitter="sqrt(-2*log(random()))*cos(2*PI*random())"
+        )
+    elif mode == 'histogram':
+        summary = Reduce_density(df, x=x, y=y.split(':')[0], mode='histogram', bins=bins)
+        plot = alt.Chart(plain_labels(summary), title=title).mark_rect().encode(
+            y=alt.Y('bin_start:Q', title="Percentage of Variant"),
+            y2='bin_end:Q',
+            x=x_axis,
+            color=color_enc,
+            opacity=alt.Opacity('Count:Q', scale=alt.Scale(type='log', range=[0.15, 1]), legend=None)
+        )
+    else:
+        summary = Reduce_density(df, x=x, y=y.split(':')[0], mode=mode)
+        base = alt.Chart(plain_labels(summary), title=title).encode(x=x_axis, color=color_enc)
+        plot = alt.layer(
+            base.mark_rule().encode(y=alt.Y('q05:Q', title="Percentage of Variant"), y2='q95:Q'),
+            base.mark_bar(size=10).encode(y='q25:Q', y2='q75:Q'),
+            base.mark_tick(color='black', size=10).encode(y='median:Q')
+        )
+
+    # Save; None only builds the chart (used by the explorer)
+    if save_name:
+        export_chart(plot, save_name, ppi=300)
     
     return plot
 
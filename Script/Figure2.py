@@ -1,6 +1,8 @@
 import altair as alt
-alt.data_transformers.enable("vegafusion")
 import polars as pl
+from export import export_chart, export_table
+from intervals import centromere_layer, add_centromere_distance, stack_layers
+from schemas import to_enum
 ## -------- ##
 
 ## FIGURE 2 ##
@@ -20,6 +22,8 @@ def Data_processing_fig2(df, chr_map, centromere_df):
 
     chr_map : polars.DataFrame
         A mapping dataframe used to add chromosome information to the main data.
+        With the Enum-keyed map from `schemas.chromosome_keys`, joins run on integer chromosome codes and
+        the result is sorted in the map's natural chromosome order.
 
     centromere_df : polars.DataFrame
         A dataframe containing centromere location information, including columns for chromosome, start, and end positions.
@@ -33,7 +37,11 @@ def Data_processing_fig2(df, chr_map, centromere_df):
     ------
     - The centromere data is transformed to megabase pairs for easier visualization.
     - The function calculates metrics such as normalized variant density, percentage density, and general positional information.
-    - Chromosome names are formatted to maintain a consistent ordering format.
+    - Distances (Mbp) from each window mid-point to the centromere (`Dist_centromere`) and to the nearest chromosome end (`Dist_telomere`) are added.
+      The chromosome length (`Chr_length`, Mbp) is Genome_text.tsv column_2, so a window subset still gets the true distances.
+      The centromere coordinates are not joined onto the windows; pass `centromere_layer(centromere_df)` to `Plot_VarPerChr` instead.
+    - The density is normalized by each window's own width (`column_3` - `column_2`), so tables at any resolution can be used.
+    - Chromosome is an Enum in natural order (chr1, chr2, ..., chr10), so no name padding is needed for sorting.
 
     Example Usage:
     --------------
@@ -41,20 +49,24 @@ def Data_processing_fig2(df, chr_map, centromere_df):
     
     """
     
-    centromere_df = centromere_df.rename({'column_1':'Chromosome','column_2':'Start','column_3':'End'})\
-    .with_columns(Start = pl.col('Start')/10**6,
-                 End = pl.col('End')/10**6)
+    chromosomes = chr_map.filter(pl.col('column_3').cast(pl.Utf8) != "MT")
+    seq_type, label_type = chromosomes.schema['column_1'], chromosomes.schema['column_3']
+    centromere_df = centromere_layer(centromere_df).with_columns(to_enum('Chromosome', label_type)).drop_nulls('Chromosome')
     
-    cleaned_df = df.join(chr_map,'column_1').filter(pl.col('column_3_right')!="MT").with_columns(pl.col('column_2')/10**6, pl.col('column_3')/10**6).select(pl.exclude("column_2_right","column_1")).rename({"column_3_right":"Chromosome"})
+    # Window width comes from the table itself, so any resolution (and truncated last windows) is handled
+    cleaned_df = df.with_columns(to_enum('column_1', seq_type), Window_bp=pl.col('column_3') - pl.col('column_2')).join(chromosomes,'column_1').with_columns(pl.col('column_2')/10**6, pl.col('column_3')/10**6, Chr_length=pl.col('column_2_right')/10**6).select(pl.exclude("column_2_right","column_1")).rename({"column_3_right":"Chromosome"})
     
-    joined_df = cleaned_df.join(centromere_df,'Chromosome')
-    proc_df = joined_df.with_columns(Norm_den=pl.col('column_4')/500000,
-                Percent_den=pl.col('column_4')*100/500000,
+    # Keep chromosomes with a centromere annotation; the centromere itself is drawn from its own layer
+    joined_df = cleaned_df.join(centromere_df.select('Chromosome'), on='Chromosome', how='semi')
+    proc_df = joined_df.with_columns(Norm_den=pl.col('column_4')/pl.col('Window_bp'),
+                Percent_den=pl.col('column_4')*100/pl.col('Window_bp'),
                       general_pos=(pl.col('column_2')+pl.col('column_3'))/2)
-    return proc_df.sort('Chromosome').with_columns(pl.col('Chromosome').str.replace(r"chr(\d)\b", r"chr0$1"))
+    proc_df = add_centromere_distance(proc_df, centromere_df)
+    return proc_df.sort('Chromosome', maintain_order=True)
 
 
-def Plot_VarPerChr(df, sorted_value, save_name='Figure2', title="Variant Distribution from Chromosomal End to Centromeric Region at 500 Kbp Resolution", x='general_pos:Q', y='Percent_den:Q'):
+def Plot_VarPerChr(df, sorted_value, save_name='Figure2', title="Variant Distribution from Chromosomal End to Centromeric Region at 500 Kbp Resolution", x='general_pos:Q', y='Percent_den:Q', centromere=None,
+                   enrichment=None, permutations=0, region=None, tiles=False):
     
     """
     Function to create a facet plot of variant distribution from chromosomal ends to centromeric regions.
@@ -65,10 +77,11 @@ def Plot_VarPerChr(df, sorted_value, save_name='Figure2', title="Variant Distrib
         The input data containing variant information, with columns for chromosomal positions, centromere start/end, and density metrics.
 
     sorted_value : list
-        A list of chromosome labels to specify the order of chromosomes in the plot.
+        A list of chromosome labels to specify the order of chromosomes (facets and colors) in the plot.
 
     save_name : str, optional (default: 'Figure2')
         The filename used to save the generated plot. The plot will be saved in both .svg and .png formats.
+        None returns the chart without saving it.
 
     title : str, optional (default: 'Variant Distribution from Chromosomal End to Centromeric Region at 500 Kbp Resolution')
         The title of the plot.
@@ -79,6 +92,25 @@ def Plot_VarPerChr(df, sorted_value, save_name='Figure2', title="Variant Distrib
     y : str, optional (default: 'Percent_den:Q')
         The column to be used for the y-axis, representing the percentage density of variants.
 
+    centromere : polars.DataFrame, optional (default: None)
+        One row per chromosome with Chromosome, Start and End (Mbp), from `centromere_layer`. None takes the distinct
+        Start/End pairs from `df` when it still carries them.
+
+    enrichment : polars.DataFrame, optional (default: None)
+        End-to-centromere statistics from `enrichment.enrichment_test`, shown as a label in each facet.
+
+    permutations : int, optional (default: 0)
+        When no `enrichment` table is given, run `enrichment_test` with this many permutations, label the facets
+        and write the table to `{save_name}_enrichment.tsv`. 0 adds no labels.
+
+    region : str, optional (default: None)
+        Only draw the windows overlapping this region, e.g. 'chr7' or 'chr7:40-60Mb' (chromosome label as in
+        Genome_text.tsv), and add it to the title. None draws every chromosome.
+
+    tiles : bool, optional (default: False)
+        Render each chromosome as its own tile on a process pool and stitch the tiles into the figure
+        (see tiles.py), instead of rendering the faceted chart as one job. Unchanged tiles are reused from the tile cache.
+
     Returns:
     --------
     altair.Chart
@@ -87,6 +119,7 @@ def Plot_VarPerChr(df, sorted_value, save_name='Figure2', title="Variant Distrib
     Notes: combined_plot
     ------
     - The plot uses a combination of scatter and rectangle marks to visualize variant distribution and centromere regions.
+    - The centromere is drawn once per facet from its own rows, not once per window.
     - The generated plot uses category20b colors and is saved at a resolution suitable for publication.
 
     Example Usage:
@@ -95,32 +128,67 @@ def Plot_VarPerChr(df, sorted_value, save_name='Figure2', title="Variant Distrib
     
     """
     
-    color_scale = alt.Scale(scheme="category20b")
-
-    plot = alt.Chart(df,
+    if centromere is None and {'Start', 'End'} <= set(df.columns):
+        centromere = df.select('Chromosome', 'Start', 'End').unique(maintain_order=True)
+        df = df.drop('Start', 'End')
+    if region:
+        from store import in_region, format_region
+        df = df.filter(in_region(region, 'Chromosome', 'column_2', 'column_3', unit=10**6))
+        if centromere is not None:
+            centromere = centromere.filter(in_region(region, 'Chromosome', 'Start', 'End', unit=10**6))
+        title = f'{title} ({format_region(region)})'
+    if enrichment is None and permutations:
+        from enrichment import enrichment_test
+        enrichment = enrichment_test(df, centromere, value=y.split(':')[0], permutations=permutations)
+        if save_name:
+            export_table(enrichment, f'{save_name}_enrichment')
+    labels = None
+    if enrichment is not None:
+        from enrichment import enrichment_layer
+        labels = enrichment_layer(enrichment)
+    data = stack_layers(points=df, centromere=centromere, enrichment=labels)
+
+    # Tiles are rendered apart, so they share an explicit color domain
+    color_scale = alt.Scale(scheme="category20b", domain=list(sorted_value)) if tiles else alt.Scale(scheme="category20b")
+    color = alt.Color('Chromosome', scale=color_scale, sort=sorted_value, title=None)
+
+    plot = alt.Chart(data,
             title=title
             ).encode(
         x = alt.X(x,title='Position (Mbp)'),
         y = alt.Y(y,title='Percentage of Variant'),
-        color=alt.Color('Chromosome',scale=color_scale,sort=sorted_value,title=None)
+        color=color
     ).properties(
         width=200,
         height=100
     )
 
-    combined_plot = alt.layer(
-        plot.mark_circle(size=40),
-        plot.mark_rect(color='', fill='', stroke='grey', strokeWidth=1.4, strokeDash=[2, 2]).encode(
+    layers = [
+        plot.transform_filter(alt.datum.layer == 'points').mark_circle(size=40),
+        plot.transform_filter(alt.datum.layer == 'centromere').mark_rect(color='', fill='', stroke='grey', strokeWidth=1.4, strokeDash=[2, 2]).encode(
             x='Start:Q',
             x2='End:Q',
             y=alt.value(0),  # 0 pixels from top
         )
-    ).facet(
-        "Chromosome:N",
-        columns=3
-    ).configure_header(
+    ]
+    # The label layer only exists with an enrichment test (the stacked data has no Label column otherwise)
+    if labels is not None:
+        layers.append(plot.transform_filter(alt.datum.layer == 'enrichment').mark_text(align='right', baseline='top', fontSize=9, color='black').encode(
+            x=alt.value(200),  # right edge of the facet
+            y=alt.value(2),
+            text='Label:N',
+            color=alt.value('black')
+        ))
+    layered = alt.layer(*layers)
+    header = dict(
         titleFontSize=16,  # Change this value to adjust the font size of the facet titles
         labelFontSize=14   # Optional: Adjusts the label font size of each facet as well
+    )
+    combined_plot = layered.facet(
+        alt.Facet("Chromosome:N", sort=sorted_value),
+        columns=3
+    ).configure_header(
+        **header
     ).resolve_axis(
         x='independent',
         y='independent'
@@ -129,9 +197,13 @@ def Plot_VarPerChr(df, sorted_value, save_name='Figure2', title="Variant Distrib
         y='independent'
     )
     
-    # Save
-    combined_plot.save(f'{save_name}.svg', engine='vl-convert', ppi=300)
-    combined_plot.save(f'{save_name}.png', engine='vl-convert', ppi=300)
+    # Save; None only builds the chart (used by the explorer)
+    if save_name and tiles:
+        from tiles import facet_tiles, export_facets
+        export_facets(facet_tiles(layered, data, 'Chromosome', sorted_value, title=title, legend=color, header_config=header),
+                      save_name, ppi=300, columns=3, anchor='start')
+    elif save_name:
+        export_chart(combined_plot, save_name, ppi=300)
     
     return combined_plot
 
@@ -1,8 +1,10 @@
 import altair as alt
-alt.data_transformers.enable("vegafusion")
 import polars as pl
+from export import export_chart
+from schemas import SV_LENGTH_SCHEMA
+from svstats import SVLengthStats, is_length_summary, sv_length_stats
 
-def plot_sv_chart(data_path, save_name='Figure3BC'):
+def plot_sv_chart(data_path, save_name='Figure3BC', svtype='SVTYPE', length='SVLEN'):
     """
     Generates combined bar charts for Median Length and Total Length of Structural Variants.
 
@@ -11,15 +13,24 @@ def plot_sv_chart(data_path, save_name='Figure3BC'):
     then combined and saved as SVG and PNG files.
 
     Parameters:
-    data_path (str): Path to the input TSV data file. The file should contain columns 'SVTYPE', 'Metric', and 'Value'.
+    data_path (str, polars.DataFrame or SVLengthStats): Path to the input TSV data file, or the already loaded table. It should contain columns 'SVTYPE', 'Metric', and 'Value'.
+        A path to raw SV calls (a VCF, or a table with SV type and length columns) is summarized in one chunked pass with `svstats.sv_length_stats`.
     save_name (str): The base name to save the output SVG and PNG charts.
+    svtype, length (str): SV type and length columns when `data_path` is a raw call table.
 
     Returns: combined_chart
     altair.Chart
         The generated Altair bar chart.
     """
     # Read data
-    med_len_SV = pl.read_csv(data_path, separator='\t')
+    if isinstance(data_path, pl.DataFrame):
+        med_len_SV = data_path
+    elif isinstance(data_path, SVLengthStats):
+        med_len_SV = data_path.table()
+    elif is_length_summary(data_path):
+        med_len_SV = pl.read_csv(data_path, separator='\t', schema_overrides=SV_LENGTH_SCHEMA)
+    else:
+        med_len_SV = sv_length_stats(data_path, svtype, length).table()
 
     # Base chart configuration
     base = alt.Chart(med_len_SV, title=" ").encode(
@@ -47,8 +58,7 @@ def plot_sv_chart(data_path, save_name='Figure3BC'):
     combined_chart = median_bar | total_bar
 
     # Save charts
-    combined_chart.save(f"{save_name}.svg", engine="vl-convert", ppi=300)
-    combined_chart.save(f"{save_name}.png", engine="vl-convert", ppi=300)
+    export_chart(combined_chart, save_name, ppi=300)
     
     return combined_chart
 
@@ -1,6 +1,9 @@
 import altair as alt
-alt.data_transformers.enable("vegafusion")
 import polars as pl
+from export import export_chart, export_table
+from loess import grouped_loess
+from intervals import centromere_layer, add_centromere_distance, stack_layers
+from schemas import to_enum, chromosome_levels
 ## -------- ##
 ## FIGURE 4 ##
 ## Use Centromere Length from Newly Published Paper (https://doi.org/10.1101/2024.04.07.588379)
@@ -10,7 +13,7 @@ import polars as pl
 
 
 
-def Data_processing_fig4(df, centromere_df):
+def Data_processing_fig4(df, centromere_df, chr_map=None):
     """
     Function to process data for Figure 4, including joining with centromere information and calculating relevant metrics.
 
@@ -22,6 +25,10 @@ def Data_processing_fig4(df, centromere_df):
     centromere_df : polars.DataFrame
         A dataframe containing centromere location information, including columns for chromosome, start, and end positions.
 
+    chr_map : polars.DataFrame, optional (default: None)
+        Enum-keyed Genome_text.tsv from `schemas.chromosome_keys`; its label order becomes the Chromosome Enum.
+        None orders the chromosomes of the centromere table naturally.
+
     Returns:
     --------
     polars.DataFrame
@@ -31,7 +38,11 @@ def Data_processing_fig4(df, centromere_df):
     ------
     - The centromere data is transformed to megabase pairs for easier visualization.
     - The function calculates metrics such as normalized variant density, percentage density, and general positional information.
-    - Chromosome names are formatted to maintain a consistent ordering format.
+    - The density is normalized by each window's own width; window coordinates in this table are already in Mbp.
+    - Distances (Mbp) to the centromere (`Dist_centromere`) and to the nearest chromosome end (`Dist_telomere`) are added.
+      The chromosome length (`Chr_length`, Mbp) is the Genome_text.tsv length carried as `column_2_right`.
+      The centromere coordinates are not joined onto the windows; pass `centromere_layer(centromere_df)` to `Plot_TrendPerChr` instead.
+    - Chromosome is an Enum in natural order (chr1, chr2, ..., chr10), so no name padding is needed for sorting.
     - The `Type` column is modified to replace occurrences of "BND" with "TRN".
 
     Example Usage:
@@ -39,18 +50,21 @@ def Data_processing_fig4(df, centromere_df):
     >>> processed_df_fig4 = Data_processing_fig4(df, centromere_df)
     
     """
-    centromere_df = centromere_df.rename({'column_1':'Chromosome','column_2':'Start','column_3':'End'})\
-    .with_columns(Start = pl.col('Start')/10**6,
-                 End = pl.col('End')/10**6)
+    centromere_df = centromere_layer(centromere_df)
+    label_type = chr_map.schema['column_3'] if chr_map is not None else pl.Enum(chromosome_levels(centromere_df['Chromosome']))
+    centromere_df = centromere_df.with_columns(to_enum('Chromosome', label_type)).drop_nulls('Chromosome')
     
-    df = df.select(pl.exclude("column_2_right","column_1")).join(centromere_df,'Chromosome').with_columns(Norm_den=pl.col('column_4')/500000, Percent_den=pl.col('column_4')*100/500000, general_pos=(pl.col('column_2')+pl.col('column_3'))/2)
+    # Keep chromosomes with a centromere annotation; the centromere itself is drawn from its own layer
+    df = df.with_columns(Chr_length=pl.col('column_2_right')/10**6).select(pl.exclude("column_2_right","column_1")).with_columns(to_enum('Chromosome', label_type)).join(centromere_df.select('Chromosome'), on='Chromosome', how='semi').with_columns(Window_bp=((pl.col('column_3')-pl.col('column_2'))*10**6).round()).with_columns(Norm_den=pl.col('column_4')/pl.col('Window_bp'), Percent_den=pl.col('column_4')*100/pl.col('Window_bp'), general_pos=(pl.col('column_2')+pl.col('column_3'))/2)
     
-    proc_df = df.with_columns(pl.col('Type').str.replace("BND", "TRN"))
+    proc_df = add_centromere_distance(df, centromere_df).with_columns(pl.col('Type').str.replace("BND", "TRN"))
     
-    return proc_df.sort('Chromosome').with_columns(pl.col('Chromosome').str.replace(r"chr(\d)\b", r"chr0$1"))
+    return proc_df.sort('Chromosome', maintain_order=True)
 
 
-def Plot_TrendPerChr(df, save_name='Figure4', title="Variant Distribution from Chromosomal End to Centromeric Region at 500 Kbp Resolution", x='column_2:Q', y='column_4:Q'):
+def Plot_TrendPerChr(df, save_name='Figure4', title="Variant Distribution from Chromosomal End to Centromeric Region at 500 Kbp Resolution", x='column_2:Q', y='column_4:Q',
+                     trend=None, bandwidth=0.3, grid_size=None, export_trend=False, centromere=None,
+                     enrichment=None, permutations=0, region=None, tiles=False):
     """
     Function to create a facet plot of variant trends per chromosome, showing variant distribution from chromosomal ends to centromeric regions.
 
@@ -61,6 +75,7 @@ def Plot_TrendPerChr(df, save_name='Figure4', title="Variant Distribution from C
 
     save_name : str, optional (default: 'Figure4')
         The filename used to save the generated plot. The plot will be saved in both .svg and .png formats.
+        None returns the chart without saving it.
 
     title : str, optional (default: 'Variant Distribution from Chromosomal End to Centromeric Region at 500 Kbp Resolution')
         The title of the plot.
@@ -71,6 +86,37 @@ def Plot_TrendPerChr(df, save_name='Figure4', title="Variant Distribution from C
     y : str, optional (default: 'column_4:Q')
         The column to be used for the y-axis, representing the percentage density of variants.
 
+    trend : polars.DataFrame, optional (default: None)
+        Precomputed LOESS curves with columns Chromosome, Type, x and y. None fits them with `grouped_loess`.
+
+    bandwidth : float, optional (default: 0.3)
+        LOESS bandwidth used when the trend is fitted here.
+
+    grid_size : int, optional (default: None)
+        Number of evaluation points per curve. None evaluates at every window position, as Vega's transform_loess does.
+
+    export_trend : bool, optional (default: False)
+        Also write the fitted curves to `{save_name}_trend.tsv` for downstream analysis.
+
+    centromere : polars.DataFrame, optional (default: None)
+        One row per chromosome with Chromosome, Start and End (Mbp), from `centromere_layer`. None takes the distinct
+        Start/End pairs from `df` when it still carries them.
+
+    enrichment : polars.DataFrame, optional (default: None)
+        End-to-centromere statistics per Type from `enrichment.enrichment_test`, shown as a label in each facet.
+
+    permutations : int, optional (default: 0)
+        When no `enrichment` table is given, test each Type with this many permutations, label the facets
+        and write the table to `{save_name}_enrichment.tsv`. 0 adds no labels.
+
+    region : str, optional (default: None)
+        Only draw the windows overlapping this region, e.g. 'chr7' or 'chr7:40-60Mb' (chromosome label as in
+        Genome_text.tsv), and add it to the title. None draws every chromosome.
+
+    tiles : bool, optional (default: False)
+        Render each chromosome as its own tile on a process pool and stitch the tiles into the figure
+        (see tiles.py), instead of rendering the faceted chart as one job. Unchanged tiles are reused from the tile cache.
+
     Returns:
     --------
     altair.Chart
@@ -79,7 +125,9 @@ def Plot_TrendPerChr(df, save_name='Figure4', title="Variant Distribution from C
     Notes:
     ------
     - The plot uses a combination of scatter and rectangle marks to visualize variant distribution and centromere regions.
-    - A LOESS smoothed line is included to indicate general trends for each variant type.
+    - The centromere is drawn once per facet from its own rows, not once per window.
+    - A LOESS smoothed line is included to indicate general trends for each variant type. The curves are fitted
+      per Chromosome x Type in NumPy before charting, so the renderer only draws the fitted points.
     - The generated plot uses set1 colors and is saved at a high resolution suitable for publication.
 
     Example Usage:
@@ -87,36 +135,77 @@ def Plot_TrendPerChr(df, save_name='Figure4', title="Variant Distribution from C
     >>> plot_fig4 = Plot_TrendPerChr(df, save_name='VariantTrendPlot')
     
     """
-    color_scale = alt.Scale(scheme="set1")
-    plot = alt.Chart(df,
+    x_field, y_field = x.split(':')[0], y.split(':')[0]
+    if region:
+        from store import in_region, format_region
+        df = df.filter(in_region(region, 'Chromosome', 'column_2', 'column_3', unit=10**6))
+        if trend is not None:
+            trend = trend.filter(in_region(region, 'Chromosome', x_field, unit=10**6))
+        if centromere is not None:
+            centromere = centromere.filter(in_region(region, 'Chromosome', 'Start', 'End', unit=10**6))
+        title = f'{title} ({format_region(region)})'
+    chromosomes = chromosome_levels(df['Chromosome'])
+    if trend is None:
+        trend = grouped_loess(df, x_field, y_field, ['Chromosome', 'Type'], bandwidth=bandwidth, grid_size=grid_size)
+    if export_trend and save_name:
+        export_table(trend, f'{save_name}_trend')
+
+    if centromere is None and {'Start', 'End'} <= set(df.columns):
+        centromere = df.select('Chromosome', 'Start', 'End').unique(maintain_order=True)
+        df = df.drop('Start', 'End')
+    if enrichment is None and permutations:
+        from enrichment import enrichment_test
+        enrichment = enrichment_test(df, centromere, value=y_field, by=['Type'], permutations=permutations)
+        if save_name:
+            export_table(enrichment, f'{save_name}_enrichment')
+    labels = None
+    if enrichment is not None:
+        from enrichment import enrichment_layer
+        labels = enrichment_layer(enrichment, by=['Type'] if 'Type' in enrichment.columns else None)
+    # Windows, centromeres, fitted curves and labels share one dataset (a faceted chart has a single data source)
+    data = stack_layers(points=df, centromere=centromere, trend=trend, enrichment=labels)
+
+    types = df['Type'].unique().sort().to_list()
+    # Tiles are rendered apart, so they share an explicit color domain
+    color_scale = alt.Scale(scheme="set1", domain=types) if tiles else alt.Scale(scheme="set1")
+    type_color = alt.Color('Type:N',
+                        scale=color_scale,
+                        sort=types,
+                        title=None)
+    plot = alt.Chart(data,
             title=title
             ).encode(
         x = alt.X(x,title='Position (Mbp)'),
         y = alt.Y(y,title='Percentage of Variant'),
-        color=alt.Color('Type:N',
-                        scale=color_scale,
-                        sort=df['Type'].unique().sort().to_list(),
-                        title=None)
     ).properties(
         width=300,
         height=200
     )
 
-    combined_plot = alt.layer(
-        plot.mark_circle(size=40,opacity=0.3),
-        plot.mark_rect(color='', fill='',stroke='grey', strokeWidth=1.4, strokeDash=[2, 2]).encode(x = 'Start:Q', x2 = 'End:Q', 
+    # Centromere rows have no Type, so only the window and trend layers are colored by it
+    layered = alt.layer(
+        plot.transform_filter(alt.datum.layer == 'points').mark_circle(size=40,opacity=0.3).encode(color=type_color),
+        plot.transform_filter(alt.datum.layer == 'centromere').mark_rect(color='', fill='',stroke='grey', strokeWidth=1.4, strokeDash=[2, 2]).encode(x = 'Start:Q', x2 = 'End:Q', 
                                         y=alt.value(0),  # 0 pixels from top
                                         ),
-        plot.transform_loess('column_2', 'column_4', groupby=['Type']).mark_line(size=4.5).encode(opacity = alt.value(0.75))
-    ).facet("Chromosome:N",
+        plot.transform_filter(alt.datum.layer == 'trend').mark_line(size=4.5).encode(color=type_color, opacity = alt.value(0.75)),
+        plot.transform_filter(alt.datum.layer == 'enrichment').mark_text(align='right', baseline='top', fontSize=9).encode(
+            x=alt.value(300),  # right edge of the facet
+            y=alt.value(2),
+            text='Label:N'
+        )
+    )
+    title_style = dict(fontSize=20, anchor='middle', align='left')
+    header = dict(
+        titleFontSize=16,  # Change this value to adjust the font size of the facet titles
+        labelFontSize=14   # Optional: Adjusts the label font size of each facet as well
+    )
+    combined_plot = layered.facet(alt.Facet("Chromosome:N", sort=chromosomes),
             columns = 3
     ).configure_title(
-        fontSize=20,
-        anchor='middle',
-        align='left'
+        **title_style
     ).configure_header(
-        titleFontSize=16,  # Change this value to adjust the font size of the facet titles
-        labelFontSize=14   # Optional: Adjusts the label font size of each facet as well
+        **header
     ).resolve_axis(
         x='independent',
         y='independent'
@@ -125,8 +214,13 @@ def Plot_TrendPerChr(df, save_name='Figure4', title="Variant Distribution from C
         y='independent'
     )
 
-    # save plot
-    combined_plot.save(f'{save_name}.svg', engine="vl-convert", ppi=450)
-    combined_plot.save(f'{save_name}.png', engine="vl-convert", ppi=450)
+    # save plot; None only builds the chart (used by the explorer)
+    if save_name and tiles:
+        from tiles import facet_tiles, export_facets
+        export_facets(facet_tiles(layered, data, 'Chromosome', chromosomes, title=title, legend=type_color,
+                                  title_config=title_style, header_config=header),
+                      save_name, ppi=450, columns=3, anchor=title_style['anchor'])
+    elif save_name:
+        export_chart(combined_plot, save_name, ppi=450)
 
     return combined_plot
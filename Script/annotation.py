@@ -0,0 +1,269 @@
+import os
+import gzip
+import mmap
+import argparse
+import numpy as np
+import polars as pl
+from dataset_cache import content_hash
+## -------- ##
+## GENOMIC REGION ANNOTATION ##
+# Assigns the Figure 1A region classes (the `col_14` column of Variant.bed) directly from a GFF3/GTF gene model.
+# Intervals of each class are merged into sorted, disjoint arrays on one genome-wide integer coordinate,
+# cached to disk, and queried for millions of variant positions at once with np.searchsorted.
+
+# Highest priority first; a position covered by several classes gets the first one
+REGION_PRIORITY = ['Exon', 'Lnc_RNA', 'Pseudogene', 'Intron', 'Intergene']
+GFF_COLUMNS = ['seqid', 'source', 'type', 'start', 'end', 'score', 'strand', 'phase', 'attributes']
+# Chromosome offset on the genome-wide coordinate; larger than any chromosome length
+CHROM_STRIDE = 1 << 32
+QUERY_BATCH = 5_000_000
+
+
+def _fasta_offset(data):
+    # Byte offset of a '##FASTA' line (GFF3 sequence section), or None
+    if data[:7] == b'##FASTA':
+        return 0
+    found = data.find(b'\n##FASTA')
+    return None if found < 0 else found + 1
+
+
+def _feature_source(path):
+    # The part of a gene model before any ##FASTA section: the path itself when there is none, else the bytes
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as handle:
+            data = handle.read()
+        cut = _fasta_offset(data)
+        return data if cut is None else data[:cut]
+    with open(path, 'rb') as handle:
+        if os.fstat(handle.fileno()).st_size == 0:
+            return path
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            cut = _fasta_offset(data)
+            return path if cut is None else data[:cut]
+
+
+def read_gene_model(path):
+    """
+    Function to read a GFF3 or GTF file and assign each feature to a region class.
+
+    Parameters:
+    -----------
+    path : str
+        Path to the gene model (plain or gzip-compressed). Sequences after a ##FASTA line are ignored.
+
+    Returns:
+    --------
+    polars.DataFrame
+        Columns chrom, start (0-based), end (exclusive) and region, one row per classified feature.
+    """
+    # Every column as text ('.' is common in score and phase), start and end cast explicitly; a ##FASTA section ends the features
+    gff = pl.read_csv(_feature_source(path), separator='\t', has_header=False, comment_prefix='#',
+                      schema={name: pl.Utf8 for name in GFF_COLUMNS}, quote_char=None)
+    gff = gff.with_columns(pl.col('start', 'end').cast(pl.Int64))
+    feature = pl.col('type')
+    biotype = pl.col('attributes').str.extract(r'(?:gene_biotype|transcript_biotype|gene_type|transcript_type|biotype)[= ]"?([^";]+)', 1).fill_null('')
+    is_lnc = feature.is_in(['lnc_RNA', 'lncRNA']) | (biotype == 'lncRNA')
+    is_pseudo = feature.str.contains('pseudogene') | biotype.str.contains('pseudogene')
+    region = (
+        pl.when(is_lnc).then(pl.lit('Lnc_RNA'))
+        .when(is_pseudo).then(pl.lit('Pseudogene'))
+        .when(feature.is_in(['exon', 'CDS'])).then(pl.lit('Exon'))
+        .when(feature.is_in(['gene', 'mRNA', 'transcript'])).then(pl.lit('Intron'))
+        .otherwise(None)
+    )
+    return gff.select(
+        pl.col('seqid').alias('chrom'),
+        (pl.col('start') - 1).alias('start'),
+        pl.col('end'),
+        region.alias('region'),
+    ).drop_nulls('region')
+
+
+def _merge(starts, ends):
+    # Merge overlapping intervals (already sorted by start) into disjoint ones
+    if len(starts) == 0:
+        return starts, ends
+    reach = np.maximum.accumulate(ends)
+    new_block = np.concatenate([[True], starts[1:] > reach[:-1]])
+    block = np.cumsum(new_block) - 1
+    merged_starts = starts[new_block]
+    merged_ends = np.zeros(len(merged_starts), dtype=ends.dtype)
+    np.maximum.at(merged_ends, block, ends)
+    return merged_starts, merged_ends
+
+
+class RegionIndex:
+    """
+    Array-backed index of the region classes of a gene model.
+
+    Parameters:
+    -----------
+    chroms : list of str
+        Chromosome names; their position in the list is the chromosome code.
+
+    intervals : dict
+        Mapping of region class to (starts, ends) on the genome-wide coordinate, sorted and disjoint.
+
+    Example Usage:
+    --------------
+    >>> index = RegionIndex.from_gene_model('genes.gff3.gz', cache_dir='.cache')
+    >>> annotated = annotate_variants(variants, index)
+    """
+
+    def __init__(self, chroms, intervals):
+        self.chroms = list(chroms)
+        self.codes = {c: i for i, c in enumerate(self.chroms)}
+        self.intervals = intervals
+
+    @classmethod
+    def build(cls, features):
+        chroms = features['chrom'].unique(maintain_order=True).to_list()
+        codes = {c: i for i, c in enumerate(chroms)}
+        features = features.with_columns(
+            code=pl.col('chrom').replace_strict(codes, return_dtype=pl.Int64)
+        ).with_columns(
+            g_start=pl.col('code') * CHROM_STRIDE + pl.col('start'),
+            g_end=pl.col('code') * CHROM_STRIDE + pl.col('end'),
+        ).sort('g_start')
+        intervals = {}
+        for region in REGION_PRIORITY[:-1]:
+            subset = features.filter(pl.col('region') == region)
+            intervals[region] = _merge(subset['g_start'].to_numpy(), subset['g_end'].to_numpy())
+        return cls(chroms, intervals)
+
+    @classmethod
+    def from_gene_model(cls, path, cache_dir=None):
+        """
+        Function to build the index from a GFF3/GTF, reusing an on-disk copy keyed on the file content.
+        """
+        cache_path = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            cache_path = os.path.join(cache_dir, f'regions_{content_hash(path)}.npz')
+            if os.path.exists(cache_path):
+                return cls.load(cache_path)
+        index = cls.build(read_gene_model(path))
+        if cache_path:
+            index.save(cache_path)
+        return index
+
+    def save(self, path):
+        arrays = {'chroms': np.array(self.chroms, dtype=str)}
+        for region, (starts, ends) in self.intervals.items():
+            arrays[f'{region}_starts'] = starts
+            arrays[f'{region}_ends'] = ends
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            intervals = {region: (arrays[f'{region}_starts'], arrays[f'{region}_ends']) for region in REGION_PRIORITY[:-1]}
+            return cls(arrays['chroms'].tolist(), intervals)
+
+    def classify(self, chroms, positions):
+        """
+        Function to assign the highest-priority region class to each position.
+
+        Parameters:
+        -----------
+        chroms : polars.Series
+            Chromosome of each position.
+
+        positions : array-like
+            0-based positions.
+
+        Returns:
+        --------
+        numpy.ndarray
+            Region class per position; positions on chromosomes missing from the gene model are 'Intergene'.
+        """
+        code = pl.Series(chroms).cast(pl.Utf8).replace_strict(self.codes, default=-1, return_dtype=pl.Int64).to_numpy()
+        query = code * CHROM_STRIDE + np.asarray(positions, dtype=np.int64)
+        labels = np.full(len(query), REGION_PRIORITY[-1], dtype=object)
+        assigned = code < 0
+        for region in REGION_PRIORITY[:-1]:
+            starts, ends = self.intervals[region]
+            if len(starts) == 0:
+                continue
+            idx = np.searchsorted(starts, query, side='right') - 1
+            hit = (idx >= 0) & (query < ends[np.clip(idx, 0, None)]) & ~assigned
+            labels[hit] = region
+            assigned |= hit
+        return labels
+
+
+def annotate_variants(df, index, chrom='col_1', pos='col_2', out='col_14'):
+    """
+    Function to add the region class of every variant, in batches.
+
+    Parameters:
+    -----------
+    df : polars.DataFrame
+        Variant calls with chromosome and 0-based position columns.
+
+    index : RegionIndex
+        Index built from the gene model.
+
+    chrom, pos : str, optional (default: 'col_1', 'col_2')
+        Chromosome and position columns (the Variant.bed layout).
+
+    out : str, optional (default: 'col_14')
+        Name of the region column, matching what `Fraction_plot` groups on.
+
+    Returns:
+    --------
+    polars.DataFrame
+        The input with the region column added (or replaced).
+    """
+    labels = [
+        index.classify(batch[chrom], batch[pos].to_numpy())
+        for batch in df.select(chrom, pos).iter_slices(QUERY_BATCH)
+    ]
+    values = np.concatenate(labels) if labels else np.array([], dtype=object)
+    return df.with_columns(pl.Series(out, values, dtype=pl.Utf8))
+
+
+def count_regions(df, index, by='col_8', chrom='col_1', pos='col_2', out='col_14'):
+    """
+    Function to count variants per region class and `by` group, annotating one batch at a time.
+
+    Parameters:
+    -----------
+    df : polars.DataFrame
+        Variant calls; a memory-mapped frame keeps peak memory at one batch.
+
+    index : RegionIndex
+        Index built from the gene model.
+
+    by : str, optional (default: 'col_8')
+        Second grouping column, as used on the y-axis of `Fraction_plot`.
+
+    Returns:
+    --------
+    polars.DataFrame
+        Columns `out`, `by` and Count, ready for `Fraction_plot`.
+    """
+    partials = []
+    for batch in df.select(chrom, pos, by).iter_slices(QUERY_BATCH):
+        regions = pl.Series(out, index.classify(batch[chrom], batch[pos].to_numpy()), dtype=pl.Utf8)
+        partials.append(batch.with_columns(regions).group_by(out, by).agg(Count=pl.len()))
+    if not partials:
+        return pl.DataFrame(schema={out: pl.Utf8, by: df.schema[by], 'Count': pl.UInt32})
+    return pl.concat(partials).group_by(out, by).agg(pl.col('Count').sum())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Annotate variant positions with Exon/Lnc_RNA/Pseudogene/Intron/Intergene")
+    parser.add_argument('--gene-model', required=True, help="GFF3 or GTF gene model")
+    parser.add_argument('--variants', required=True, help="Variant table with a header row (e.g. Variant.bed)")
+    parser.add_argument('--chrom-col', default='col_1')
+    parser.add_argument('--pos-col', default='col_2')
+    parser.add_argument('--output', required=True, help="Annotated table (tab-separated)")
+    parser.add_argument('--cache-dir', default='.cache', help="Directory for the cached region index")
+    args = parser.parse_args()
+
+    index = RegionIndex.from_gene_model(args.gene_model, args.cache_dir)
+    variants = pl.read_csv(args.variants, separator='\t', has_header=True)
+    annotate_variants(variants, index, args.chrom_col, args.pos_col).write_csv(args.output, separator='\t')
@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from synthetic import SCALES, ensure_dataset
+from tracing import Stage
+## -------- ##
+## PER-STAGE BENCHMARK SUITE ##
+# Times every figure on synthetic inputs in four stages -- parse (text to Arrow sidecar), transform
+# (the figure's processing function), spec (chart construction and Vega compilation, including the
+# vegafusion pre-transform) and render (SVG and PNG from the compiled spec) -- with the peak RSS of each,
+# and compares the result with a stored baseline to catch performance regressions before a production run.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ('parse', 'transform', 'spec', 'render')
+
+
+def _rows(values):
+    # Rows handed from the processing function to the plot function
+    values = values.values() if isinstance(values, dict) else values
+    return sum(len(value) for value in values if hasattr(value, 'height'))
+
+
+def bench_figure(name, data_dir, work_dir):
+    """
+    Function to run the four stages of one figure in this process and measure each.
+
+    Returns:
+    --------
+    dict
+        Mapping of stage to {'wall': seconds, 'peak_mb': peak RSS increase, 'rows': rows produced}.
+    """
+    import main
+    from dataset_cache import DatasetRegistry
+    from export import configure_export, render_spec
+    from rebuild import call_plot
+
+    # A fresh cache directory, so the parse stage always converts the text inputs
+    cache_dir = tempfile.mkdtemp(prefix='cache_', dir=work_dir)
+    main.DATA_DIR, main.CACHE_DIR, main.BUDGET, main.GRAPH = data_dir, cache_dir, None, None
+    main.REGISTRY = DatasetRegistry(cache_dir)
+    configure_export(formats=['json'], out_dir=work_dir)
+    node = main.FIGURE_GRAPH[name]
+    results = {}
+
+    with Stage(f'{name} parse', 'read') as meter:
+        for file, read_kwargs in main._unique_inputs([name]):
+            main.get_registry().sidecar(main.input_path(file), **read_kwargs)
+    results['parse'] = {'wall': meter.wall, 'peak_mb': meter.peak_mb, 'rows': None}
+
+    with Stage(f'{name} transform', 'transform') as meter:
+        processed = node.process(*node.process_args)
+    results['transform'] = {'wall': meter.wall, 'peak_mb': meter.peak_mb, 'rows': _rows(processed)}
+
+    # With only the json format enabled, the plot function stops after compiling the Vega spec
+    with Stage(f'{name} spec', 'chart') as meter:
+        call_plot(node, processed)
+    results['spec'] = {'wall': meter.wall, 'peak_mb': meter.peak_mb, 'rows': None}
+
+    base = os.path.join(work_dir, node.params.get('save_name', name))
+    with open(f'{base}.vg.json') as handle:
+        vega_spec = json.load(handle)
+    with Stage(f'{name} render', 'save') as meter:
+        render_spec(vega_spec, base, ['svg', 'png'], ppi=300)
+    results['render'] = {'wall': meter.wall, 'peak_mb': meter.peak_mb, 'rows': None}
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def run_benchmark(data_dir, figures, repeat=3, work_dir=None):
+    """
+    Function to benchmark each figure `repeat` times, every run in a fresh process.
+
+    Returns:
+    --------
+    dict
+        Mapping of figure to stage to the fastest wall time and the largest peak memory over the runs.
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix='benchmark_')
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in figures:
+        runs = []
+        for _ in range(repeat):
+            # A new process per run keeps caches and allocator state from leaking between measurements
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                runs.append(pool.submit(bench_figure, name, data_dir, work_dir).result())
+        results[name] = {
+            stage: {
+                'wall': min(run[stage]['wall'] for run in runs),
+                'peak_mb': max(run[stage]['peak_mb'] for run in runs),
+                'rows': runs[0][stage]['rows'],
+            }
+            for stage in STAGES
+        }
+        print(f"{name:<12} " + '  '.join(f"{stage} {results[name][stage]['wall']:7.3f}s" for stage in STAGES), flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2, min_seconds=0.05, min_mb=16.0):
+    """
+    Function to list the stages that got slower or used more memory than in the baseline.
+
+    Parameters:
+    -----------
+    results, baseline : dict
+        Output of `run_benchmark` (the baseline's 'results' entry).
+
+    tolerance : float, optional (default: 0.2)
+        Allowed relative increase.
+
+    min_seconds, min_mb : float, optional (default: 0.05, 16.0)
+        Absolute increases below these are treated as noise.
+
+    Returns:
+    --------
+    list of tuple
+        (figure, stage, metric, baseline value, new value) for every regression.
+    """
+    regressions = []
+    for name, stages in results.items():
+        for stage, values in stages.items():
+            old = baseline.get(name, {}).get(stage)
+            if not old:
+                continue
+            for metric, floor in (('wall', min_seconds), ('peak_mb', min_mb)):
+                if values[metric] > old[metric] * (1 + tolerance) and values[metric] - old[metric] > floor:
+                    regressions.append((name, stage, metric, old[metric], values[metric]))
+    return regressions
+
+
+def report(results, baseline=None):
+    # Summary table, with the change against the baseline when there is one
+    print(f"\n{'Figure':<12} {'Stage':<10} {'Wall (s)':>10} {'Peak (MB)':>10} {'Rows':>10} {'vs baseline':>12}")
+    for name, stages in results.items():
+        for stage in STAGES:
+            values = stages[stage]
+            old = (baseline or {}).get(name, {}).get(stage)
+            change = f"{(values['wall'] / old['wall'] - 1) * 100:+.0f}%" if old and old['wall'] else ''
+            rows = '' if values['rows'] is None else values['rows']
+            print(f"{name:<12} {stage:<10} {values['wall']:>10.3f} {values['peak_mb']:>10.1f} {rows:>10} {change:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parse, transform, spec build and render of every figure on synthetic data")
+    parser.add_argument('--scale', choices=list(SCALES), default='chromosome', help="Synthetic data scale (default: chromosome)")
+    parser.add_argument('--data-dir', default=None,
+                        help="Directory for the synthetic inputs (default: Script/.cache/synthetic/<scale>); generated only when missing")
+    parser.add_argument('--figures', default=None, help="Comma-separated figures to benchmark (default: all)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per figure; the fastest is kept (default: 3)")
+    parser.add_argument('--baseline', default=None,
+                        help="Baseline file (default: Script/benchmarks/baseline_<scale>.json)")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative slowdown before failing (default: 0.2)")
+    args = parser.parse_args()
+
+    settings = SCALES[args.scale]
+    data_dir = args.data_dir or os.path.join(BASE_DIR, '.cache', 'synthetic', args.scale)
+    print(f"Preparing {args.scale} inputs in {data_dir}")
+    ensure_dataset(data_dir, **settings)
+
+    from main import FIGURE_GRAPH
+    figures = args.figures.split(',') if args.figures else list(FIGURE_GRAPH)
+    unknown = sorted(set(figures) - set(FIGURE_GRAPH))
+    if unknown:
+        parser.error(f"Unknown figure(s): {', '.join(unknown)}")
+
+    results = run_benchmark(data_dir, figures, args.repeat)
+    baseline_path = args.baseline or os.path.join(BASE_DIR, 'benchmarks', f'baseline_{args.scale}.json')
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as handle:
+            stored = json.load(handle)
+        if stored.get('settings') == settings:
+            baseline = stored['results']
+        else:
+            print(f"Baseline {baseline_path} was recorded with different settings ({stored.get('settings')}); not comparing")
+    report(results, baseline)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, 'w') as handle:
+            json.dump({'settings': settings, 'machine': platform.node(), 'cpus': os.cpu_count(),
+                       'python': platform.python_version(), 'results': results}, handle, indent=1)
+        print(f"Saved baseline to {baseline_path}")
+
+    regressions = compare(results, baseline or {}, args.tolerance)
+    for name, stage, metric, old, new in regressions:
+        print(f"REGRESSION {name} {stage} {metric}: {old:.3f} -> {new:.3f}")
+    sys.exit(1 if regressions else 0)
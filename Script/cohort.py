@@ -0,0 +1,52 @@
+import os
+import polars as pl
+## -------- ##
+## MULTI-SAMPLE COHORT MODE ##
+# A manifest lists one data directory per individual. Every sample is rendered into its own output
+# directory; the reference tables (Genome_text.tsv, T2T-MFA8v1.0.centromere.bed) come from one shared
+# reference directory and are parsed once into sidecars that all workers memory-map read-only.
+
+REFERENCE_FILES = ('Genome_text.tsv', 'T2T-MFA8v1.0.centromere.bed')
+
+
+def read_manifest(path):
+    """
+    Function to read a cohort manifest.
+
+    Parameters:
+    -----------
+    path : str
+        Tab-separated file with a header row and the columns `sample` and `data_dir`. Relative data
+        directories are resolved against the manifest's own directory.
+
+    Returns:
+    --------
+    list of tuple
+        (sample, data_dir) for each sample, in manifest order.
+
+    Example Usage:
+    --------------
+    >>> read_manifest('cohort.tsv')
+    [('MF001', '/data/MF001'), ('MF002', '/data/MF002')]
+    """
+    manifest = pl.read_csv(path, separator='\t', has_header=True, infer_schema=False)
+    missing = {'sample', 'data_dir'} - set(manifest.columns)
+    if missing:
+        raise ValueError(f"Manifest {path} is missing column(s): {', '.join(sorted(missing))}")
+    duplicated = manifest.filter(pl.col('sample').is_duplicated())['sample'].unique().to_list()
+    if duplicated:
+        raise ValueError(f"Manifest {path} lists samples more than once: {', '.join(duplicated)}")
+
+    base = os.path.dirname(os.path.abspath(path))
+    samples = []
+    for sample, data_dir in manifest.select('sample', 'data_dir').iter_rows():
+        data_dir = data_dir if os.path.isabs(data_dir) else os.path.join(base, data_dir)
+        if not os.path.isdir(data_dir):
+            raise FileNotFoundError(f"Data directory for sample {sample} not found at {data_dir}")
+        samples.append((sample, data_dir))
+    return samples
+
+
+def sample_out_dir(out_root, sample):
+    # Per-sample outputs never land in the current working directory
+    return os.path.join(out_root, sample)
@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import hashlib
+import multiprocessing.util
+from contextlib import contextmanager
+from collections import OrderedDict, Counter
+import polars as pl
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, workers then rely on the atomic replace only
+    fcntl = None
+from streaming import scan_table
+## -------- ##
+## PARSE-ONCE DATASET REGISTRY ##
+# Every input table goes through DatasetRegistry. The first run parses the TSV/BED text once and
+# writes an uncompressed Arrow IPC sidecar; later runs memory-map the sidecar instead of re-parsing.
+# Sidecars are keyed on path, size, mtime and a content hash, so a touched but unchanged file reuses its sidecar.
+# Worker processes share the manifest: lookups only record access times and hit counts in memory, and `flush`
+# re-reads the manifest under a file lock and merges this process's entries once, at exit or before eviction.
+# Sidecars are only evicted by the driver once no worker is reading the cache.
+
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = 'manifest.lock'
+HASH_CHUNK = 1 << 20
+
+
+def content_hash(path):
+    """
+    Function to hash the content of a file in fixed-size chunks.
+
+    Parameters:
+    -----------
+    path : str
+        Path to the file.
+
+    Returns:
+    --------
+    str
+        Hex digest of the file content.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DatasetRegistry:
+    """
+    Registry that parses each input file at most once per process and caches it as an Arrow IPC sidecar.
+
+    Parameters:
+    -----------
+    cache_dir : str
+        Directory holding the sidecars and the manifest.
+
+    max_memory : int, optional (default: 2 GB)
+        Size limit in bytes for the in-process LRU of loaded frames.
+
+    max_disk : int, optional (default: 20 GB)
+        Size limit in bytes for the sidecars on disk, enforced by `evict`. The least recently used sidecars are evicted first.
+
+    stats_dir : str, optional (default: None)
+        Directory where every registry writes its hit/miss counts, so the driver can report those of its workers.
+
+    Example Usage:
+    --------------
+    >>> registry = DatasetRegistry('.cache')
+    >>> chr_map = registry.load('Data/Genome_text.tsv', has_header=False)
+    >>> registry.flush()
+    >>> registry.evict()
+    >>> registry.report()
+    """
+
+    def __init__(self, cache_dir, max_memory=2 * 1024 ** 3, max_disk=20 * 1024 ** 3, stats_dir=None):
+        self.cache_dir = cache_dir
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.stats_dir = stats_dir
+        self.frames = OrderedDict()
+        self.memory_used = 0
+        self.stats = Counter()
+        self.per_file = {}
+        self.counted = False
+        os.makedirs(cache_dir, exist_ok=True)
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+        self.manifest = self._read_manifest()
+        # Entries added by this process since the last write, merged into the manifest on disk
+        self.pending = {'files': {}, 'sidecars': {}}
+        # Runs when the process exits, including spawned pool workers, which skip atexit handlers
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    # Manifest handling
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as handle:
+                manifest = json.load(handle)
+        except (OSError, ValueError):
+            manifest = {}
+        manifest.setdefault('files', {})
+        manifest.setdefault('sidecars', {})
+        return manifest
+
+    @contextmanager
+    def _locked(self):
+        # Exclusive lock on a separate file, held while the manifest is read, merged and replaced
+        with open(os.path.join(self.cache_dir, LOCK_NAME), 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _dump_manifest(self):
+        # Write atomically so that concurrent readers never see a half-written manifest
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as handle:
+            json.dump(self.manifest, handle, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _write_manifest(self):
+        # Merge this process's entries into the current manifest, so entries written by other workers are kept
+        with self._locked():
+            manifest = self._read_manifest()
+            manifest['files'].update(self.pending['files'])
+            for name, entry in self.pending['sidecars'].items():
+                known = manifest['sidecars'].get(name)
+                if os.path.exists(os.path.join(self.cache_dir, name)) and (not known or known['last_used'] < entry['last_used']):
+                    manifest['sidecars'][name] = entry
+            self.manifest = manifest
+            self.pending = {'files': {}, 'sidecars': {}}
+            self._dump_manifest()
+
+    def fingerprint(self, path):
+        """
+        Return (path, size, mtime, content hash) for a file, re-hashing only when size or mtime changed.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        known = self.manifest['files'].get(path)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            digest = known['hash']
+        else:
+            digest = content_hash(path)
+            self.manifest['files'][path] = self.pending['files'][path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest}
+        return path, stat.st_size, stat.st_mtime_ns, digest
+
+    def _key(self, path, read_kwargs):
+        path, size, mtime_ns, digest = self.fingerprint(path)
+        options = json.dumps(read_kwargs, sort_keys=True, default=str)
+        key = hashlib.blake2b(f"{path}|{size}|{mtime_ns}|{digest}|{options}".encode(), digest_size=16).hexdigest()
+        # Sidecars are shared between paths/mtimes with identical content and read options
+        sidecar = hashlib.blake2b(f"{digest}|{options}".encode(), digest_size=16).hexdigest()
+        return key, os.path.join(self.cache_dir, f"{sidecar}.arrow")
+
+    def _count(self, path, outcome):
+        self.stats[outcome] += 1
+        self.per_file.setdefault(os.path.basename(path), Counter())[outcome] += 1
+        self.counted = True
+
+    def _touch(self, name, path, last_used=None):
+        entry = {'bytes': os.path.getsize(path), 'last_used': last_used or time.time()}
+        self.manifest['sidecars'][name] = self.pending['sidecars'][name] = entry
+
+    def flush(self):
+        """
+        Function to write the access times, fingerprints and hit/miss counts recorded since the last flush.
+
+        Lookups only update them in memory; they are written once when the process exits, before `evict` and `report`,
+        and by the driver before it starts workers so that they reuse its fingerprints.
+        """
+        if self.pending['files'] or self.pending['sidecars']:
+            self._write_manifest()
+        if self.stats_dir and self.counted:
+            # One file per registry, so the counts survive the worker
+            os.makedirs(self.stats_dir, exist_ok=True)
+            stats_path = os.path.join(self.stats_dir, f'{os.getpid()}-{id(self)}.json')
+            with open(f'{stats_path}.tmp', 'w') as handle:
+                json.dump(self.per_file, handle)
+            os.replace(f'{stats_path}.tmp', stats_path)
+            self.counted = False
+
+    def sidecar(self, path, **read_kwargs):
+        """
+        Function to return the Arrow IPC sidecar of an input file, parsing the text only when no valid sidecar exists.
+
+        Parameters:
+        -----------
+        path : str
+            Path to the TSV/BED input.
+
+        **read_kwargs :
+            Options passed to `pl.scan_csv` (e.g. has_header). They are part of the cache key.
+
+        Returns:
+        --------
+        str
+            Path to the sidecar file.
+        """
+        _, sidecar_path = self._key(path, read_kwargs)
+        name = os.path.basename(sidecar_path)
+        if os.path.exists(sidecar_path):
+            self._count(path, 'sidecar_hit')
+        else:
+            self._count(path, 'parse')
+            tmp_path = f"{sidecar_path}.{os.getpid()}.tmp"
+            try:
+                # Streaming sink keeps peak memory bounded for the large variant tables
+                scan_table(path, **read_kwargs).sink_ipc(tmp_path, compression=None)
+            except pl.exceptions.InvalidOperationError:
+                # Only plans the streaming engine cannot sink fall back to an in-memory collect
+                scan_table(path, **read_kwargs).collect().write_ipc(tmp_path, compression='uncompressed')
+            os.replace(tmp_path, sidecar_path)
+        self._touch(name, sidecar_path)
+        return sidecar_path
+
+    def scan(self, path, **read_kwargs):
+        """
+        Function to lazily scan an input through its sidecar, for queries that should stream.
+
+        Returns:
+        --------
+        polars.LazyFrame
+            A lazy frame over the memory-mapped sidecar.
+        """
+        return pl.scan_ipc(self.sidecar(path, **read_kwargs))
+
+    def load(self, path, **read_kwargs):
+        """
+        Function to load an input table, at most once per process.
+
+        Parameters:
+        -----------
+        path : str
+            Path to the TSV/BED input.
+
+        **read_kwargs :
+            Options passed to `pl.scan_csv` (e.g. has_header).
+
+        Returns:
+        --------
+        polars.DataFrame
+            The parsed table, memory-mapped from its sidecar.
+        """
+        key, _ = self._key(path, read_kwargs)
+        if key in self.frames:
+            self.frames.move_to_end(key)
+            self._count(path, 'memory_hit')
+            return self.frames[key]
+        frame = pl.read_ipc(self.sidecar(path, **read_kwargs))
+        self.frames[key] = frame
+        self.memory_used += frame.estimated_size()
+        self._evict_memory()
+        return frame
+
+    def track(self, path, last_used=None):
+        """
+        Function to account for a file derived from a sidecar (e.g. a sorted region store or a rendered tile) in the disk limit.
+
+        last_used defaults to now; pass e.g. the file's mtime for files used by other processes.
+        """
+        self._touch(os.path.relpath(path, self.cache_dir), path, last_used)
+
+    # Eviction
+    def _evict_memory(self):
+        while self.memory_used > self.max_memory and len(self.frames) > 1:
+            _, frame = self.frames.popitem(last=False)
+            self.memory_used -= frame.estimated_size()
+
+    def evict(self):
+        """
+        Function to delete the least recently used sidecars until the cache is under max_disk.
+
+        Only call it when no worker is reading the cache (in the driver, after the pool has finished): a worker may
+        have any sidecar or sorted store memory-mapped, or be about to open one it has just looked up.
+
+        Returns:
+        --------
+        list of str
+            The evicted files, relative to the cache directory.
+        """
+        self.flush()
+        evicted = []
+        with self._locked():
+            self.manifest = self._read_manifest()
+            sidecars = self.manifest['sidecars']
+            total = sum(entry['bytes'] for entry in sidecars.values())
+            for name in sorted(sidecars, key=lambda n: sidecars[n]['last_used']):
+                if total <= self.max_disk:
+                    break
+                total -= sidecars.pop(name)['bytes']
+                evicted.append(name)
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+            if evicted:
+                self._dump_manifest()
+        return evicted
+
+    def report(self):
+        """
+        Function to print the cache hit/miss report of this process and, with a stats_dir, of every worker.
+        """
+        self.flush()
+        per_file = {}
+        parts = [os.path.join(self.stats_dir, part) for part in os.listdir(self.stats_dir)
+                 if part.endswith('.json')] if self.stats_dir and os.path.isdir(self.stats_dir) else []
+        for part in parts:
+            try:
+                with open(part) as handle:
+                    counts = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            for name, outcomes in counts.items():
+                per_file.setdefault(name, Counter()).update(outcomes)
+        if not parts:
+            per_file = self.per_file
+        stats = sum(per_file.values(), Counter())
+        print("Dataset cache report:")
+        print(f"  {'File':<55}{'memory':>8}{'sidecar':>9}{'parse':>7}")
+        for name, counts in sorted(per_file.items()):
+            print(f"  {name:<55}{counts['memory_hit']:>8}{counts['sidecar_hit']:>9}{counts['parse']:>7}")
+        print(f"  Total: {stats['memory_hit']} memory hits, {stats['sidecar_hit']} sidecar hits, "
+              f"{stats['parse']} parses; {self.memory_used / (1024 ** 2):.1f} MB held in this process")
+        return dict(stats)
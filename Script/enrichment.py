@@ -0,0 +1,294 @@
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import polars as pl
+## -------- ##
+## END-TO-CENTROMERE ENRICHMENT ##
+# Figures 2 and 4 show variant density going from the chromosome ends to the centromere. This module
+# measures that pattern on the output of Data_processing_fig2 / Data_processing_fig4. Every window gets its
+# relative distance along its arm (0 at the centromere, 1 at the chromosome end). The trend is the correlation
+# of density with that distance, tested by shuffling windows within each chromosome. The permutations
+# are drawn as (permutations x windows) index matrices, so each batch is one argsort, one gather and one
+# matrix-vector product. Batches run on a thread pool because those NumPy kernels release the GIL.
+
+# Upper bound on the elements of one (permutations x windows) index matrix, ~32 MB of int64
+BATCH_ELEMENTS = 4_000_000
+# Permutations per task; strata are split into such chunks so a few large chromosomes still use every core
+CHUNK_PERMUTATIONS = 2_500
+GENOME = 'Genome'
+
+
+def relative_distance(df, centromere, pos='general_pos', chrom='Chromosome', length='Chr_length'):
+    """
+    Function to add each window's arm and its relative distance from the centromere to the chromosome end.
+
+    Parameters:
+    -----------
+    df : polars.DataFrame
+        Output of `Data_processing_fig2` or `Data_processing_fig4` (needs Dist_centromere).
+
+    centromere : polars.DataFrame
+        Output of `centromere_layer` (Chromosome, Start, End in Mbp).
+
+    pos, chrom, length : str, optional (default: 'general_pos', 'Chromosome', 'Chr_length')
+        Window position, chromosome and chromosome length columns. The length is that of Genome_text.tsv, so the
+        q arm ends at the chromosome end even when only the windows of a region are given.
+
+    Returns:
+    --------
+    polars.DataFrame
+        The input with Arm ('p', 'q' or 'cen') and Rel_centromere (0 at the centromere, 1 at the end of the arm).
+        Windows on chromosomes without a centromere get nulls.
+    """
+    labels = centromere['Chromosome'].cast(pl.Utf8).to_list()
+    starts = dict(zip(labels, centromere['Start'].to_list()))
+    ends = dict(zip(labels, centromere['End'].to_list()))
+    name = pl.col(chrom).cast(pl.Utf8)
+    cen_start = name.replace_strict(starts, default=None, return_dtype=pl.Float64)
+    cen_end = name.replace_strict(ends, default=None, return_dtype=pl.Float64)
+    arm_length = pl.when(pl.col(pos) < cen_start).then(cen_start).otherwise(pl.col(length) - cen_end)
+    return df.with_columns(
+        Arm=pl.when(cen_start.is_null()).then(None)
+            .when(pl.col(pos) < cen_start).then(pl.lit('p'))
+            .when(pl.col(pos) > cen_end).then(pl.lit('q'))
+            .otherwise(pl.lit('cen')),
+        Rel_centromere=pl.when(cen_start.is_null()).then(None)
+            .otherwise((pl.col('Dist_centromere') / arm_length).clip(0, 1)),
+    )
+
+
+def _with_distance(df, centromere, **columns):
+    if 'Rel_centromere' in df.columns:
+        return df
+    if centromere is None:
+        raise ValueError("`centromere` is required when `df` has no Rel_centromere column")
+    return relative_distance(df, centromere, **columns)
+
+
+def meta_profile(df, centromere=None, value='Percent_den', bins=20, by=None, chrom='Chromosome'):
+    """
+    Function to compute the genome-wide meta-profile of density against relative distance to the centromere.
+
+    Parameters:
+    -----------
+    df : polars.DataFrame
+        Output of `Data_processing_fig2` / `Data_processing_fig4`, or of `relative_distance`.
+
+    centromere : polars.DataFrame, optional (default: None)
+        Output of `centromere_layer`; needed when `df` has no Rel_centromere column yet.
+
+    value : str, optional (default: 'Percent_den')
+        Density column.
+
+    bins : int, optional (default: 20)
+        Number of relative-distance bins from the centromere (0) to the chromosome ends (1).
+
+    by : list of str, optional (default: None)
+        Extra grouping columns, e.g. ['Type'] for Figure 4.
+
+    Returns:
+    --------
+    polars.DataFrame
+        Per bin (and `by` group): Rel_start, Rel_end, Windows, Mean, SD, Expected and Enrichment (Mean / Expected).
+        Expected is the exact mean of the bin under shuffling within chromosomes: the mean of each window's chromosome mean.
+
+    Example Usage:
+    --------------
+    >>> profile = meta_profile(processed_df_fig2, centromere_layer(centromere_df), bins=20)
+    """
+    by = list(by or [])
+    df = _with_distance(df, centromere).drop_nulls(['Rel_centromere', value])
+    return df.with_columns(
+        Bin=(pl.col('Rel_centromere') * bins).floor().clip(0, bins - 1).cast(pl.UInt32),
+        Expected=pl.col(value).mean().over(chrom, *by),
+    ).group_by(*by, 'Bin').agg(
+        Windows=pl.len(),
+        Mean=pl.col(value).mean(),
+        SD=pl.col(value).std(),
+        Expected=pl.col('Expected').mean(),
+    ).with_columns(
+        Rel_start=pl.col('Bin') / bins,
+        Rel_end=(pl.col('Bin') + 1) / bins,
+        Enrichment=pl.col('Mean') / pl.col('Expected'),
+    ).sort(*by, 'Bin')
+
+
+def _null_sums(x, r, permutations, seed):
+    # x[perm] @ r for `permutations` random permutations, in batches of at most BATCH_ELEMENTS indices
+    rng = np.random.default_rng(seed)
+    n = len(x)
+    batch = max(1, BATCH_ELEMENTS // max(n, 1))
+    sums = np.empty(permutations)
+    for low in range(0, permutations, batch):
+        size = min(batch, permutations - low)
+        order = np.argsort(rng.random((size, n)), axis=1)
+        sums[low:low + size] = np.take(x, order) @ r
+    return sums
+
+
+def _p_value(observed, null):
+    # Two-sided permutation p-value, counting the observed arrangement as one of the permutations
+    return (1 + np.count_nonzero(np.abs(null) >= np.abs(observed) * (1 - 1e-12))) / (len(null) + 1)
+
+
+def _bh(p_values):
+    # Benjamini-Hochberg adjusted p-values
+    p = np.asarray(p_values, dtype=float)
+    if len(p) == 0:
+        return p
+    order = np.argsort(p)
+    ranked = p[order] * len(p) / np.arange(1, len(p) + 1)
+    adjusted = np.empty_like(p)
+    adjusted[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1)
+    return adjusted
+
+
+def enrichment_test(df, centromere=None, value='Percent_den', by=None, permutations=10_000, seed=0, n_jobs=None,
+                    chrom='Chromosome'):
+    """
+    Function to test the end-to-centromere density trend per chromosome and genome-wide by permutation.
+
+    The statistic is the correlation between density and relative distance from the centromere (positive: density
+    rises towards the chromosome ends). The null shuffles the densities among the windows of each chromosome,
+    keeping each chromosome's density distribution. The genome-wide statistic pools the within-chromosome
+    covariances, and its null adds up the per-chromosome nulls of the same permutation.
+
+    Parameters:
+    -----------
+    df : polars.DataFrame
+        Output of `Data_processing_fig2` / `Data_processing_fig4`, or of `relative_distance`.
+
+    centromere : polars.DataFrame, optional (default: None)
+        Output of `centromere_layer`; needed when `df` has no Rel_centromere column yet.
+
+    value : str, optional (default: 'Percent_den')
+        Density column.
+
+    by : list of str, optional (default: None)
+        Extra grouping columns tested separately, e.g. ['Type'] for Figure 4.
+
+    permutations : int, optional (default: 10000)
+        Number of shuffles per chromosome.
+
+    seed : int, optional (default: 0)
+        Seed; the result does not depend on `n_jobs`.
+
+    n_jobs : int, optional (default: None)
+        Number of threads. None uses every CPU.
+
+    Returns:
+    --------
+    polars.DataFrame
+        One row per chromosome (and `by` group) plus a genome-wide row (Chromosome 'Genome') per group:
+        Windows, Correlation, Z_score, P_value, Q_value (Benjamini-Hochberg over the chromosomes) and Permutations.
+
+    Example Usage:
+    --------------
+    >>> stats = enrichment_test(processed_df_fig2, centromere_layer(centromere_df), permutations=10_000)
+    >>> stats.filter(pl.col('Chromosome') == 'Genome')
+    """
+    if permutations < 1:
+        raise ValueError(f"permutations must be at least 1, got {permutations}")
+    by = list(by or [])
+    df = _with_distance(df, centromere).drop_nulls(['Rel_centromere', value])
+    groups = df.select(*by, chrom, 'Rel_centromere', value).partition_by([*by, chrom], as_dict=True, maintain_order=True)
+
+    strata = []
+    for key, group in groups.items():
+        if group.height < 3:
+            continue
+        x = group[value].cast(pl.Float64).to_numpy().copy()
+        r = group['Rel_centromere'].to_numpy().astype(np.float64)
+        x -= x.mean()
+        r -= r.mean()
+        strata.append((tuple(key), x, r))
+
+    tasks = [(index, low, min(low + CHUNK_PERMUTATIONS, permutations))
+             for index in range(len(strata)) for low in range(0, permutations, CHUNK_PERMUTATIONS)]
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    null = np.empty((len(strata), permutations))
+
+    def run(task, task_seed):
+        index, low, high = task
+        null[index, low:high] = _null_sums(strata[index][1], strata[index][2], high - low, task_seed)
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as pool:
+        list(pool.map(run, tasks, seeds))
+
+    def summarize(observed, sxx, srr, sums):
+        scale = np.sqrt(sxx * srr)
+        spread = sums.std()
+        return {
+            'Correlation': observed / scale if scale > 0 else np.nan,
+            'Z_score': (observed - sums.mean()) / spread if spread > 0 else np.nan,
+            'P_value': _p_value(observed, sums) if scale > 0 else np.nan,
+        }
+
+    rows, pooled = [], {}
+    for index, (key, x, r) in enumerate(strata):
+        observed, sxx, srr = x @ r, x @ x, r @ r
+        rows.append({**dict(zip([*by, chrom], key)), 'Windows': len(x), **summarize(observed, sxx, srr, null[index])})
+        totals = pooled.setdefault(key[:-1], {'observed': 0.0, 'sxx': 0.0, 'srr': 0.0, 'windows': 0, 'members': []})
+        totals['observed'] += observed
+        totals['sxx'] += sxx
+        totals['srr'] += srr
+        totals['windows'] += len(x)
+        totals['members'].append(index)
+
+    for group_key, totals in pooled.items():
+        # Chromosome rows come first and share their index with the strata
+        members = [rows[index] for index in totals['members']]
+        for row, q in zip(members, _bh([row['P_value'] for row in members])):
+            row['Q_value'] = q
+        rows.append({**dict(zip(by, group_key)), chrom: GENOME, 'Windows': totals['windows'], 'Q_value': None,
+                     **summarize(totals['observed'], totals['sxx'], totals['srr'], null[totals['members']].sum(axis=0))})
+
+    schema = {**{col: pl.Utf8 for col in [*by, chrom]}, 'Windows': pl.UInt32, 'Correlation': pl.Float64,
+              'Z_score': pl.Float64, 'P_value': pl.Float64, 'Q_value': pl.Float64}
+    stats = pl.DataFrame([{**row, **{col: str(row[col]) for col in [*by, chrom]}} for row in rows], schema=schema)
+    return stats.with_columns(Permutations=pl.lit(permutations, dtype=pl.UInt32))
+
+
+def enrichment_layer(stats, chrom='Chromosome', by=None):
+    """
+    Function to turn `enrichment_test` output into one label per chromosome, for the facets of Figures 2 and 4.
+
+    Returns:
+    --------
+    polars.DataFrame
+        Columns Chromosome and Label, e.g. 'r=0.42 p=0.0001' (one 'TYPE r=.. p=..' entry per group when `by` is given).
+    """
+    by = list(by or [])
+    entry = pl.format('r={} p={}', pl.col('Correlation').round(2), pl.col('P_value').round(4))
+    if by:
+        entry = pl.concat_str([*[pl.col(col) for col in by], entry], separator=' ')
+    return stats.filter(pl.col(chrom) != GENOME).group_by(chrom, maintain_order=True).agg(
+        Label=entry.str.join('; ')
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Meta-profile and permutation test of the end-to-centromere variant density trend")
+    parser.add_argument('--figure', choices=['2', '4'], default='2', help="Data of Figure 2 (500Kb variant windows) or Figure 4 (SV windows)")
+    parser.add_argument('--data-dir', default=None, help="Directory with the input tables (default: Script/Data)")
+    parser.add_argument('--permutations', type=int, default=10_000, help="Shuffles per chromosome (default: 10000)")
+    parser.add_argument('--bins', type=int, default=20, help="Relative-distance bins of the meta-profile (default: 20)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out-prefix', default=None, help="Prefix of the output tables (default: Figure<N>_enrichment)")
+    args = parser.parse_args()
+
+    import time
+    import main
+    main.DATA_DIR = args.data_dir or main.DATA_DIR
+    processed = main.process_figure2() if args.figure == '2' else main.process_figure4()
+    value, by = ('Percent_den', None) if args.figure == '2' else ('column_4', ['Type'])
+    df = relative_distance(processed['df'], processed['centromere'])
+    began = time.perf_counter()
+    stats = enrichment_test(df, value=value, by=by, permutations=args.permutations, seed=args.seed)
+    print(f"{args.permutations} permutations in {time.perf_counter() - began:.2f} s")
+    prefix = args.out_prefix or f'Figure{args.figure}_enrichment'
+    stats.write_csv(f'{prefix}.tsv', separator='\t')
+    meta_profile(df, value=value, bins=args.bins, by=by).write_csv(f'{prefix}_profile.tsv', separator='\t')
+    with pl.Config(tbl_rows=-1):
+        print(stats.filter(pl.col('Chromosome') == GENOME))
@@ -0,0 +1,481 @@
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+import threading
+import webbrowser
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import polars as pl
+import main
+from export import compile_chart, _renderer
+from rebuild import resolve
+from schemas import chromosome_levels
+## -------- ##
+## INTERACTIVE EXPLORER ##
+# A local web page for browsing Plot_VarChr (Figure 1B, S1A, S1B), Plot_VarPerChr (Figure 2) and
+# Plot_TrendPerChr (Figure 4). The processed polars frames stay in this process: every pan, zoom or
+# chromosome selection is a request that filters them to the visible chromosomes and range, builds the
+# figure's own chart and compiles it through the vegafusion runtime, so binning and aggregation run here
+# and the browser only receives the rows of the current view.
+
+# Chromosome and position column of the processed frame of each figure, and the unit of the position (per Mbp)
+VIEWS = {
+    'Figure1B': {'chromosome': 'column_3_right', 'position': 'column_2', 'scale': 10**6},
+    'Figure_S1A': {'chromosome': 'column_3_right', 'position': 'column_2', 'scale': 10**6},
+    'Figure_S1B': {'chromosome': 'column_3_right', 'position': 'column_2', 'scale': 10**6},
+    'Figure2': {'chromosome': 'Chromosome', 'position': 'general_pos', 'scale': 1},
+    'Figure4': {'chromosome': 'Chromosome', 'position': 'column_2', 'scale': 1},
+}
+DENSITY_MODES = ('auto', 'points', 'histogram', 'quantile')
+# In 'auto' mode Plot_VarChr draws single windows up to this many, and density bins above it
+MAX_POINTS = 20_000
+SPEC_CACHE_SIZE = 64
+VEGA_EMBED_URL = 'https://cdn.jsdelivr.net/npm/vega-embed@6/+esm'
+
+
+def _region(chromosome, position, chromosomes=None, start=None, end=None, scale=1):
+    # Filter expression for the selected chromosomes and the [start, end] range in Mbp
+    keep = pl.lit(True)
+    if chromosomes:
+        keep &= pl.col(chromosome).cast(pl.Utf8).is_in(list(chromosomes))
+    if start is not None:
+        keep &= pl.col(position) >= start * scale
+    if end is not None:
+        keep &= pl.col(position) <= end * scale
+    return keep
+
+
+class Explorer:
+    """
+    Server-side state of the explorer: the processed frames of each figure and a cache of compiled views.
+
+    Parameters:
+    -----------
+    figures : list of str
+        Figures to offer, any of the keys of VIEWS.
+
+    cache_size : int, optional (default: 64)
+        Number of compiled views kept, so going back to a previous view is immediate.
+
+    Example Usage:
+    --------------
+    >>> explorer = Explorer(['Figure2', 'Figure4'])
+    >>> view = explorer.spec('Figure2', chromosomes=['chr7'], start=40, end=60)
+    >>> view['rows'], view['spec']['$schema']
+    """
+
+    def __init__(self, figures, cache_size=SPEC_CACHE_SIZE):
+        unknown = sorted(set(figures) - set(VIEWS))
+        if unknown:
+            raise ValueError(f"No explorer view for {', '.join(unknown)}. Choose from {', '.join(VIEWS)}")
+        self.figures = list(figures)
+        self.cache_size = cache_size
+        self._data = {}
+        self._specs = OrderedDict()
+        self._script = None
+        self._lock = threading.Lock()
+
+    def data(self, name):
+        """
+        Function to return the plot arguments of a figure, processing its inputs on first use.
+        """
+        if name not in self.figures:
+            raise ValueError(f"Unknown figure '{name}'. Choose from {', '.join(self.figures)}")
+        with self._lock:
+            if name not in self._data:
+                self._data[name] = self._load(name)
+            return self._data[name]
+
+    def _load(self, name):
+        node = main.FIGURE_GRAPH[name]
+        processed = resolve(node.process)(*node.process_args)
+        if not isinstance(processed, dict):
+            processed = dict(zip(('df', 'sorted_value'), processed))
+        if name == 'Figure4':
+            from loess import grouped_loess
+            # Fitted once on every window, so zooming in filters the curves instead of refitting them on the visible part
+            processed['trend'] = grouped_loess(processed['df'], 'column_2', 'column_4', ['Chromosome', 'Type'],
+                                               bandwidth=node.params.get('bandwidth') or 0.3, grid_size=node.params.get('grid_size'))
+        return processed
+
+    def chromosomes(self, name):
+        """
+        Function to list the chromosomes of a figure with their lengths (Mbp), in plotting order.
+        """
+        layout, df = VIEWS[name], self.data(name)['df']
+        lengths = df.group_by(layout['chromosome']).agg(pl.col(layout['position']).max() / layout['scale'])
+        lengths = dict(zip(lengths[layout['chromosome']].cast(pl.Utf8).to_list(), lengths[layout['position']].to_list()))
+        order = chromosome_levels(df[layout['chromosome']])
+        return [{'name': chrom, 'length': lengths[chrom]} for chrom in order if chrom in lengths]
+
+    def chart(self, name, chromosomes=None, start=None, end=None, mode='auto', bins=200):
+        """
+        Function to build the figure's chart for one view.
+
+        Parameters:
+        -----------
+        name : str
+            Figure name, e.g. 'Figure2'.
+
+        chromosomes : list of str, optional (default: None)
+            Chromosomes to show. None shows all of them.
+
+        start, end : float, optional (default: None)
+            Visible range on every shown chromosome, in Mbp.
+
+        mode : str, optional (default: 'auto')
+            Density mode of Plot_VarChr; 'auto' draws single windows when at most MAX_POINTS are visible
+            and density bins otherwise. Ignored by the other figures.
+
+        bins : int, optional (default: 200)
+            Density bins per chromosome in 'histogram' mode.
+
+        Returns:
+        --------
+        (altair.Chart, int)
+            The chart and the number of windows in view.
+        """
+        if mode not in DENSITY_MODES:
+            raise ValueError(f"Unknown mode '{mode}'. Choose from {', '.join(DENSITY_MODES)}")
+        layout, node = VIEWS[name], main.FIGURE_GRAPH[name]
+        args = dict(self.data(name))
+        args['df'] = args['df'].filter(_region(layout['chromosome'], layout['position'], chromosomes, start, end, layout['scale']))
+        if chromosomes and 'sorted_value' in args:
+            args['sorted_value'] = [chrom for chrom in args['sorted_value'] if chrom in chromosomes]
+        if args.get('centromere') is not None:
+            centromere = args['centromere'].filter(_region('Chromosome', 'End', chromosomes, start, None))
+            args['centromere'] = centromere.filter(pl.col('Start') <= end) if end is not None else centromere
+        if args.get('trend') is not None:
+            args['trend'] = args['trend'].filter(_region('Chromosome', 'column_2', chromosomes, start, end))
+
+        params = {key: value for key, value in node.params.items() if key not in ('bandwidth', 'grid_size', 'export_trend', 'mode', 'permutations')}
+        params['save_name'] = None
+        if layout['chromosome'] == 'column_3_right':
+            params['mode'] = ('points' if args['df'].height <= MAX_POINTS else 'histogram') if mode == 'auto' else mode
+            params['bins'] = bins
+        return resolve(node.plot)(**args, **params), args['df'].height
+
+    def spec(self, name, chromosomes=None, start=None, end=None, mode='auto', bins=200):
+        """
+        Function to compile one view to a Vega spec with its data pre-transformed by vegafusion.
+
+        Returns:
+        --------
+        dict
+            'spec' (the Vega spec), 'rows' (data rows sent to the browser), 'windows' (windows in view)
+            and 'seconds' (build time; 0 when the view came from the cache).
+        """
+        chromosomes = tuple(chromosomes or ())
+        # Millibase rounding, so panning back and forth hits the cache
+        start = None if start is None else round(max(start, 0.0), 3)
+        end = None if end is None else round(end, 3)
+        if start is not None and end is not None and end <= start:
+            raise ValueError(f"End ({end}) must be larger than start ({start})")
+        key = (name, chromosomes, start, end, mode, bins)
+        with self._lock:
+            if key in self._specs:
+                self._specs.move_to_end(key)
+                return {**self._specs[key], 'seconds': 0.0}
+
+        began = time.perf_counter()
+        chart, windows = self.chart(name, chromosomes, start, end, mode, bins)
+        spec = compile_chart(chart)
+        rows = sum(len(data['values']) for data in spec.get('data', []) if isinstance(data.get('values'), list))
+        view = {'spec': spec, 'rows': rows, 'windows': windows, 'seconds': time.perf_counter() - began}
+        with self._lock:
+            self._specs[key] = view
+            while len(self._specs) > self.cache_size:
+                self._specs.popitem(last=False)
+        return view
+
+    def script(self):
+        # vega-embed bundled by vl-convert (works offline); older vl-convert releases load it from the CDN
+        if self._script is None:
+            bundle = getattr(_renderer(), 'javascript_bundle', None)
+            self._script = bundle(APP_JS) if bundle else f'import vegaEmbed from "{VEGA_EMBED_URL}";\n{APP_JS}'
+        return self._script
+
+    def preload(self):
+        # Process every figure in the background so the first view of each is fast
+        def run():
+            for name in self.figures:
+                try:
+                    self.data(name)
+                except Exception as error:
+                    print(f"Could not load {name}: {error}", file=sys.stderr)
+        threading.Thread(target=run, daemon=True).start()
+
+
+def parse_view(query):
+    """
+    Function to turn the query string of a /spec request into `Explorer.spec` arguments.
+    """
+    if 'figure' not in query:
+        raise ValueError("Missing 'figure' parameter")
+    chromosomes = [chrom for chrom in query.get('chromosomes', '').split(',') if chrom]
+    start = float(query['start']) if query.get('start') else None
+    end = float(query['end']) if query.get('end') else None
+    return {'name': query['figure'], 'chromosomes': chromosomes, 'start': start, 'end': end,
+            'mode': query.get('mode', 'auto'), 'bins': int(query.get('bins', 200))}
+
+
+class ExplorerHandler(BaseHTTPRequestHandler):
+    explorer = None
+    verbose = False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path in ('/', '/index.html'):
+                self._send(PAGE.encode(), 'text/html; charset=utf-8')
+            elif url.path == '/app.js':
+                self._send(self.explorer.script().encode(), 'application/javascript; charset=utf-8')
+            elif url.path == '/figures':
+                self._json([{'name': name, 'title': main.FIGURE_GRAPH[name].params.get('title', name),
+                             'modes': VIEWS[name]['chromosome'] == 'column_3_right'} for name in self.explorer.figures])
+            elif url.path == '/chromosomes':
+                self._json(self.explorer.chromosomes(query.get('figure', '')))
+            elif url.path == '/spec':
+                self._json(self.explorer.spec(**parse_view(query)))
+            else:
+                self._json({'error': f"Not found: {url.path}"}, status=404)
+        except (KeyError, ValueError) as error:
+            self._json({'error': str(error)}, status=400)
+
+    def _json(self, payload, status=200):
+        self._send(json.dumps(payload, default=str).encode(), 'application/json', status)
+
+    def _send(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if len(body) > 1024 and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def serve(explorer, host='127.0.0.1', port=8050, verbose=False):
+    """
+    Function to serve the explorer until interrupted.
+
+    Example Usage:
+    --------------
+    >>> serve(Explorer(['Figure1B', 'Figure2', 'Figure4']), port=8050)
+    """
+    handler = type('Handler', (ExplorerHandler,), {'explorer': explorer, 'verbose': verbose})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Explorer running on http://{host}:{server.server_port} (Ctrl+C to stop)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return server
+
+
+PAGE = """<!doctype html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>MF_Analysis explorer</title>
+<style>
+  body { font-family: sans-serif; margin: 1em; }
+  #controls { display: flex; flex-wrap: wrap; gap: 0.8em; align-items: end; }
+  #chromosomes { display: flex; flex-wrap: wrap; gap: 0.2em 0.8em; margin-top: 0.6em; max-width: 70em; }
+  #status { color: #666; margin-top: 0.6em; }
+  #chart { margin-top: 0.6em; cursor: grab; user-select: none; }
+</style>
+</head>
+<body>
+<div id="controls">
+  <label>Figure <select id="figure"></select></label>
+  <label>Mode <select id="mode"><option>auto</option><option>points</option><option>histogram</option><option>quantile</option></select></label>
+  <label>Start (Mbp) <input id="start" type="number" step="any" min="0" style="width: 7em"></label>
+  <label>End (Mbp) <input id="end" type="number" step="any" min="0" style="width: 7em"></label>
+  <button id="left" title="Pan left (&larr;)">&#9664;</button>
+  <button id="zoom-in" title="Zoom in (+)">+</button>
+  <button id="zoom-out" title="Zoom out (-)">&minus;</button>
+  <button id="right" title="Pan right (&rarr;)">&#9654;</button>
+  <button id="reset">Reset</button>
+</div>
+<div id="chromosomes"></div>
+<div id="status"></div>
+<div id="chart"></div>
+<script type="module" src="app.js"></script>
+</body>
+</html>
+"""
+
+# Runs with `vegaEmbed` in scope (see Explorer.script)
+APP_JS = """
+const $ = (id) => document.getElementById(id);
+const state = {figure: null, chromosomes: new Set(), start: null, end: null, mode: 'auto'};
+let lengths = new Map(), view = null, latest = 0, timer = null, dragFrom = null;
+
+async function getJSON(url) {
+  const response = await fetch(url);
+  const body = await response.json();
+  if (!response.ok) throw new Error(body.error || response.statusText);
+  return body;
+}
+
+function schedule(delay = 150) {
+  // Wheel and key repeats are coalesced into one request
+  clearTimeout(timer);
+  timer = setTimeout(render, delay);
+}
+
+async function render() {
+  const request = ++latest;
+  const query = new URLSearchParams({figure: state.figure, mode: state.mode});
+  if (state.chromosomes.size) query.set('chromosomes', [...state.chromosomes].join(','));
+  if (state.start !== null) query.set('start', state.start.toFixed(3));
+  if (state.end !== null) query.set('end', state.end.toFixed(3));
+  $('status').textContent = 'Loading...';
+  try {
+    const body = await getJSON('spec?' + query);
+    if (request !== latest) return;  // a newer view was requested meanwhile
+    if (view) view.finalize();
+    view = (await vegaEmbed('#chart', body.spec, {mode: 'vega', actions: false, renderer: 'canvas'})).view;
+    const built = body.seconds ? `built in ${body.seconds.toFixed(2)} s` : 'cached';
+    $('status').textContent = `${body.windows.toLocaleString()} windows in view, ${body.rows.toLocaleString()} rows sent, ${built}`;
+  } catch (error) {
+    if (request === latest) $('status').textContent = error.message;
+  }
+}
+
+function extent() {
+  const shown = [...lengths].filter(([name]) => !state.chromosomes.size || state.chromosomes.has(name));
+  return [state.start ?? 0, state.end ?? Math.max(0, ...shown.map(([, length]) => length))];
+}
+
+function setRange(start, end) {
+  state.start = Math.max(0, start);
+  state.end = state.start + (end - start);
+  $('start').value = state.start.toFixed(3);
+  $('end').value = state.end.toFixed(3);
+  schedule();
+}
+
+function zoom(factor) {
+  const [low, high] = extent();
+  const center = (low + high) / 2, half = (high - low) * factor / 2;
+  setRange(center - half, center + half);
+}
+
+function pan(fraction) {
+  const [low, high] = extent();
+  const shift = Math.max((high - low) * fraction, -low);
+  setRange(low + shift, high + shift);
+}
+
+function resetRange() {
+  state.start = state.end = null;
+  $('start').value = $('end').value = '';
+}
+
+async function selectFigure(name, modes) {
+  state.figure = name;
+  state.chromosomes.clear();
+  resetRange();
+  $('mode').disabled = !modes;
+  const chromosomes = await getJSON('chromosomes?figure=' + encodeURIComponent(name));
+  lengths = new Map(chromosomes.map((chrom) => [chrom.name, chrom.length]));
+  $('chromosomes').replaceChildren(...chromosomes.map((chrom) => {
+    const label = document.createElement('label');
+    const box = document.createElement('input');
+    box.type = 'checkbox';
+    box.onchange = () => {
+      box.checked ? state.chromosomes.add(chrom.name) : state.chromosomes.delete(chrom.name);
+      schedule(0);
+    };
+    label.append(box, ' ' + chrom.name);
+    return label;
+  }));
+  schedule(0);
+}
+
+async function init() {
+  const figures = await getJSON('figures');
+  $('figure').replaceChildren(...figures.map((figure) => new Option(`${figure.name}: ${figure.title}`, figure.name)));
+  $('figure').onchange = () => {
+    const figure = figures.find((item) => item.name === $('figure').value);
+    selectFigure(figure.name, figure.modes);
+  };
+  $('mode').onchange = () => { state.mode = $('mode').value; schedule(0); };
+  $('start').onchange = $('end').onchange = () => {
+    state.start = $('start').value === '' ? null : Number($('start').value);
+    state.end = $('end').value === '' ? null : Number($('end').value);
+    schedule(0);
+  };
+  $('zoom-in').onclick = () => zoom(0.5);
+  $('zoom-out').onclick = () => zoom(2);
+  $('left').onclick = () => pan(-0.25);
+  $('right').onclick = () => pan(0.25);
+  $('reset').onclick = () => { resetRange(); schedule(0); };
+
+  const chart = $('chart');
+  chart.addEventListener('wheel', (event) => { event.preventDefault(); zoom(event.deltaY < 0 ? 0.8 : 1.25); }, {passive: false});
+  chart.addEventListener('pointerdown', (event) => { dragFrom = event.clientX; });
+  window.addEventListener('pointerup', (event) => {
+    if (dragFrom !== null && Math.abs(event.clientX - dragFrom) > 4) pan((dragFrom - event.clientX) / Math.max(chart.clientWidth, 1));
+    dragFrom = null;
+  });
+  window.addEventListener('keydown', (event) => {
+    if (event.target.tagName === 'INPUT') return;
+    const actions = {'ArrowLeft': () => pan(-0.1), 'ArrowRight': () => pan(0.1), '+': () => zoom(0.8), '=': () => zoom(0.8), '-': () => zoom(1.25)};
+    if (actions[event.key]) actions[event.key]();
+  });
+  if (figures.length) selectFigure(figures[0].name, figures[0].modes);
+}
+
+init();
+"""
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Browse Figures 1B, S1, 2 and 4 interactively in a local web page")
+    parser.add_argument('--figures', default=None,
+                        help="Figures to offer, e.g. '1B,2' (default: Figure1B, Figure_S1A, Figure_S1B, Figure2, Figure4)")
+    parser.add_argument('--data-dir', default=None, help="Directory with the input tables (default: Script/Data)")
+    parser.add_argument('--reference-dir', default=None,
+                        help="Directory with Genome_text.tsv and the centromere BED (default: the data directory)")
+    parser.add_argument('--cache-dir', default=None, help="Directory for the Arrow sidecars (default: Script/.cache)")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8050, help="Port to listen on; 0 picks a free one (default: 8050)")
+    parser.add_argument('--open', action='store_true', help="Open the page in the default browser")
+    parser.add_argument('--verbose', action='store_true', help="Log every request")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main.DATA_DIR = args.data_dir or main.DATA_DIR
+    main.CACHE_DIR = args.cache_dir or main.CACHE_DIR
+    main.REFERENCE_DIR = args.reference_dir
+    if not os.path.isdir(main.DATA_DIR):
+        sys.exit(f"Data directory not found: {main.DATA_DIR}")
+    try:
+        figures = [name for name in main.select_figures(args.figures) if name in VIEWS]
+    except ValueError as error:
+        sys.exit(str(error))
+    if not figures:
+        sys.exit(f"None of the selected figures can be explored; choose from {', '.join(VIEWS)}")
+
+    explorer = Explorer(figures)
+    explorer.preload()
+    if args.open:
+        threading.Timer(1.0, webbrowser.open, (f"http://{args.host}:{args.port}/",)).start()
+    serve(explorer, args.host, args.port, args.verbose)
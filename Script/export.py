@@ -0,0 +1,325 @@
+import os
+import re
+import json
+from tracing import stage
+## -------- ##
+## SHARED EXPORT LAYER ##
+# `chart.save()` re-serializes the data, re-runs the vegafusion pre-transform and re-compiles the
+# Vega-Lite spec for every file it writes. export_chart compiles once and renders every format
+# from that single Vega spec; PNG and PDF are converted from the already rendered SVG.
+# vl-convert and the vegafusion data transformer are loaded on the first export, not at import.
+# Before compiling, each dataset of the chart is cut down to the columns its encodings and transforms
+# reference and handed over as an Arrow table at minimal numeric widths.
+
+EXPORT_SETTINGS = {
+    'formats': ['svg', 'png'],  # any of svg, png, pdf, json (the compiled Vega spec)
+    'ppi': None,                # None keeps each figure's own resolution
+    'out_dir': '.',
+    'tile_workers': None,       # processes for per-facet tile rendering (tiles.py); None uses one per CPU
+    'tile_cache': None,         # directory of rendered tiles; None disables the cache
+}
+SUPPORTED_FORMATS = ('svg', 'png', 'pdf', 'json')
+_RENDERER = None
+# 'Percent_den:Q', 'mean(column_4):Q' -> the field name
+_SHORTHAND = re.compile(r'^\s*(?:[A-Za-z]\w*\()?\s*([^:()]+?)\s*\)?\s*(?::[A-Za-z]+)?\s*$')
+# datum.layer, datum['Start'] in filter / calculate expressions
+_DATUM = re.compile(r'datum\.([A-Za-z_]\w*)|datum\[\s*[\'"]([^\'"]+)[\'"]\s*\]')
+_COMPOSITE = ('layer', 'hconcat', 'vconcat', 'concat')
+
+
+def _renderer():
+    # Initialize vegafusion and vl-convert once, when the first chart is about to be saved
+    global _RENDERER
+    if _RENDERER is None:
+        import altair as alt
+        import vl_convert
+        alt.data_transformers.enable("vegafusion")
+        _RENDERER = vl_convert
+    return _RENDERER
+
+
+def configure_export(formats=None, ppi=None, out_dir=None, tile_workers=None, tile_cache=None):
+    """
+    Function to set the export options for this run.
+
+    Parameters:
+    -----------
+    formats : list of str or str, optional (default: None)
+        Output formats, e.g. ['svg', 'png'] or 'svg,png,pdf'. None keeps the current setting.
+
+    ppi : float, optional (default: None)
+        Resolution applied to every figure. None keeps each figure's own ppi.
+
+    out_dir : str, optional (default: None)
+        Directory the figures are written to. None keeps the current setting.
+
+    tile_workers : int, optional (default: None)
+        Processes rendering the facet tiles of a figure (see tiles.py). None keeps the current setting.
+
+    tile_cache : str, optional (default: None)
+        Directory caching the rendered facet tiles. None keeps the current setting.
+
+    Returns:
+    --------
+    dict
+        The export settings in effect.
+    """
+    if formats is not None:
+        if isinstance(formats, str):
+            formats = [f.strip().lower() for f in formats.split(',') if f.strip()]
+        unknown = sorted(set(formats) - set(SUPPORTED_FORMATS))
+        if unknown:
+            raise ValueError(f"Unsupported export format(s): {', '.join(unknown)}. Choose from {', '.join(SUPPORTED_FORMATS)}")
+        EXPORT_SETTINGS['formats'] = list(formats)
+    if ppi is not None:
+        EXPORT_SETTINGS['ppi'] = ppi
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+        EXPORT_SETTINGS['out_dir'] = out_dir
+    if tile_workers is not None:
+        EXPORT_SETTINGS['tile_workers'] = tile_workers
+    if tile_cache is not None:
+        EXPORT_SETTINGS['tile_cache'] = tile_cache
+    return dict(EXPORT_SETTINGS)
+
+
+def chart_fields(chart):
+    """
+    Function to collect the names a chart (and every chart nested in it) may read from its data.
+
+    Parameters:
+    -----------
+    chart : altair.Chart
+        Any Altair chart or part of one.
+
+    Returns:
+    --------
+    set of str
+        Encoding fields (from shorthands and field definitions), fields named in transforms and `datum`
+        references in expressions. Other strings of the spec are included too, so the set errs on the side
+        of keeping a column.
+    """
+    fields = set()
+
+    def walk(obj):
+        if isinstance(obj, str):
+            fields.add(obj)
+            shorthand = _SHORTHAND.match(obj)
+            if shorthand:
+                fields.add(shorthand.group(1))
+            fields.update(name for match in _DATUM.findall(obj) for name in match if name)
+        elif isinstance(obj, dict):
+            for key, value in obj.items():
+                if key != 'data':
+                    walk(value)
+        elif isinstance(obj, (list, tuple)):
+            for value in obj:
+                walk(value)
+        elif type(obj).__module__.startswith('altair.expr'):
+            # alt.datum.layer == 'points' and friends
+            walk(repr(obj))
+        elif hasattr(obj, '_kwds'):
+            walk(getattr(obj, '_args', ()))
+            walk(obj._kwds)
+
+    walk(chart)
+    return fields
+
+
+def minimal_frame(frame):
+    """
+    Function to store a polars frame at the smallest numeric widths and hand it over as an Arrow table.
+
+    Integers are shrunk to the narrowest type holding their range, Float64 becomes Float32 (ample for
+    plotted positions and densities) and Enum/Categorical labels become plain strings.
+    """
+    import polars as pl
+    narrowed = []
+    for name, dtype in frame.schema.items():
+        if dtype.is_integer():
+            narrowed.append(frame[name].shrink_dtype())
+        elif dtype == pl.Float64:
+            narrowed.append(pl.col(name).cast(pl.Float32))
+        elif isinstance(dtype, (pl.Enum, pl.Categorical)):
+            narrowed.append(pl.col(name).cast(pl.Utf8))
+    return frame.with_columns(narrowed).to_arrow()
+
+
+def project_chart(chart):
+    """
+    Function to cut every polars dataset of a chart down to the columns its encodings and transforms use.
+
+    Parameters:
+    -----------
+    chart : altair.Chart
+        Any Altair chart (layered, faceted or concatenated). It is not modified.
+
+    Returns:
+    --------
+    altair.Chart
+        A copy whose datasets only hold the referenced columns, as Arrow tables at minimal widths, so
+        vegafusion neither converts nor inlines the unused ones.
+
+    Example Usage:
+    --------------
+    >>> project_chart(plot).data.column_names
+    ['Percent_den', 'column_3_right']
+    """
+    import polars as pl
+    chart = chart.copy(deep=True)
+
+    def visit(node):
+        kwds = getattr(node, '_kwds', {})
+        data = kwds.get('data')
+        if isinstance(data, pl.DataFrame):
+            # The data is read by this chart and by every chart nested in it without data of its own
+            used = chart_fields(node)
+            node.data = minimal_frame(data.select([name for name in data.columns if name in used]))
+        for key in _COMPOSITE:
+            if isinstance(kwds.get(key), list):
+                for child in kwds[key]:
+                    visit(child)
+        if hasattr(kwds.get('spec'), '_kwds'):
+            visit(kwds['spec'])
+
+    visit(chart)
+    return chart
+
+
+def compile_chart(chart):
+    """
+    Function to compile an Altair chart to a Vega spec, running the vegafusion data transforms once.
+    Only the data columns the chart uses are passed on (see `project_chart`).
+
+    Parameters:
+    -----------
+    chart : altair.Chart
+        Any Altair chart (layered, faceted or concatenated).
+
+    Returns:
+    --------
+    dict
+        The compiled Vega spec with the pre-transformed data inlined.
+    """
+    vlc = _renderer()
+    chart = project_chart(chart)
+    try:
+        return chart.to_dict(format='vega')
+    except TypeError:
+        # Altair < 5.2 cannot compile to Vega itself
+        return json.loads(vlc.vegalite_to_vega(chart.to_dict()))
+
+
+def export_chart(chart, save_name, ppi=300, formats=None):
+    """
+    Function to save a chart in every configured format from a single compilation.
+
+    Parameters:
+    -----------
+    chart : altair.Chart
+        The chart to export.
+
+    save_name : str
+        Base file name without extension.
+
+    ppi : float, optional (default: 300)
+        The figure's own resolution for PNG output. Overridden by a run-wide `configure_export(ppi=...)`.
+
+    formats : list of str, optional (default: None)
+        Formats for this chart only. None uses the run-wide setting.
+
+    Returns:
+    --------
+    dict
+        Mapping of format to the written file path.
+
+    Example Usage:
+    --------------
+    >>> export_chart(plot, 'Figure4', ppi=450)
+    {'svg': './Figure4.svg', 'png': './Figure4.png'}
+    """
+    formats = formats or EXPORT_SETTINGS['formats']
+    ppi = EXPORT_SETTINGS['ppi'] or ppi
+    base = os.path.join(EXPORT_SETTINGS['out_dir'], save_name)
+    with stage(f'compile {save_name}', 'chart'):
+        vega_spec = compile_chart(chart)
+    return render_spec(vega_spec, base, formats, ppi)
+
+
+def render_spec(vega_spec, base, formats, ppi=300):
+    """
+    Function to write an already compiled Vega spec in the given formats.
+
+    Parameters:
+    -----------
+    vega_spec : dict
+        Output of `compile_chart`.
+
+    base : str
+        Output path without extension.
+
+    formats : list of str
+        Any of svg, png, pdf and json.
+
+    ppi : float, optional (default: 300)
+        Resolution for PNG output.
+
+    Returns:
+    --------
+    dict
+        Mapping of format to the written file path.
+    """
+    vlc = _renderer()
+    written = {}
+    name = os.path.basename(base)
+    if 'json' in formats:
+        with stage(f'save {name}.vg.json', 'save'):
+            written['json'] = _write(f'{base}.vg.json', json.dumps(vega_spec), 'w')
+
+    svg = None
+    if {'svg', 'png', 'pdf'} & set(formats):
+        with stage(f'render {name} svg', 'save'):
+            svg = vlc.vega_to_svg(vega_spec)
+    if 'svg' in formats:
+        written['svg'] = _write(f'{base}.svg', svg, 'w')
+    if 'png' in formats:
+        # Rasterize the rendered SVG rather than re-running the Vega view
+        with stage(f'save {name}.png', 'save'):
+            if hasattr(vlc, 'svg_to_png'):
+                png = vlc.svg_to_png(svg, ppi=ppi)
+            else:
+                png = vlc.vega_to_png(vega_spec, ppi=ppi)
+            written['png'] = _write(f'{base}.png', png, 'wb')
+    if 'pdf' in formats:
+        with stage(f'save {name}.pdf', 'save'):
+            pdf = vlc.svg_to_pdf(svg) if hasattr(vlc, 'svg_to_pdf') else vlc.vega_to_pdf(vega_spec)
+            written['pdf'] = _write(f'{base}.pdf', pdf, 'wb')
+    return written
+
+
+def _write(path, content, mode):
+    with open(path, mode) as handle:
+        handle.write(content)
+    return path
+
+
+def export_table(df, save_name):
+    """
+    Function to write a table that accompanies a figure (e.g. fitted trend curves) next to the figure files.
+
+    Parameters:
+    -----------
+    df : polars.DataFrame
+        The table to write.
+
+    save_name : str
+        Base file name without extension; written as tab-separated `.tsv`.
+
+    Returns:
+    --------
+    str
+        Path of the written file.
+    """
+    path = os.path.join(EXPORT_SETTINGS['out_dir'], f'{save_name}.tsv')
+    df.write_csv(path, separator='\t')
+    return path
@@ -0,0 +1,158 @@
+import numpy as np
+import polars as pl
+from schemas import plain_labels
+## -------- ##
+## CENTROMERE / TELOMERE INTERVAL INDEX ##
+# Figures 2 and 4 are about the end-to-centromere trend. Instead of joining the centromere onto every
+# window (and drawing the same rectangle once per window), the centromere is kept as its own small
+# per-chromosome layer and each window gets its distance to the centromere and to the nearest chromosome end.
+
+
+def centromere_layer(centromere_df):
+    """
+    Function to turn the centromere BED into one row per chromosome, in Mbp, for the chart's annotation layer.
+
+    Parameters:
+    -----------
+    centromere_df : polars.DataFrame
+        Headerless centromere BED (column_1 chromosome, column_2 start, column_3 end, in bp).
+
+    Returns:
+    --------
+    polars.DataFrame
+        Columns Chromosome, Start and End (Mbp), one row per centromere.
+    """
+    return centromere_df.select(
+        pl.col('column_1').alias('Chromosome'),
+        (pl.col('column_2') / 10**6).alias('Start'),
+        (pl.col('column_3') / 10**6).alias('End'),
+    ).unique(maintain_order=True)
+
+
+class IntervalIndex:
+    """
+    Sorted, array-backed index of intervals on several chromosomes, for vectorized distance queries.
+
+    Intervals are sorted by chromosome and start. At query time intervals and positions are laid out on one
+    genome-wide coordinate (each chromosome shifted by an offset wider than any coordinate), so a whole table
+    of positions is answered with a single `np.searchsorted`.
+
+    Parameters:
+    -----------
+    chroms : sequence of str
+        Chromosome of each interval.
+
+    starts, ends : array-like
+        Interval coordinates (any unit, as long as queries use the same one).
+
+    Example Usage:
+    --------------
+    >>> index = IntervalIndex(layer['Chromosome'], layer['Start'], layer['End'])
+    >>> index.distance(df['Chromosome'], df['general_pos'].to_numpy())
+    """
+
+    def __init__(self, chroms, starts, ends):
+        chroms = [str(c) for c in chroms]
+        starts = np.asarray(starts, dtype=float)
+        ends = np.asarray(ends, dtype=float)
+        self.codes = {c: i for i, c in enumerate(dict.fromkeys(chroms))}
+        code = np.array([self.codes[c] for c in chroms], dtype=float)
+        order = np.lexsort((starts, code))
+        self.chrom, self.starts, self.ends = code[order], starts[order], ends[order]
+
+    def distance(self, chroms, positions):
+        """
+        Function to compute the distance from each position to the nearest interval on its chromosome.
+
+        Parameters:
+        -----------
+        chroms : polars.Series or sequence of str
+            Chromosome of each position.
+
+        positions : array-like
+            Query positions.
+
+        Returns:
+        --------
+        numpy.ndarray
+            0 inside an interval, NaN on chromosomes without any interval.
+        """
+        chroms = pl.Series(chroms).cast(pl.Utf8)
+        code = chroms.replace_strict(self.codes, default=None, return_dtype=pl.Float64).to_numpy()
+        positions = np.asarray(positions, dtype=float)
+        result = np.full(len(positions), np.nan)
+        known = ~np.isnan(code)
+        if not known.any() or len(self.starts) == 0:
+            return result
+        # Leave a gap between chromosomes wider than any interval or query coordinate
+        stride = 2.0 * np.nanmax(np.abs(np.concatenate([self.starts, self.ends, positions[known]])), initial=1.0) + 1.0
+        starts = self.chrom * stride + self.starts
+        # Furthest end reached so far, so a position inside a long interval that contains shorter ones is at 0;
+        # ends of earlier chromosomes stay below every query on a later one
+        reach = np.maximum.accumulate(self.chrom * stride + self.ends)
+        query = code[known] * stride + positions[known]
+
+        left = np.searchsorted(starts, query, side='right') - 1
+        right = left + 1
+        best = np.full(len(query), np.inf)
+        has_left = (left >= 0)
+        left_idx = np.clip(left, 0, len(starts) - 1)
+        same = has_left & (self.chrom[left_idx] == code[known])
+        best = np.where(same, np.maximum(query - reach[left_idx], 0.0), best)
+        has_right = right < len(starts)
+        right_idx = np.clip(right, 0, len(starts) - 1)
+        same = has_right & (self.chrom[right_idx] == code[known])
+        best = np.minimum(best, np.where(same, starts[right_idx] - query, np.inf))
+        result[known] = np.where(np.isinf(best), np.nan, best)
+        return result
+
+
+def add_centromere_distance(df, centromere, pos='general_pos', chrom='Chromosome', length='Chr_length'):
+    """
+    Function to add distance-to-centromere and distance-to-telomere columns to every window in one vectorized pass.
+
+    Parameters:
+    -----------
+    df : polars.DataFrame
+        Window table with a chromosome column and positions in the same unit as `centromere`.
+
+    centromere : polars.DataFrame
+        Output of `centromere_layer`.
+
+    pos : str, optional (default: 'general_pos')
+        Window position used for the distances (the window mid-point).
+
+    chrom : str, optional (default: 'Chromosome')
+        Chromosome column.
+
+    length : str, optional (default: 'Chr_length')
+        Chromosome length column (Genome_text.tsv column_2, in the unit of `pos`). The largest window end is not
+        used, since under a region it is only the end of the region.
+
+    Returns:
+    --------
+    polars.DataFrame
+        The input with Dist_centromere (0 inside the centromere) and Dist_telomere (to the nearest chromosome end).
+    """
+    index = IntervalIndex(centromere['Chromosome'].to_list(), centromere['Start'].to_numpy(), centromere['End'].to_numpy())
+    return df.with_columns(
+        Dist_centromere=pl.Series(index.distance(df[chrom], df[pos].to_numpy())),
+    ).with_columns(
+        Dist_telomere=pl.min_horizontal(pl.col(pos), pl.col(length) - pl.col(pos)).clip(0, None),
+    )
+
+
+def stack_layers(**frames):
+    """
+    Function to stack the datasets of a layered, faceted chart into one frame with a `layer` column.
+
+    A faceted chart has a single data source, so the window rows, the per-chromosome centromere rows and any
+    other annotation rows are stacked and each layer selects its own rows with `transform_filter`.
+    Enum chromosome columns become plain strings in the stacked chart data.
+
+    Example Usage:
+    --------------
+    >>> data = stack_layers(points=df, centromere=centromere_layer(centromere_df))
+    """
+    return pl.concat([plain_labels(frame).with_columns(layer=pl.lit(name)) for name, frame in frames.items() if frame is not None],
+                     how='diagonal_relaxed')
@@ -0,0 +1,142 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import polars as pl
+## -------- ##
+## PRECOMPUTED LOESS TRENDS ##
+# Vectorized local-linear LOESS (tricube weights, bisquare robustness iterations as in Vega's
+# transform_loess), fitted per group ahead of time so only the small fitted curves go into the chart.
+
+# Grid points fitted per block, to bound the (grid x observations) weight matrix
+BLOCK_SIZE = 2048
+# Vega's floor for robustness weights and its threshold for a vanishing residual scale
+EPSILON = 1e-12
+
+
+def _local_linear(x, y, robust, grid, bandwidth):
+    # Fit a weighted straight line around every grid point at once
+    n = len(x)
+    k = min(n, max(2, int(np.floor(bandwidth * n))))
+    fitted = np.empty(len(grid))
+    for start in range(0, len(grid), BLOCK_SIZE):
+        g = grid[start:start + BLOCK_SIZE, None]
+        dx = x[None, :] - g
+        dist = np.abs(dx)
+        # Neighbourhood radius: distance to the k-th nearest observation
+        radius = np.partition(dist, k - 1, axis=1)[:, k - 1:k]
+        radius = np.where(radius > 0, radius * 1.0000001, 1.0)
+        weights = np.clip(1 - (dist / radius) ** 3, 0, None) ** 3 * robust[None, :]
+        sw = weights.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Sums around the weighted means: sw * sxx - sx ** 2 cancels badly when a few weights dominate
+            # (e.g. next to outliers floored at EPSILON)
+            mean_x = (weights * dx).sum(axis=1) / sw
+            mean_y = (weights * y[None, :]).sum(axis=1) / sw
+            cx = dx - mean_x[:, None]
+            sxx = (weights * cx * cx).sum(axis=1)
+            sxy = (weights * cx * (y[None, :] - mean_y[:, None])).sum(axis=1)
+            # Degenerate when the weighted x spread vanishes relative to its scale, not below an absolute threshold
+            scale = (weights * dx * dx).sum(axis=1)
+            slope = np.where(sxx > EPSILON * scale, sxy / sxx, 0.0)
+            # x is centred on the grid point, so the intercept is the fitted value
+            fitted[start:start + BLOCK_SIZE] = np.where(sw > 0, mean_y - slope * mean_x, np.nan)
+    return fitted
+
+
+def loess_fit(x, y, grid=None, bandwidth=0.3, iterations=2):
+    """
+    Function to fit a LOESS curve with NumPy.
+
+    Parameters:
+    -----------
+    x, y : array-like
+        Observations.
+
+    grid : array-like, optional (default: None)
+        Points at which to evaluate the curve. None uses the sorted unique x values, as Vega does.
+
+    bandwidth : float, optional (default: 0.3)
+        Fraction of the observations in each local neighbourhood (Vega's default is 0.3).
+
+    iterations : int, optional (default: 2)
+        Number of bisquare robustness iterations.
+
+    Returns:
+    --------
+    tuple of numpy.ndarray
+        The grid and the fitted values.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = np.isfinite(x) & np.isfinite(y)
+    x, y = x[keep], y[keep]
+    grid = np.unique(x) if grid is None else np.asarray(grid, dtype=float)
+    if len(x) < 2:
+        return grid, np.full(len(grid), y[0] if len(y) else np.nan)
+
+    robust = np.ones(len(x))
+    for _ in range(iterations):
+        residuals = y - _local_linear(x, y, robust, x, bandwidth)
+        median = np.median(np.abs(residuals))
+        if median < EPSILON:
+            break
+        arg = np.abs(residuals) / (6 * median)
+        # Outliers keep a tiny weight, so a neighbourhood made only of outliers still has a fit
+        robust = np.where(arg >= 1, EPSILON, (1 - arg ** 2) ** 2)
+    return grid, _local_linear(x, y, robust, grid, bandwidth)
+
+
+def grouped_loess(df, x, y, groupby, bandwidth=0.3, grid_size=None, iterations=2, n_jobs=None):
+    """
+    Function to fit one LOESS curve per group, with the groups fitted in parallel.
+
+    Parameters:
+    -----------
+    df : polars.DataFrame
+        Input data.
+
+    x, y : str
+        Columns to smooth.
+
+    groupby : list of str
+        Grouping columns, e.g. ['Chromosome', 'Type'].
+
+    bandwidth : float, optional (default: 0.3)
+        LOESS bandwidth.
+
+    grid_size : int, optional (default: None)
+        Number of evenly spaced evaluation points per group. None evaluates at the group's unique x values.
+
+    iterations : int, optional (default: 2)
+        Number of robustness iterations.
+
+    n_jobs : int, optional (default: None)
+        Number of threads. The heavy NumPy kernels release the GIL, so threads avoid pickling the groups to processes.
+
+    Returns:
+    --------
+    polars.DataFrame
+        The grouping columns plus x and the fitted y, one row per evaluation point.
+
+    Example Usage:
+    --------------
+    >>> trend = grouped_loess(df, 'column_2', 'column_4', ['Chromosome', 'Type'], grid_size=100)
+    """
+    groups = df.select(*groupby, x, y).partition_by(groupby, as_dict=True, maintain_order=True)
+
+    def fit(item):
+        key, group = item
+        xs = group[x].to_numpy()
+        grid = None
+        if grid_size:
+            finite = xs[np.isfinite(xs)] if len(xs) else xs
+            grid = np.linspace(finite.min(), finite.max(), grid_size) if len(finite) else np.array([])
+        grid, fitted = loess_fit(xs, group[y].to_numpy(), grid, bandwidth, iterations)
+        key = key if isinstance(key, tuple) else (key,)
+        return pl.DataFrame({**{col: [value] * len(grid) for col, value in zip(groupby, key)}, x: grid, y: fitted})
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as pool:
+        curves = list(pool.map(fit, groups.items()))
+    if not curves:
+        return pl.DataFrame(schema={**{col: df.schema[col] for col in groupby}, x: pl.Float64, y: pl.Float64})
+    return pl.concat(curves, how='vertical_relaxed')
@@ -1,21 +1,28 @@
 import os
-import psutil
+import sys
+import time
+import json
+import shutil
+import hashlib
+import argparse
 import polars as pl
-from natsort import natsorted
+from streaming import memory_budget, memory_size, use_streaming, configure_streaming, collect
+from dataset_cache import DatasetRegistry
+from scheduler import run_tasks, summarize
+from export import configure_export, EXPORT_SETTINGS
+from cohort import REFERENCE_FILES, read_manifest, sample_out_dir
+from rebuild import FigureNode, RebuildGraph, call_plot, resolve
+from tracing import stage, enable_tracing, write_trace, summarize_trace
+from schemas import (GENOME_SCHEMA, WINDOW_SCHEMA, CENTROMERE_SCHEMA, VARIANT_SCHEMA, SV_WINDOW_SCHEMA,
+                     SV_LENGTH_SCHEMA, chromosome_keys, chromosome_levels, natural_key)
 
-# Import custom plot functions from separate modules
-from Figure1 import *
-from Figure2 import *
-from Figure3 import *
-from Figure4 import *
+# The figure modules (altair), psutil and the NumPy helpers are imported inside the functions
+# that use them, so `--help` or a single small figure does not pay for the whole pipeline.
 
 # Define base directory as the directory containing this script
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "Data")
-
-# Ensure that the data directory exists
-if not os.path.exists(DATA_DIR):
-    raise FileNotFoundError(f"Data directory not found at {DATA_DIR}")
+CACHE_DIR = os.path.join(BASE_DIR, ".cache")
 
 # Utility functions for system information
 def system_info():
@@ -24,6 +31,7 @@ def system_info():
     print(f"Number of CPU cores: {num_cores}")
 
     # Amount of RAM
+    import psutil
     ram_info = psutil.virtual_memory()
     total_ram = ram_info.total / (1024 ** 3)  # Convert bytes to GB
     available_ram = ram_info.available / (1024 ** 3)  # Convert bytes to GB
@@ -31,51 +39,551 @@ def system_info():
     print(f"Available RAM: {available_ram:.2f} GB")
     print(f'Working Directory: {BASE_DIR}')
     print(f'Data Directory: {DATA_DIR}')
+    return {'num_cores': num_cores, 'total_ram': ram_info.total, 'available_ram': ram_info.available}
 
-# Plotting functions
-def plot_figure1():
+# Read options of every input, with the declared column types of its format (see schemas.py)
+INPUT_FORMATS = {
+    "Variant.bed": {'has_header': True, 'schema_overrides': VARIANT_SCHEMA},
+    'Genome_text.tsv': {'has_header': False, 'schema_overrides': GENOME_SCHEMA},
+    '10Kb_window_Variant_Count.bed': {'has_header': False, 'schema_overrides': WINDOW_SCHEMA},
+    "10Kb_window_Variant_Count_SNP_InDel_Homozygous.bed": {'has_header': False, 'schema_overrides': WINDOW_SCHEMA},
+    "10Kb_window_Variant_Count_SNP_InDel_Heterozygous.bed": {'has_header': False, 'schema_overrides': WINDOW_SCHEMA},
+    "500Kb_window_Variant_Count.bed": {'has_header': False, 'schema_overrides': WINDOW_SCHEMA},
+    "T2T-MFA8v1.0.centromere.bed": {'has_header': False, 'schema_overrides': CENTROMERE_SCHEMA},
+    "SV_type_Median_Length.tsv": {'schema_overrides': SV_LENGTH_SCHEMA},
+    "merged_SV_df.tsv": {'schema_overrides': SV_WINDOW_SCHEMA},
+}
+
+# Inputs read by each figure, with the read options used for them
+FIGURE_INPUTS = {
+    figure: [(name, INPUT_FORMATS[name]) for name in names] for figure, names in {
+        'Figure1A': ["Variant.bed"],
+        'Figure1B': ['Genome_text.tsv', '10Kb_window_Variant_Count.bed'],
+        'Figure_S1A': ['Genome_text.tsv', "10Kb_window_Variant_Count_SNP_InDel_Homozygous.bed"],
+        'Figure_S1B': ['Genome_text.tsv', "10Kb_window_Variant_Count_SNP_InDel_Heterozygous.bed"],
+        'Figure2': ['Genome_text.tsv', "500Kb_window_Variant_Count.bed", "T2T-MFA8v1.0.centromere.bed"],
+        'Figure3BC': ["SV_type_Median_Length.tsv"],
+        'Figure4': ['Genome_text.tsv', "T2T-MFA8v1.0.centromere.bed", "merged_SV_df.tsv"],
+    }.items()
+}
+
+# Relative render cost, used to start the slowest figures first
+FIGURE_COST = {'Figure4': 10, 'Figure1B': 6, 'Figure_S1A': 6, 'Figure_S1B': 6, 'Figure2': 4, 'Figure1A': 3, 'Figure3BC': 1}
+
+# Loading functions
+# Every input goes through the registry so each file is parsed at most once per process
+REGISTRY = None
+BUDGET = None
+GRAPH = None
+GENE_MODEL = None
+# Raw SV calls for Figure 3 B-C; a bare file name is looked up in the data directory of each sample
+SV_CALLS = None
+# Region (e.g. 'chr7:40-60Mb') the figures are restricted to; inputs are then read through their sorted stores
+REGION = None
+REGIONAL_FIGURES = ('Figure1B', 'Figure_S1A', 'Figure_S1B', 'Figure2', 'Figure4')
+REGION_INPUTS = ('10Kb_window_Variant_Count.bed', '10Kb_window_Variant_Count_SNP_InDel_Homozygous.bed',
+                 '10Kb_window_Variant_Count_SNP_InDel_Heterozygous.bed', '500Kb_window_Variant_Count.bed', 'merged_SV_df.tsv')
+STORES = {}
+# Shared reference tables are read from here when set (cohort mode), otherwise from DATA_DIR
+REFERENCE_DIR = None
+
+def get_registry():
+    global REGISTRY
+    if REGISTRY is None:
+        REGISTRY = DatasetRegistry(CACHE_DIR)
+    return REGISTRY
+
+def input_path(name):
+    if REFERENCE_DIR and name in REFERENCE_FILES:
+        return os.path.join(REFERENCE_DIR, name)
+    return os.path.join(DATA_DIR, name)
+
+def load_table(name):
+    with stage(f'read {name}', 'read') as traced:
+        df = get_registry().load(input_path(name), **INPUT_FORMATS[name])
+        traced.rows = df.height
+    return df
+
+def get_store(name):
+    # Sorted, row-group-indexed copy of an input for region queries; chromosome labels are accepted as aliases
+    path = input_path(name)
+    # Keyed by the sidecar, i.e. the file content, so an edited input gets a new store
+    key = get_registry().sidecar(path, **INPUT_FORMATS[name])
+    if key not in STORES:
+        from store import open_store
+        chr_map = load_table('Genome_text.tsv')
+        aliases = dict(zip(chr_map['column_3'].cast(pl.Utf8).to_list(), chr_map['column_1'].cast(pl.Utf8).to_list()))
+        STORES[key] = open_store(get_registry(), path, INPUT_FORMATS[name], aliases=aliases)
+    return STORES[key]
+
+def load_region(name):
+    # The rows of an input that overlap REGION, or the whole table when no region is set
+    if not REGION:
+        return load_table(name)
+    with stage(f'query {name}', 'read') as traced:
+        df = get_store(name).query(REGION)
+        traced.rows = df.height
+    return df
+
+def load_windows(name, chr_map, budget=None):
+    # Run Data_processing on the lazy scan so only the processed rows are materialized
+    from Figure1 import Data_processing
+    path = input_path(name)
+    with stage(f'Data_processing {name}', 'transform') as traced:
+        if REGION:
+            df = Data_processing(load_region(name), chr_map)
+        else:
+            df = collect(Data_processing(get_registry().scan(path, **INPUT_FORMATS[name]), chr_map), use_streaming(path, budget))
+        traced.rows = df.height
+    return df
+
+def load_chromosomes():
+    # Genome_text.tsv with Enum chromosome keys in natural order
+    return chromosome_keys(load_table('Genome_text.tsv'))
+
+def chromosome_order(chr_map):
+    return chromosome_levels(chr_map.filter(pl.col('column_3').cast(pl.Utf8) != "MT")['column_3'])
+
+def prepare_inputs(figures, names=None):
+    # Convert every input (or only those in `names`) to its sidecar once, up front, so that workers only memory-map them
+    registry = get_registry()
+    for name, read_kwargs in _unique_inputs(figures):
+        if names is not None and name not in names:
+            continue
+        with stage(f'parse {name}', 'read'):
+            registry.sidecar(input_path(name), **read_kwargs)
+        if REGION and name in REGION_INPUTS:
+            with stage(f'sort {name}', 'read'):
+                get_store(name)
+    # Workers read the manifest when they start, so they reuse these fingerprints instead of re-hashing
+    registry.flush()
+
+def _unique_inputs(figures):
+    # Inputs read as tables; entries without read options (e.g. the gene model) are only fingerprinted
+    seen = {}
+    for fig in figures:
+        for name, read_kwargs in FIGURE_GRAPH[fig].inputs:
+            if read_kwargs is not None:
+                seen.setdefault((name, json.dumps(read_kwargs, sort_keys=True, default=str)), (name, read_kwargs))
+    return list(seen.values())
+
+def _extend_node(name, inputs=(), deps=()):
+    # Add inputs and deps to a figure once, so the options can be applied again in the same process
+    node = FIGURE_GRAPH[name]
+    FIGURE_GRAPH[name] = node._replace(inputs=node.inputs + [item for item in inputs if item not in node.inputs],
+                                       deps=node.deps + tuple(dep for dep in deps if dep not in node.deps))
+
+def configure_figures(figure_params=None, gene_model=None, sv_calls=None, region=None):
+    # Apply run options to the figure graph; called in the driver and again in every worker
+    global GENE_MODEL, SV_CALLS, REGION, GRAPH
+    for name, params in (figure_params or {}).items():
+        FIGURE_GRAPH[name].params.update(params)
+    # A bare file name is looked up in each sample's data directory; any other path is resolved once, here, so
+    # the fingerprinted file and the file process_figure3 reads are the same
+    if sv_calls and os.path.dirname(sv_calls):
+        sv_calls = os.path.abspath(sv_calls)
+    GENE_MODEL, SV_CALLS, REGION, GRAPH = gene_model, sv_calls, region, None
+    if region:
+        for name in REGIONAL_FIGURES:
+            FIGURE_GRAPH[name].params['region'] = region
+            _extend_node(name, deps=('store:VariantStore', 'store:in_region'))
+    if sv_calls:
+        # Fingerprint the raw calls instead of the aggregated table
+        FIGURE_GRAPH['Figure3BC'] = FIGURE_GRAPH['Figure3BC']._replace(inputs=[(sv_calls, None)])
+        _extend_node('Figure3BC', deps=('svstats:sv_length_stats', 'svstats:SVLengthStats'))
+    if gene_model:
+        _extend_node('Figure1A', inputs=[(os.path.abspath(gene_model), None)], deps=('annotation:RegionIndex', 'annotation:count_regions'))
+
+def init_worker(settings):
+    # Runs once per worker process: point it at the shared sidecars and give it its share of the memory budget
+    global DATA_DIR, CACHE_DIR, REGISTRY, BUDGET, REFERENCE_DIR
+    DATA_DIR, CACHE_DIR, BUDGET = settings['data_dir'], settings['cache_dir'], settings['budget']
+    REFERENCE_DIR = settings.get('reference_dir')
+    if settings.get('trace_dir'):
+        enable_tracing(settings['trace_dir'])
+    if settings.get('export'):
+        configure_export(**settings['export'])
+    configure_figures(settings.get('figure_params'), settings.get('gene_model'), settings.get('sv_calls'), settings.get('region'))
+    REGISTRY = DatasetRegistry(CACHE_DIR, max_memory=BUDGET // 4 if BUDGET else 2 * 1024 ** 3, stats_dir=settings.get('stats_dir'))
+    if BUDGET:
+        configure_streaming(BUDGET)
+
+# Processing functions: each returns the arguments of the figure's plot function (a tuple, or a dict of keyword arguments)
+def process_figure1a():
     # Figure 1A
-    sum_alltype = pl.read_csv(os.path.join(DATA_DIR, "Variant.bed"), separator='\t', has_header=True).with_columns(Count = 1).group_by('col_14','col_8').agg(pl.col('Count').sum())
-    sorted_value = natsorted(sum_alltype['col_8'].unique())
-    plot_fig1a = Fraction_plot(sum_alltype, sorted_value)
+    variant_path = input_path("Variant.bed")
+    if GENE_MODEL:
+        from annotation import RegionIndex, count_regions
+        # Annotate the raw calls against the gene model instead of using the precomputed col_14 classes
+        index = RegionIndex.from_gene_model(GENE_MODEL, cache_dir=CACHE_DIR)
+        variants = pl.read_ipc(get_registry().sidecar(variant_path, **INPUT_FORMATS["Variant.bed"]))
+        with stage('count_regions Variant.bed', 'transform') as traced:
+            sum_alltype = count_regions(variants, index)
+            traced.rows = variants.height
+        return sum_alltype.sort('col_14', 'col_8'), sorted(sum_alltype['col_8'].cast(pl.Utf8).unique().to_list(), key=natural_key)
+    with stage('group_by Variant.bed', 'transform'):
+        sum_alltype = collect(get_registry().scan(variant_path, **INPUT_FORMATS["Variant.bed"]).group_by('col_14','col_8').agg(Count=pl.len()), use_streaming(variant_path, BUDGET))
+    return sum_alltype.sort('col_14', 'col_8'), sorted(sum_alltype['col_8'].cast(pl.Utf8).unique().to_list(), key=natural_key)
 
+def process_windows_10kb(name):
     # Figure 1B & Supplementary S1 A-B
-    chr_map = pl.read_csv(os.path.join(DATA_DIR, 'Genome_text.tsv'), separator="\t", has_header=False)
-    vcf_10kb_df = pl.read_csv(os.path.join(DATA_DIR, '10Kb_window_Variant_Count.bed'), separator="\t", has_header=False)
-    sorted_value = natsorted(Data_processing(vcf_10kb_df, chr_map)['column_3_right'].unique())
-    plot_fig1b = Plot_VarChr(Data_processing(vcf_10kb_df, chr_map), sorted_value, save_name='Figure1B')
+    chr_map = load_chromosomes()
+    return load_windows(name, chr_map, BUDGET), chromosome_order(chr_map)
+
+def process_figure2():
+    # Figure 2
+    from Figure2 import Data_processing_fig2
+    from intervals import centromere_layer
+    chr_map = load_chromosomes()
+    df_500kbp = load_region("500Kb_window_Variant_Count.bed")
+    centromere_df = load_table("T2T-MFA8v1.0.centromere.bed")
+    with stage('Data_processing_fig2', 'transform') as traced:
+        processed_value = Data_processing_fig2(df_500kbp, chr_map, centromere_df)
+        traced.rows = processed_value.height
+    return {'df': processed_value, 'sorted_value': chromosome_levels(processed_value['Chromosome']),
+            'centromere': centromere_layer(centromere_df)}
+
+def process_figure3():
+    # Figure 3 B-C
+    if SV_CALLS:
+        from svstats import MAX_EXACT, sv_length_stats
+        # Exact quantiles while the lengths fit in an eighth of the budget, t-digests beyond
+        max_exact = min(MAX_EXACT, BUDGET // 8 // 8) if BUDGET else MAX_EXACT
+        with stage(f'sv_length_stats {os.path.basename(SV_CALLS)}', 'transform') as traced:
+            stats = sv_length_stats(input_path(SV_CALLS), max_exact=max_exact)
+            traced.rows = sum(stats.counts.values())
+        return (stats.table(),)
+    return (load_table("SV_type_Median_Length.tsv"),)
+
+def process_figure4():
+    # Figure 4
+    from Figure4 import Data_processing_fig4
+    from intervals import centromere_layer
+    chr_map = load_chromosomes()
+    centromere_df = load_table("T2T-MFA8v1.0.centromere.bed")
+    SV_df = load_region("merged_SV_df.tsv")
+    with stage('Data_processing_fig4', 'transform') as traced:
+        processed_value = Data_processing_fig4(SV_df, centromere_df, chr_map)
+        traced.rows = processed_value.height
+    return {'df': processed_value, 'centromere': centromere_layer(centromere_df)}
+
+# Dependency graph: figure -> inputs, processing function and plot parameters
+# Functions of the figure modules are referenced as 'module:function' and imported when the figure is built
+FIGURE_GRAPH = {
+    'Figure1A': FigureNode(FIGURE_INPUTS['Figure1A'], process_figure1a, (), 'Figure1:Fraction_plot', {'save_name': 'Figure1A'}, ()),
+    'Figure1B': FigureNode(FIGURE_INPUTS['Figure1B'], process_windows_10kb, ('10Kb_window_Variant_Count.bed',),
+                           'Figure1:Plot_VarChr', {'save_name': 'Figure1B'}, ('Figure1:Data_processing', 'Figure1:Reduce_density', load_windows, load_chromosomes, chromosome_order)),
+    'Figure_S1A': FigureNode(FIGURE_INPUTS['Figure_S1A'], process_windows_10kb, ("10Kb_window_Variant_Count_SNP_InDel_Homozygous.bed",),
+                             'Figure1:Plot_VarChr', {'save_name': 'Figure_S1A', 'title': 'Homozygous variant occurrence per chromosome with resolution of 10Kb'},
+                             ('Figure1:Data_processing', 'Figure1:Reduce_density', load_windows, load_chromosomes, chromosome_order)),
+    'Figure_S1B': FigureNode(FIGURE_INPUTS['Figure_S1B'], process_windows_10kb, ("10Kb_window_Variant_Count_SNP_InDel_Heterozygous.bed",),
+                             'Figure1:Plot_VarChr', {'save_name': 'Figure_S1B', 'title': 'Heterozygous variant occurrence per chromosome with resolution of 10Kb'},
+                             ('Figure1:Data_processing', 'Figure1:Reduce_density', load_windows, load_chromosomes, chromosome_order)),
+    'Figure2': FigureNode(FIGURE_INPUTS['Figure2'], process_figure2, (), 'Figure2:Plot_VarPerChr', {'save_name': 'Figure2'},
+                          ('Figure2:Data_processing_fig2', 'intervals:centromere_layer', 'intervals:add_centromere_distance',
+                           load_chromosomes, 'schemas:chromosome_keys', 'schemas:to_enum',
+                           'enrichment:relative_distance', 'enrichment:enrichment_test', 'enrichment:enrichment_layer',
+                           'tiles:facet_tiles', 'tiles:export_facets')),
+    'Figure3BC': FigureNode(FIGURE_INPUTS['Figure3BC'], process_figure3, (), 'Figure3:plot_sv_chart', {'save_name': 'Figure3BC'}, ()),
+    'Figure4': FigureNode(FIGURE_INPUTS['Figure4'], process_figure4, (), 'Figure4:Plot_TrendPerChr', {'save_name': 'Figure4'},
+                          ('Figure4:Data_processing_fig4', 'loess:grouped_loess', 'loess:loess_fit',
+                           'intervals:centromere_layer', 'intervals:add_centromere_distance',
+                           load_chromosomes, 'schemas:chromosome_keys', 'schemas:to_enum',
+                           'enrichment:relative_distance', 'enrichment:enrichment_test', 'enrichment:enrichment_layer',
+                           'tiles:facet_tiles', 'tiles:export_facets')),
+}
+
+# Figures that --facet-tiles renders as per-chromosome tiles
+TILED_FIGURES = ('Figure2', 'Figure4')
+
+def tile_budget(requested, concurrent, num_cores):
+    # Tile processes per figure: the --facet-tiles total (default: the CPU count) shared by the tiled figures rendering at once
+    return max(1, (requested or num_cores or 1) // max(1, concurrent))
 
-    # Homozygous Variant Plot (Supplementary Figure S1A)
-    homo_df = pl.read_csv(os.path.join(DATA_DIR, "10Kb_window_Variant_Count_SNP_InDel_Homozygous.bed"), separator="\t", has_header=False)
-    plot_figS1a = Plot_VarChr(Data_processing(homo_df, chr_map), sorted_value, save_name='Figure_S1A', title='Homozygous variant occurrence per chromosome with resolution of 10Kb')
+# Short names accepted by --figures; '1' selects Figure 1A, 1B and the supplementary S1A/S1B
+FIGURE_ALIASES = {
+    '1': ['Figure1A', 'Figure1B', 'Figure_S1A', 'Figure_S1B'], '1A': ['Figure1A'], '1B': ['Figure1B'],
+    'S1': ['Figure_S1A', 'Figure_S1B'], 'S1A': ['Figure_S1A'], 'S1B': ['Figure_S1B'],
+    '2': ['Figure2'], '3': ['Figure3BC'], '3BC': ['Figure3BC'], '4': ['Figure4'],
+}
 
-    # Heterozygous Variant Plot (Supplementary Figure S1B)
-    hetero_df = pl.read_csv(os.path.join(DATA_DIR, "10Kb_window_Variant_Count_SNP_InDel_Heterozygous.bed"), separator="\t", has_header=False)
-    plot_figS1b = Plot_VarChr(Data_processing(hetero_df, chr_map), sorted_value, save_name='Figure_S1B', title='Heterozygous variant occurrence per chromosome with resolution of 10Kb')
+def select_figures(spec):
+    """
+    Function to turn a --figures value such as '1B,3' or 'Figure2,S1A' into figure names, in graph order.
+    """
+    if not spec:
+        return list(FIGURE_GRAPH)
+    wanted = set()
+    for item in (part.strip() for part in spec.split(',') if part.strip()):
+        key = item.upper()
+        for prefix in ('FIGURE_', 'FIGURE'):
+            if key.startswith(prefix):
+                key = key[len(prefix):]
+                break
+        names = FIGURE_ALIASES.get(key) or [name for name in FIGURE_GRAPH if name.upper() == item.upper()]
+        if not names:
+            raise ValueError(f"Unknown figure '{item}'. Choose from {', '.join(FIGURE_ALIASES)} or {', '.join(FIGURE_GRAPH)}")
+        wanted.update(names)
+    return [name for name in FIGURE_GRAPH if name in wanted]
+
+def get_graph():
+    global GRAPH
+    if GRAPH is None:
+        # One state directory per (data, output) pair, so samples of a cohort do not overwrite each other's fingerprints
+        run_key = hashlib.blake2b(f"{os.path.abspath(DATA_DIR)}|{os.path.abspath(EXPORT_SETTINGS['out_dir'])}".encode(), digest_size=8).hexdigest()
+        GRAPH = RebuildGraph(FIGURE_GRAPH, os.path.join(CACHE_DIR, 'rebuild', run_key), input_path,
+                             get_registry().fingerprint, lambda: EXPORT_SETTINGS)
+    return GRAPH
+
+# Plotting functions
+def render_figure(name):
+    # Process and plot unconditionally
+    node = FIGURE_GRAPH[name]
+    processed = resolve(node.process)(*node.process_args)
+    with stage(f'{name} chart', 'chart'):
+        return call_plot(node, processed)
+
+def build_figure(name, force=False):
+    # Rebuild only if an upstream node changed
+    status = get_graph().build(name, force=force)
+    print(f"{name}: {status}")
+    return status
+
+def run_sample(sample, data_dir, out_dir, force=False, figures=None):
+    # Cohort mode: render the figures of one sample into its own directory
+    global DATA_DIR, GRAPH
+    DATA_DIR, GRAPH = data_dir, None
+    configure_export(out_dir=out_dir)
+    figures = figures or list(FIGURE_GRAPH)
+    if not force and not any(get_graph().plan(figures).values()):
+        print(f"{sample}: already complete, skipped")
+        return 'skipped'
+    # The sample's own tables are parsed here, in parallel with the other samples
+    prepare_inputs(figures)
+    failed = []
+    for name in figures:
+        try:
+            build_figure(name, force=force)
+        except Exception as error:
+            print(f"{sample}: {name} failed: {error!r}")
+            failed.append(name)
+    if failed:
+        raise RuntimeError(f"{sample}: {len(failed)} figure(s) failed: {', '.join(failed)}")
+    return 'built'
+
+def plot_figure1():
+    for name in ('Figure1A', 'Figure1B', 'Figure_S1A', 'Figure_S1B'):
+        render_figure(name)
 
 def plot_figure2():
-    # Figure 2
-    chr_map = pl.read_csv(os.path.join(DATA_DIR, 'Genome_text.tsv'), separator="\t", has_header=False)
-    df_500kbp = pl.read_csv(os.path.join(DATA_DIR, "500Kb_window_Variant_Count.bed"), separator="\t", has_header=False)
-    centromere_df = pl.read_csv(os.path.join(DATA_DIR, "T2T-MFA8v1.0.centromere.bed"), separator="\t", has_header=False)
-    processed_value = Data_processing_fig2(df_500kbp, chr_map, centromere_df)
-    sorted_value = natsorted(processed_value['Chromosome'].unique())
-    plot_fig2 = Plot_VarPerChr(processed_value, sorted_value)
+    return render_figure('Figure2')
 
 def plot_figure3():
-    # Figure 3 B-C
-    plot_fig3bc = plot_sv_chart(os.path.join(DATA_DIR, "SV_type_Median_Length.tsv"))
+    return render_figure('Figure3BC')
 
 def plot_figure4():
-    # Figure 4
-    centromere_df = pl.read_csv(os.path.join(DATA_DIR, "T2T-MFA8v1.0.centromere.bed"), separator="\t", has_header=False)
-    SV_df = pl.read_csv(os.path.join(DATA_DIR, "merged_SV_df.tsv"), separator='\t')
-    plot_fig4 = Plot_TrendPerChr(Data_processing_fig4(SV_df, centromere_df))
+    return render_figure('Figure4')
+
+def evict_cache():
+    # Rendered facet tiles count towards the disk limit too, by the time they were last written or reused
+    registry = get_registry()
+    tile_cache = EXPORT_SETTINGS.get('tile_cache')
+    if tile_cache and os.path.isdir(tile_cache):
+        for entry in os.scandir(tile_cache):
+            if entry.is_file():
+                registry.track(entry.path, entry.stat().st_mtime)
+    return registry.evict()
+
+def finish_cache(stats_dir):
+    # The pool has finished, so no worker has a sidecar open: enforce the disk limit, then report every process's hits
+    evict_cache()
+    get_registry().report()
+    shutil.rmtree(stats_dir, ignore_errors=True)
+
+def finish_trace(path, trace_dir):
+    # Merge the per-process trace parts into one Chrome trace file and print the per-stage summary
+    if not trace_dir:
+        return
+    events = write_trace(trace_dir, path)
+    shutil.rmtree(trace_dir, ignore_errors=True)
+    summarize_trace(events)
+    print(f"Trace written to {path} (open in chrome://tracing or https://ui.perfetto.dev)")
+
+# Command line options
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate Figures 1-4 for the Thai M. fascicularis variant analysis")
+    parser.add_argument('--figures', default=None,
+                        help="Comma-separated figures to build, e.g. 1B,3 or 2,4 (1 = 1A, 1B, S1A and S1B; default: all)")
+    parser.add_argument('--data-dir', default=DATA_DIR, help="Directory with the input tables (default: Script/Data)")
+    parser.add_argument('--out-dir', default='.', help="Directory the figures are written to (default: current directory)")
+    parser.add_argument('--max-memory', type=memory_size, default=None,
+                        help="Cap on the memory the pipeline may use (e.g. 8G, 512M). Defaults to the available RAM")
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help="Directory for the Arrow sidecars of parsed inputs (default: Script/.cache)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes for rendering figures (default: one per figure, up to the CPU count; 1 runs serially)")
+    parser.add_argument('--formats', default='svg,png',
+                        help="Comma-separated output formats: svg, png, pdf, json (compiled Vega spec). Default: svg,png")
+    parser.add_argument('--ppi', type=float, default=None,
+                        help="Resolution for raster output, applied to every figure (default: 300, 450 for Figure 4)")
+    parser.add_argument('--facet-tiles', nargs='?', type=int, const=0, default=None,
+                        help="Render every chromosome facet of Figures 2 and 4 as its own tile on this many processes in total (default: one per CPU), "
+                             "shared by the figures rendering at once, and stitch them into the figure. Rendered tiles are cached, so only changed "
+                             "chromosomes are re-rendered")
+    parser.add_argument('--density-mode', choices=['points', 'histogram', 'quantile'], default='points',
+                        help="How Figure 1B/S1A/S1B draw the 10Kb windows: every window as a point (default), "
+                             "a per-chromosome density histogram, or quantile bands")
+    parser.add_argument('--loess-bandwidth', type=float, default=None,
+                        help="Bandwidth of the Figure 4 LOESS trend lines (default: 0.3, as in Vega)")
+    parser.add_argument('--loess-grid', type=int, default=None,
+                        help="Number of evaluation points per Figure 4 trend line (default: every window position)")
+    parser.add_argument('--export-trend', action='store_true',
+                        help="Also write the fitted Figure 4 trend curves to Figure4_trend.tsv")
+    parser.add_argument('--permutations', type=int, default=0,
+                        help="Test the end-to-centromere density trend of Figures 2 and 4 with this many within-chromosome "
+                             "permutations, label the facets and write Figure2_enrichment.tsv / Figure4_enrichment.tsv (default: 0, off)")
+    parser.add_argument('--region', default=None,
+                        help="Restrict Figures 1B, S1A, S1B, 2 and 4 to a region, e.g. chr7 or chr7:40-60Mb (chromosome label). The inputs are read "
+                             "through sorted, row-group-indexed stores (built once under the cache directory), so only the region is read")
+    parser.add_argument('--sv-calls', default=None,
+                        help="Raw SV calls (VCF, or a table with SVTYPE and SVLEN columns) to compute the Figure 3 B-C length statistics from, "
+                             "instead of SV_type_Median_Length.tsv. A bare file name is looked up in the data directory (of every sample in cohort mode); "
+                             "any other relative path is resolved against the current directory")
+    parser.add_argument('--gene-model', default=None,
+                        help="GFF3/GTF gene model. When given, Figure 1A region classes are assigned from it instead of the col_14 column of Variant.bed")
+    parser.add_argument('--cohort', default=None,
+                        help="Manifest (TSV with sample and data_dir columns) to render every sample of a cohort")
+    parser.add_argument('--reference-dir', default=None,
+                        help="Directory with the shared reference tables (Genome_text.tsv, T2T-MFA8v1.0.centromere.bed) in cohort mode. Default: the data directory")
+    parser.add_argument('--cohort-out', default='cohort_figures',
+                        help="Root directory for per-sample outputs in cohort mode (default: cohort_figures)")
+    parser.add_argument('--trace', nargs='?', const='trace.json', default=None,
+                        help="Record wall/CPU time, peak memory and rows of every read, transform, chart build and save, "
+                             "write them as a Chrome trace (default: trace.json) and print a summary table")
+    parser.add_argument('--force', action='store_true',
+                        help="Rebuild every figure even if its inputs, code and parameters are unchanged")
+    parser.add_argument('--watch', action='store_true',
+                        help="Stay running: rebuild the figures whose input files or plotting code change, in one warm process")
+    parser.add_argument('--control-port', type=int, default=8765,
+                        help="Port on 127.0.0.1 of the watch-mode control socket, used by watch.py (default: 8765; 0 disables it)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Show which figures would rebuild and why, without parsing or rendering anything")
+    return parser.parse_args(argv)
 
 # Main function
+def main(argv=None):
+    global DATA_DIR, CACHE_DIR, REGISTRY, REFERENCE_DIR, GRAPH
+    args = parse_args(argv)
+    try:
+        figures = select_figures(args.figures)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 2
+    DATA_DIR = args.data_dir
+    # Ensure that the data directory exists (cohort samples bring their own)
+    if not args.cohort and not os.path.exists(DATA_DIR):
+        raise FileNotFoundError(f"Data directory not found at {DATA_DIR}")
+    info = system_info()
+    budget = memory_budget(info['available_ram'], args.max_memory)
+    configure_streaming(budget)
+    print(f"Memory budget: {budget / (1024 ** 3):.2f} GB")
+    # Workers write their cache hit/miss counts here, so the report covers the whole run
+    stats_dir = os.path.join(args.cache_dir, f'stats.{os.getpid()}')
+    REGISTRY = DatasetRegistry(args.cache_dir, max_memory=budget // 4, stats_dir=stats_dir)
+    trace_dir = None
+    if args.trace:
+        trace_dir = f'{args.trace}.parts'
+        shutil.rmtree(trace_dir, ignore_errors=True)
+        enable_tracing(trace_dir)
+    CACHE_DIR = args.cache_dir
+    export_settings = configure_export(formats=args.formats, ppi=args.ppi, out_dir=args.out_dir, tile_cache=os.path.join(CACHE_DIR, 'tiles'))
+
+    figure_params = {}
+    if args.density_mode != 'points':
+        figure_params.update({name: {'mode': args.density_mode} for name in ('Figure1B', 'Figure_S1A', 'Figure_S1B')})
+    trend_params = {'bandwidth': args.loess_bandwidth, 'grid_size': args.loess_grid, 'export_trend': args.export_trend or None}
+    trend_params = {key: value for key, value in trend_params.items() if value is not None}
+    if trend_params:
+        figure_params['Figure4'] = trend_params
+    if args.facet_tiles is not None:
+        for name in TILED_FIGURES:
+            figure_params.setdefault(name, {})['tiles'] = True
+    if args.permutations:
+        figure_params.setdefault('Figure2', {})['permutations'] = args.permutations
+        figure_params.setdefault('Figure4', {})['permutations'] = args.permutations
+    if args.region:
+        from store import parse_region
+        try:
+            parse_region(args.region)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 2
+    configure_figures(figure_params, args.gene_model, args.sv_calls, args.region)
+    REFERENCE_DIR = args.reference_dir
+
+    if args.cohort and args.watch:
+        print("--watch renders a single data directory and cannot be combined with --cohort", file=sys.stderr)
+        return 2
+    if args.cohort:
+        samples = read_manifest(args.cohort)
+        if args.dry_run:
+            for sample, data_dir in samples:
+                DATA_DIR, GRAPH = data_dir, None
+                configure_export(out_dir=sample_out_dir(args.cohort_out, sample))
+                pending = {name: reason for name, reason in get_graph().plan(figures).items() if reason}
+                print(f"{sample:<16} {'up to date' if not pending else 'rebuild ' + ', '.join(pending)}")
+            return 0
+        start = time.perf_counter()
+        # Only the shared reference tables are converted in the driver, a single time; each worker parses its own sample
+        if REFERENCE_DIR:
+            prepare_inputs(figures, REFERENCE_FILES)
+        workers = args.workers or min(len(samples), info['num_cores'] or 1)
+        os.environ['POLARS_MAX_THREADS'] = str(max(1, (info['num_cores'] or 1) // workers))
+        # Every sample worker may be rendering a tiled figure at the same time
+        export_settings = configure_export(tile_workers=tile_budget(args.facet_tiles, workers, info['num_cores']))
+        settings = {'data_dir': DATA_DIR, 'cache_dir': args.cache_dir, 'budget': budget // workers,
+                    'export': export_settings, 'figure_params': figure_params, 'gene_model': args.gene_model,
+                    'sv_calls': SV_CALLS, 'region': args.region, 'reference_dir': args.reference_dir, 'trace_dir': trace_dir,
+                    'stats_dir': stats_dir}
+        tasks = {sample: (run_sample, (sample, data_dir, sample_out_dir(args.cohort_out, sample), args.force, figures))
+                 for sample, data_dir in samples}
+        results = run_tasks(tasks, workers=workers, initializer=init_worker, initargs=(settings,))
+        failed = summarize(results, time.perf_counter() - start)
+        finish_cache(stats_dir)
+        finish_trace(args.trace, trace_dir)
+        return 1 if failed else 0
+
+    if args.dry_run:
+        for name, reason in get_graph().plan(figures).items():
+            print(f"{name:<12} {'rebuild (' + reason + ')' if reason else 'up to date'}")
+        return 0
+
+    if args.watch:
+        from watch import WatchDaemon
+        # Build in this process, which keeps the imports, parsed tables and renderer warm between builds
+        export_settings = configure_export(tile_workers=tile_budget(args.facet_tiles, 1, info['num_cores']))
+        init_worker({'data_dir': DATA_DIR, 'cache_dir': args.cache_dir, 'budget': budget, 'export': export_settings,
+                     'figure_params': figure_params, 'gene_model': args.gene_model, 'sv_calls': SV_CALLS,
+                     'region': args.region, 'reference_dir': args.reference_dir})
+        return WatchDaemon(sys.modules[__name__], figures, port=args.control_port or None).run(force=args.force)
+
+    start = time.perf_counter()
+    prepare_inputs(figures)
+    tasks = {name: (build_figure, (name, args.force)) for name in figures}
+    workers = args.workers or min(len(tasks), info['num_cores'] or 1)
+    # Each worker gets its share of the memory budget, of the polars thread pool and of the tile processes
+    os.environ['POLARS_MAX_THREADS'] = str(max(1, (info['num_cores'] or 1) // workers))
+    tiled = min(workers, len([name for name in figures if name in TILED_FIGURES]))
+    export_settings = configure_export(tile_workers=tile_budget(args.facet_tiles, tiled, info['num_cores']))
+    settings = {'data_dir': DATA_DIR, 'cache_dir': args.cache_dir, 'budget': budget // workers,
+                'export': export_settings, 'figure_params': figure_params, 'gene_model': args.gene_model,
+                'sv_calls': SV_CALLS, 'region': args.region, 'trace_dir': trace_dir, 'stats_dir': stats_dir}
+    results = run_tasks(tasks, workers=workers, initializer=init_worker, initargs=(settings,), cost=FIGURE_COST)
+    failed = summarize(results, time.perf_counter() - start)
+    finish_cache(stats_dir)
+    finish_trace(args.trace, trace_dir)
+    return 1 if failed else 0
+
+
 if __name__ == "__main__":
-    system_info()
-    plot_figure1()
-    plot_figure2()
-    plot_figure3()
-    plot_figure4()
+    sys.exit(main())
@@ -0,0 +1,405 @@
+import os
+import json
+import argparse
+import numpy as np
+import polars as pl
+from schemas import WINDOW_SCHEMA, GENOME_SCHEMA, chromosome_keys, headerless_columns
+from streaming import memory_size
+## -------- ##
+## SAMPLES x WINDOWS DENSITY MATRIX ##
+# Population statistics need the window counts of every individual aligned on one set of windows. The
+# windows are laid out in Genome_text.tsv chromosome order (natural order of the labels), at a fixed
+# resolution, and the counts of each sample are one row of a uint32 samples x windows matrix in a raw
+# memory-mapped file. Appending a sample appends one row, so a cohort is built one sample at a time.
+# Reductions read blocks of window columns across all samples, sized to a memory budget, so they run on
+# cohorts whose matrix does not fit in RAM.
+
+COUNTS_FILE = 'counts.u32'
+WINDOWS_FILE = 'windows.arrow'
+META_FILE = 'matrix.json'
+# Bytes of the block-sized float64 working arrays a reduction holds at once
+BLOCK_BYTES = 256 * 1024 ** 2
+WINDOW_FORMAT = {'separator': '\t', 'has_header': False, 'schema_overrides': WINDOW_SCHEMA}
+# 1.4826 * MAD estimates the standard deviation of normally distributed values
+MAD_SCALE = 1.4826
+
+
+def read_windows(source):
+    # A *_window_Variant_Count*.bed table, or an already loaded frame
+    if isinstance(source, pl.DataFrame):
+        return source
+    return pl.read_csv(source, new_columns=headerless_columns(source), **WINDOW_FORMAT)
+
+
+class DensityMatrix:
+    """
+    Samples x windows variant count matrix on a memory-mapped file, with chunked reductions across samples.
+
+    Parameters:
+    -----------
+    path : str
+        Matrix directory written by `DensityMatrix.create` (counts.u32, windows.arrow and matrix.json).
+
+    block_bytes : int, optional (default: BLOCK_BYTES)
+        Memory for the working arrays of a reduction. Blocks of window columns (float64 values of all samples)
+        are sized so that all the block-sized arrays a reduction holds at once fit in it.
+
+    Example Usage:
+    --------------
+    >>> matrix = DensityMatrix.create('cohort_10Kb', chr_map, 10_000)
+    >>> matrix.append('MF001', 'cohort/MF001/10Kb_window_Variant_Count.bed')
+    >>> matrix.window_stats()
+    """
+
+    def __init__(self, path, block_bytes=BLOCK_BYTES):
+        with open(os.path.join(path, META_FILE)) as handle:
+            meta = json.load(handle)
+        self.path, self.block_bytes = path, block_bytes
+        self.samples, self.resolution = meta['samples'], meta['resolution']
+        self.windows = pl.read_ipc(os.path.join(path, WINDOWS_FILE))
+        self.widths = (self.windows['End'] - self.windows['Start']).cast(pl.Float64).to_numpy()
+        # First window and window count of every sequence, to place the rows of a sample table
+        self.offsets = self.windows.with_row_index('offset').group_by('column_1', maintain_order=True).agg(
+            pl.col('offset').first(), n=pl.len()).with_columns(pl.col('column_1').cast(pl.Utf8))
+
+    @classmethod
+    def create(cls, path, chr_map, resolution, block_bytes=BLOCK_BYTES):
+        """
+        Function to lay out the windows of an empty matrix.
+
+        Parameters:
+        -----------
+        path : str
+            Directory of the new matrix.
+
+        chr_map : polars.DataFrame
+            Genome_text.tsv: column_1 the sequence name, column_2 its length in bp, column_3 the chromosome label.
+
+        resolution : int
+            Window size in bp, e.g. 10_000 for the 10Kb tables.
+
+        Returns:
+        --------
+        DensityMatrix
+        """
+        if 'column_2' not in chr_map.columns or chr_map['column_2'].null_count():
+            raise ValueError("Genome_text.tsv needs the sequence lengths (column 2) to lay out the windows")
+        keyed = chromosome_keys(chr_map)
+        lengths = keyed['column_2'].cast(pl.Int64).to_numpy()
+        counts = -(-lengths // resolution)
+        starts = np.concatenate([np.arange(n, dtype=np.int64) * resolution for n in counts])
+        ends = np.minimum(starts + resolution, np.repeat(lengths, counts))
+        windows = pl.DataFrame({
+            'Chromosome': keyed['column_3'].gather(np.repeat(np.arange(keyed.height), counts)),
+            'column_1': keyed['column_1'].gather(np.repeat(np.arange(keyed.height), counts)),
+            'Start': starts, 'End': ends,
+        }).with_columns(pl.col('Start', 'End').cast(pl.UInt32))
+
+        os.makedirs(path, exist_ok=True)
+        windows.write_ipc(os.path.join(path, WINDOWS_FILE), compression='uncompressed')
+        open(os.path.join(path, COUNTS_FILE), 'wb').close()
+        _write_meta(path, {'samples': [], 'resolution': resolution, 'windows': windows.height})
+        return cls(path, block_bytes)
+
+    @property
+    def counts(self):
+        # Read-only (samples x windows) view of the count file
+        if not self.samples:
+            return np.zeros((0, self.windows.height), dtype=np.uint32)
+        return np.memmap(os.path.join(self.path, COUNTS_FILE), dtype=np.uint32, mode='r',
+                         shape=(len(self.samples), self.windows.height))
+
+    def append(self, sample, table):
+        """
+        Function to add the window counts of one sample as a new row.
+
+        Parameters:
+        -----------
+        sample : str
+            Sample name; must not be in the matrix yet.
+
+        table : str or polars.DataFrame
+            A *_window_Variant_Count*.bed table at the matrix resolution. Windows on sequences missing from
+            Genome_text.tsv are left out, as in `Data_processing`.
+
+        Returns:
+        --------
+        int
+            The row of the sample.
+        """
+        if sample in self.samples:
+            raise ValueError(f"Sample {sample} is already in the matrix at {self.path}")
+        placed = read_windows(table).with_columns(pl.col('column_1').cast(pl.Utf8)).join(self.offsets, on='column_1')
+        start = placed['column_2'].cast(pl.Int64).to_numpy()
+        slot = start // self.resolution
+        if np.any(start % self.resolution) or np.any(slot >= placed['n'].to_numpy()):
+            raise ValueError(f"Windows of sample {sample} are not on the {self.resolution} bp grid of the matrix")
+        row = np.bincount(placed['offset'].to_numpy() + slot, weights=placed['column_4'].to_numpy(),
+                          minlength=self.windows.height).astype(np.uint32)
+
+        counts_path = os.path.join(self.path, COUNTS_FILE)
+        with open(counts_path, 'r+b') as handle:
+            # Drop the partial row of an interrupted append before writing this one
+            handle.truncate(len(self.samples) * self.windows.height * 4)
+            handle.seek(0, os.SEEK_END)
+            handle.write(row.tobytes())
+        self.samples.append(sample)
+        _write_meta(self.path, {'samples': self.samples, 'resolution': self.resolution, 'windows': self.windows.height})
+        return len(self.samples) - 1
+
+    def blocks(self, density=True, copies=1):
+        """
+        Function to iterate over blocks of window columns.
+
+        Parameters:
+        -----------
+        density : bool, optional (default: True)
+            Divide the counts by the window width (percent of bp), so truncated last windows compare with full ones.
+
+        copies : int, optional (default: 1)
+            Block-sized arrays the caller holds at once (the block included); each block is block_bytes / copies.
+
+        Returns:
+        --------
+        generator
+            (first window, last window + 1, float64 array of samples x block windows).
+        """
+        counts = self.counts
+        step = max(1, self.block_bytes // (8 * max(1, len(self.samples)) * copies))
+        for first in range(0, self.windows.height, step):
+            last = min(first + step, self.windows.height)
+            block = counts[:, first:last].astype(np.float64)
+            if density:
+                block *= 100 / self.widths[first:last]
+            yield first, last, block
+
+    def window_stats(self, density=True):
+        """
+        Function to compute the mean and variance of every window across samples.
+
+        Returns:
+        --------
+        polars.DataFrame
+            The windows with Mean, Variance (n - 1 denominator) and CV of the density (or count), the index of
+            dispersion of the counts (variance / mean; ~1 for Poisson noise) and Hypervariable_z, the robust z-score
+            of the log dispersion across windows. Windows without variants in any sample get null scores.
+        """
+        n = len(self.samples)
+        mean, variance, dispersion = (np.full(self.windows.height, np.nan) for _ in range(3))
+        # The block and the deviations block.var works on
+        for first, last, block in self.blocks(density=False, copies=2):
+            count_mean = block.mean(axis=0)
+            count_var = block.var(axis=0, ddof=1) if n > 1 else np.full(last - first, np.nan)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                dispersion[first:last] = np.where(count_mean > 0, count_var / count_mean, np.nan)
+            scale = 100 / self.widths[first:last] if density else 1.0
+            mean[first:last], variance[first:last] = count_mean * scale, count_var * scale ** 2
+
+        log_dispersion = np.log(dispersion, where=dispersion > 0, out=np.full_like(dispersion, np.nan))
+        centre = np.nanmedian(log_dispersion) if np.isfinite(log_dispersion).any() else np.nan
+        spread = MAD_SCALE * np.nanmedian(np.abs(log_dispersion - centre)) if np.isfinite(centre) else np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            hyper = (log_dispersion - centre) / spread
+            cv = np.sqrt(variance) / mean
+        return self.windows.with_columns(pl.col('Chromosome', 'column_1').cast(pl.Utf8)).with_columns(
+            Mean=pl.Series(mean), Variance=pl.Series(variance), CV=pl.Series(cv),
+            Dispersion=pl.Series(dispersion), Hypervariable_z=pl.Series(hyper)).fill_nan(None)
+
+    def outlier_scores(self, threshold=5.0, density=True, out=None):
+        """
+        Function to score every sample in every window against the other samples, and list the outliers.
+
+        Parameters:
+        -----------
+        threshold : float, optional (default: 5.0)
+            Smallest absolute robust z-score listed.
+
+        density : bool, optional (default: True)
+            Score the density rather than the raw count.
+
+        out : str, optional (default: None)
+            Also write the full float32 samples x windows score matrix to this raw file (memory-mappable
+            with `np.memmap(out, dtype=np.float32, shape=(len(samples), len(windows)))`).
+
+        Returns:
+        --------
+        polars.DataFrame
+            Sample, Chromosome, column_1, Start, End, Value and Z for every |Z| >= threshold, where
+            Z = (value - median) / (1.4826 * MAD) across samples. Windows where more than half of the samples
+            share a value (MAD 0) fall back to the standard deviation; constant windows are not scored.
+
+        Notes:
+        ------
+        - Peak memory is about block_bytes: blocks are sized for the block and one scratch array, plus boolean
+          masks of an eighth of a block each.
+        """
+        scores = np.memmap(out, dtype=np.float32, mode='w+', shape=(len(self.samples), self.windows.height)) if out else None
+        hits = []
+        # The block and one scratch array, reused for the medians, the deviations and the z-scores
+        for first, last, block in self.blocks(density=density, copies=2):
+            scratch = block.copy()
+            median = np.median(scratch, axis=0, overwrite_input=True)
+            np.subtract(block, median, out=scratch)
+            np.abs(scratch, out=scratch)
+            spread = MAD_SCALE * np.median(scratch, axis=0, overwrite_input=True)
+            flat = ~(spread > 0)
+            if flat.any():
+                # Standard deviation where the MAD is 0, computed in the scratch array
+                np.subtract(block, block.mean(axis=0), out=scratch)
+                np.square(scratch, out=scratch)
+                spread = np.where(flat, np.sqrt(scratch.mean(axis=0)), spread)
+            z = np.subtract(block, median, out=scratch)
+            np.divide(z, spread, out=z, where=spread > 0)
+            z[:, ~(spread > 0)] = 0.0
+            if scores is not None:
+                scores[:, first:last] = z
+            sample, window = np.nonzero((z >= threshold) | (z <= -threshold))
+            hits.append((sample, window + first, block[sample, window], z[sample, window]))
+        if scores is not None:
+            scores.flush()
+
+        sample, window, value, z = (np.concatenate(part) for part in zip(*hits)) if hits else (np.empty(0, dtype=np.int64),) * 4
+        windows = self.windows.with_columns(pl.col('Chromosome', 'column_1').cast(pl.Utf8))
+        names = pl.Series('Sample', self.samples, dtype=pl.Utf8).gather(pl.Series(sample))
+        return windows.select(pl.all().gather(pl.Series(window))).insert_column(0, names).with_columns(
+            Value=pl.Series(value, dtype=pl.Float64), Z=pl.Series(z, dtype=pl.Float64))
+
+    def distances(self, metric='euclidean', density=True):
+        """
+        Function to compute the distance between every pair of samples over all windows.
+
+        Parameters:
+        -----------
+        metric : str, optional (default: 'euclidean')
+            'euclidean' or 'correlation' (1 - Pearson correlation of the window profiles).
+
+        density : bool, optional (default: True)
+            Compare densities rather than raw counts.
+
+        Returns:
+        --------
+        polars.DataFrame
+            Square matrix with a Sample column and one column per sample.
+
+        Notes:
+        ------
+        - The Gram matrix and per-sample sums are accumulated block by block (one matrix product per block),
+          so the samples x windows matrix is read once and never held in memory.
+        """
+        if metric not in ('euclidean', 'correlation'):
+            raise ValueError(f"Unknown metric '{metric}'; choose euclidean or correlation")
+        n = len(self.samples)
+        gram, sums = np.zeros((n, n)), np.zeros(n)
+        for _, _, block in self.blocks(density=density):
+            gram += block @ block.T
+            sums += block.sum(axis=1)
+        norms = np.diag(gram)
+        if metric == 'euclidean':
+            distance = np.sqrt(np.maximum(norms[:, None] + norms[None, :] - 2 * gram, 0))
+        else:
+            m = self.windows.height
+            covariance = gram - np.outer(sums, sums) / m
+            scale = np.sqrt(np.maximum(np.diag(covariance), 0))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                distance = 1 - covariance / np.outer(scale, scale)
+        np.fill_diagonal(distance, 0)
+        return pl.DataFrame({'Sample': self.samples, **{sample: distance[:, i] for i, sample in enumerate(self.samples)}}).fill_nan(None)
+
+
+def _write_meta(path, meta):
+    # Replace the metadata atomically, so an interrupted append leaves the previous sample list
+    tmp_path = os.path.join(path, f'{META_FILE}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as handle:
+        json.dump(meta, handle)
+    os.replace(tmp_path, os.path.join(path, META_FILE))
+
+
+def build_matrix(samples, path, table='10Kb_window_Variant_Count.bed', chr_map=None, resolution=None, block_bytes=BLOCK_BYTES,
+                 progress=None):
+    """
+    Function to create a density matrix, or extend an existing one, with the window tables of a cohort.
+
+    Parameters:
+    -----------
+    samples : list of tuple
+        (sample, data_dir) pairs, e.g. from `cohort.read_manifest`.
+
+    path : str
+        Matrix directory. Samples already in it are skipped, so an interrupted build can be resumed.
+
+    table : str, optional (default: '10Kb_window_Variant_Count.bed')
+        Window table read from every data directory.
+
+    chr_map : polars.DataFrame, optional (default: None)
+        Genome_text.tsv with sequence lengths. None reads it from the first sample's data directory.
+
+    resolution : int, optional (default: None)
+        Window size in bp. None takes the widest window of the first sample's table.
+
+    progress : callable, optional (default: None)
+        Called as progress(sample, row) after each sample is added.
+
+    Returns:
+    --------
+    DensityMatrix
+
+    Example Usage:
+    --------------
+    >>> matrix = build_matrix(read_manifest('cohort.tsv'), 'cohort_10Kb')
+    """
+    if os.path.exists(os.path.join(path, META_FILE)):
+        matrix = DensityMatrix(path, block_bytes)
+    else:
+        first = os.path.join(samples[0][1], table)
+        if chr_map is None:
+            genome_text = os.path.join(samples[0][1], 'Genome_text.tsv')
+            chr_map = pl.read_csv(genome_text, separator='\t', has_header=False, new_columns=headerless_columns(genome_text),
+                                  schema_overrides=GENOME_SCHEMA)
+        if resolution is None:
+            windows = read_windows(first)
+            resolution = int((windows['column_3'].cast(pl.Int64) - windows['column_2'].cast(pl.Int64)).max())
+        matrix = DensityMatrix.create(path, chr_map, resolution, block_bytes)
+    for sample, data_dir in samples:
+        if sample in matrix.samples:
+            continue
+        row = matrix.append(sample, os.path.join(data_dir, table))
+        if progress is not None:
+            progress(sample, row)
+    return matrix
+
+
+if __name__ == "__main__":
+    from cohort import read_manifest
+    parser = argparse.ArgumentParser(description="Build a samples x windows density matrix and compute population statistics on it")
+    parser.add_argument('--matrix', required=True, help="Matrix directory (created if missing, extended otherwise)")
+    parser.add_argument('--cohort', default=None, help="Manifest (TSV with sample and data_dir columns) of the samples to add")
+    parser.add_argument('--table', default='10Kb_window_Variant_Count.bed',
+                        help="Window table of every sample (default: 10Kb_window_Variant_Count.bed)")
+    parser.add_argument('--reference-dir', default=None,
+                        help="Directory with Genome_text.tsv (with sequence lengths). Default: the first sample's data directory")
+    parser.add_argument('--resolution', type=int, default=None, help="Window size in bp (default: from the first table)")
+    parser.add_argument('--block-memory', type=memory_size, default=BLOCK_BYTES,
+                        help="Memory for the block-sized working arrays of each statistic (default: 256M)")
+    parser.add_argument('--threshold', type=float, default=5.0, help="Smallest absolute robust z-score listed as an outlier (default: 5)")
+    parser.add_argument('--metric', choices=['euclidean', 'correlation'], default='euclidean', help="Sample distance (default: euclidean)")
+    parser.add_argument('--out-prefix', default=None, help="Prefix of the output tables (default: the matrix directory)")
+    args = parser.parse_args()
+
+    block_bytes = args.block_memory
+    if args.cohort:
+        chr_map = None
+        if args.reference_dir:
+            genome_text = os.path.join(args.reference_dir, 'Genome_text.tsv')
+            chr_map = pl.read_csv(genome_text, separator='\t', has_header=False, new_columns=headerless_columns(genome_text),
+                                  schema_overrides=GENOME_SCHEMA)
+        matrix = build_matrix(read_manifest(args.cohort), args.matrix, args.table, chr_map, args.resolution, block_bytes,
+                              progress=lambda sample, row: print(f"{sample}: added as row {row}"))
+    else:
+        matrix = DensityMatrix(args.matrix, block_bytes)
+
+    prefix = args.out_prefix or args.matrix.rstrip('/')
+    matrix.window_stats().write_csv(f'{prefix}_window_stats.tsv', separator='\t')
+    matrix.outlier_scores(args.threshold).write_csv(f'{prefix}_outliers.tsv', separator='\t')
+    matrix.distances(args.metric).write_csv(f'{prefix}_distances.tsv', separator='\t')
+    print(f"{len(matrix.samples)} samples x {matrix.windows.height} windows; wrote {prefix}_window_stats.tsv, "
+          f"{prefix}_outliers.tsv and {prefix}_distances.tsv")
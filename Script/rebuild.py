@@ -0,0 +1,346 @@
+import os
+import ast
+import json
+import hashlib
+import inspect
+import importlib
+from collections import namedtuple
+import polars as pl
+from tracing import stage
+## -------- ##
+## INCREMENTAL REBUILD GRAPH ##
+# Each figure is a node: input files -> processing function -> plot function(params) -> output files.
+# Fingerprints of the inputs, the code, the parameters and the processed frame are stored per figure,
+# so a rerun rebuilds only the figures whose upstream nodes changed.
+
+# inputs: list of (file name, read options); process(*process_args) returns the arguments of plot,
+# either as a tuple of positional arguments or as a dict of keyword arguments.
+# process, plot and deps may be given as 'module:function' so the module is imported only when needed.
+# Code reached from process, plot and deps (see `code_closure`) is fingerprinted; deps lists code that is not
+# referenced by name from them.
+FigureNode = namedtuple('FigureNode', ['inputs', 'process', 'process_args', 'plot', 'params', 'deps'])
+# Modules in this directory are pipeline code; installed libraries are not fingerprinted
+LOCAL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def resolve(func):
+    # 'Figure4:Plot_TrendPerChr' -> the function, importing its module on first use
+    if isinstance(func, str):
+        module, _, name = func.partition(':')
+        return getattr(importlib.import_module(module), name)
+    return func
+
+
+def call_plot(node, processed):
+    # Hand the processed data to the plot function together with the node's plot parameters
+    plot = resolve(node.plot)
+    if isinstance(processed, dict):
+        return plot(**processed, **node.params)
+    return plot(*processed, **node.params)
+
+
+def _digest(*parts):
+    return hashlib.blake2b('|'.join(str(p) for p in parts).encode(), digest_size=16).hexdigest()
+
+
+def _code_objects(code):
+    # A code object and the code of the functions, lambdas and comprehensions nested in it
+    yield code
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            yield from _code_objects(const)
+
+
+def _local_file(obj):
+    # Source file of a module, function or class defined in this directory (the pipeline), else None
+    path = getattr(obj, '__file__', None) if inspect.ismodule(obj) else getattr(inspect.getmodule(obj), '__file__', None)
+    if path and os.path.dirname(os.path.abspath(path)) == LOCAL_DIR:
+        return os.path.abspath(path)
+    return None
+
+
+def local_imports(path, top_level=False):
+    """
+    Function to list the pipeline modules (files in this directory) a source file imports.
+
+    Parameters:
+    -----------
+    path : str
+        Python source file.
+
+    top_level : bool, optional (default: False)
+        Only imports executed when the module is imported, not those inside functions.
+
+    Returns:
+    --------
+    set of str
+        Paths of the imported pipeline modules.
+    """
+    with open(path) as handle:
+        tree = ast.parse(handle.read(), path)
+    names = set()
+    for item in (tree.body if top_level else ast.walk(tree)):
+        if isinstance(item, ast.Import):
+            names.update(alias.name.partition('.')[0] for alias in item.names)
+        elif isinstance(item, ast.ImportFrom) and item.module and not item.level:
+            names.add(item.module.partition('.')[0])
+    return {os.path.join(LOCAL_DIR, f'{name}.py') for name in names if os.path.exists(os.path.join(LOCAL_DIR, f'{name}.py'))}
+
+
+def code_closure(*functions):
+    """
+    Function to collect the pipeline code a set of functions runs: their own source, every function or class of
+    this directory they reference, and whole modules reached through a module name (e.g. a lazy `from tiles import ...`).
+
+    Parameters:
+    -----------
+    *functions : callable or str
+        Functions, or 'module:function' references.
+
+    Returns:
+    --------
+    dict
+        Mapping of each unit ('file:qualname' for functions and classes, the module path for whole modules) to its source.
+
+    Example Usage:
+    --------------
+    >>> sorted(code_closure('Figure4:Plot_TrendPerChr'))  # includes loess.grouped_loess and export.compile_chart
+    """
+    units, stack = {}, list(map(resolve, functions))
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, str):
+            # A whole module file, followed through its imports of other pipeline modules
+            if obj not in units:
+                with open(obj) as handle:
+                    units[obj] = handle.read()
+                stack.extend(local_imports(obj))
+            continue
+        path = _local_file(obj)
+        if inspect.ismodule(obj):
+            if path:
+                stack.append(path)
+            continue
+        key = f"{os.path.basename(path or '')}:{getattr(obj, '__qualname__', repr(obj))}"
+        if key in units:
+            continue
+        try:
+            units[key] = inspect.getsource(obj)
+        except (OSError, TypeError):
+            units[key] = key
+        if path is None:
+            continue
+        if inspect.isclass(obj):
+            functions_of = [item for item in vars(obj).values() if inspect.isfunction(getattr(item, '__func__', item))]
+            codes = [code for item in functions_of for code in _code_objects(getattr(item, '__func__', item).__code__)]
+            namespace = vars(inspect.getmodule(obj))
+        elif hasattr(obj, '__code__'):
+            codes, namespace = list(_code_objects(obj.__code__)), obj.__globals__
+        else:
+            continue
+        for name in {name for code in codes for name in code.co_names}:
+            if name in namespace:
+                target = namespace[name]
+                if inspect.ismodule(target) or inspect.isfunction(target) or inspect.isclass(target):
+                    if _local_file(target):
+                        stack.append(target)
+            elif os.path.exists(os.path.join(LOCAL_DIR, f'{name}.py')):
+                # Imported inside the function body: the module is not a global, so take all of it
+                stack.append(os.path.join(LOCAL_DIR, f'{name}.py'))
+    return units
+
+
+def code_files(*functions):
+    """
+    Function to list the source files of the pipeline code a set of functions runs (see `code_closure`).
+    """
+    files = set()
+    for key in code_closure(*functions):
+        name = key if os.path.isabs(key) else key.partition(':')[0]
+        if name:
+            files.add(os.path.join(LOCAL_DIR, name))
+    return files
+
+
+def code_fingerprint(*functions):
+    """
+    Function to fingerprint the source code a figure depends on, so styling edits trigger a rebuild. Helpers the
+    functions call are followed through `code_closure`, so an edit to e.g. export.compile_chart or loess.py counts.
+    """
+    units = code_closure(*functions)
+    # Keyed by file name rather than full path, so a moved checkout keeps its state
+    named = {os.path.basename(key) if os.path.isabs(key) else key: source for key, source in units.items()}
+    return _digest(*(f'{key}\n{named[key]}' for key in sorted(named)))
+
+
+def frame_fingerprint(values):
+    """
+    Function to fingerprint the processed data handed to a plot function.
+
+    Parameters:
+    -----------
+    values : tuple or dict
+        The arguments of the plot function. polars frames are hashed by schema and row hashes,
+        anything else by its repr.
+
+    Returns:
+    --------
+    str
+        Hex digest of the intermediate data.
+    """
+    digest = hashlib.blake2b(pl.__version__.encode(), digest_size=16)
+    if isinstance(values, dict):
+        digest.update(repr(sorted(values)).encode())
+        values = [values[key] for key in sorted(values)]
+    for value in values:
+        if isinstance(value, pl.DataFrame):
+            digest.update(repr(value.schema).encode())
+            digest.update(value.hash_rows(seed=0).to_numpy().tobytes())
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+class RebuildGraph:
+    """
+    Dependency graph mapping each figure to its inputs, processing function and plot parameters.
+
+    Parameters:
+    -----------
+    nodes : dict
+        Mapping of figure name (also its save_name) to a FigureNode.
+
+    state_dir : str
+        Directory holding one fingerprint file per figure. One file per figure lets parallel workers record state without locking.
+
+    input_path : callable
+        Maps an input file name to its full path.
+
+    file_fingerprint : callable
+        Returns the content fingerprint of a file (e.g. `DatasetRegistry.fingerprint`).
+
+    export_settings : callable
+        Returns the export settings in effect; formats and ppi are part of the fingerprint.
+
+    Example Usage:
+    --------------
+    >>> graph = RebuildGraph(FIGURE_GRAPH, '.cache/rebuild', data_path, registry.fingerprint, lambda: EXPORT_SETTINGS)
+    >>> graph.plan(['Figure2', 'Figure4'])
+    """
+
+    def __init__(self, nodes, state_dir, input_path, file_fingerprint, export_settings):
+        self.nodes = nodes
+        self.state_dir = state_dir
+        self.input_path = input_path
+        self.file_fingerprint = file_fingerprint
+        self.export_settings = export_settings
+        os.makedirs(state_dir, exist_ok=True)
+
+    # State
+    def _state_path(self, name):
+        return os.path.join(self.state_dir, f'{name}.json')
+
+    def _load_state(self, name):
+        try:
+            with open(self._state_path(name)) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, name, state):
+        tmp_path = f'{self._state_path(name)}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as handle:
+            json.dump(state, handle, indent=1)
+        os.replace(tmp_path, self._state_path(name))
+
+    # Fingerprints
+    def upstream_key(self, name):
+        node = self.nodes[name]
+        inputs = [(file, json.dumps(opts, sort_keys=True, default=str), self.file_fingerprint(self.input_path(file))[3]) for file, opts in node.inputs]
+        return _digest(inputs, code_fingerprint(node.process, *node.deps), repr(node.process_args))
+
+    def downstream_key(self, name):
+        node = self.nodes[name]
+        settings = self.export_settings()
+        return _digest(code_fingerprint(node.plot), json.dumps(node.params, sort_keys=True, default=str),
+                       settings['formats'], settings['ppi'])
+
+    def outputs(self, name):
+        settings = self.export_settings()
+        save_name = self.nodes[name].params.get('save_name', name)
+        extension = {'json': 'vg.json'}
+        return [os.path.join(settings['out_dir'], f'{save_name}.{extension.get(fmt, fmt)}') for fmt in settings['formats']]
+
+    def _reason(self, name, state, upstream, downstream):
+        if not state:
+            return 'never built'
+        missing = [path for path in self.outputs(name) if not os.path.exists(path)]
+        if missing:
+            return f'missing {os.path.basename(missing[0])}'
+        if state.get('upstream') != upstream:
+            changed = [file for file, _ in self.nodes[name].inputs
+                       if state.get('inputs', {}).get(file) != self.file_fingerprint(self.input_path(file))[3]]
+            return f"inputs changed: {', '.join(changed)}" if changed else 'processing code changed'
+        if state.get('downstream') != downstream:
+            return 'plot code or parameters changed'
+        return None
+
+    def plan(self, names):
+        """
+        Function to work out which figures would rebuild, without reading or rendering anything.
+
+        Parameters:
+        -----------
+        names : list of str
+            Figures to check.
+
+        Returns:
+        --------
+        dict
+            Mapping of figure name to the reason it would rebuild, or None when it is up to date.
+        """
+        return {name: self._reason(name, self._load_state(name), self.upstream_key(name), self.downstream_key(name))
+                for name in names}
+
+    def build(self, name, force=False):
+        """
+        Function to rebuild a figure only if something upstream of it changed.
+
+        Parameters:
+        -----------
+        name : str
+            Figure to build.
+
+        force : bool, optional (default: False)
+            Rebuild even when all fingerprints match.
+
+        Returns:
+        --------
+        str
+            'up to date', 'data unchanged' (inputs changed but the processed frame did not) or 'rebuilt'.
+        """
+        node = self.nodes[name]
+        state = self._load_state(name)
+        upstream, downstream = self.upstream_key(name), self.downstream_key(name)
+        reason = 'forced' if force else self._reason(name, state, upstream, downstream)
+        if reason is None:
+            return 'up to date'
+
+        with stage(f'{name} process', 'transform'):
+            args = resolve(node.process)(*node.process_args)
+        frame = frame_fingerprint(args)
+        new_state = {
+            'upstream': upstream,
+            'downstream': downstream,
+            'frame': frame,
+            'inputs': {file: self.file_fingerprint(self.input_path(file))[3] for file, _ in node.inputs},
+        }
+        outputs_exist = all(os.path.exists(path) for path in self.outputs(name))
+        if not force and outputs_exist and state.get('frame') == frame and state.get('downstream') == downstream:
+            self._save_state(name, new_state)
+            return 'data unchanged'
+
+        with stage(f'{name} chart', 'chart'):
+            call_plot(node, args)
+        self._save_state(name, new_state)
+        return 'rebuilt'
@@ -0,0 +1,117 @@
+import os
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+## -------- ##
+## FIGURE TASK SCHEDULER ##
+# Each chart is an independent task. Tasks run on a process pool so that the slow vl-convert
+# renders overlap; a failing task is reported but never aborts the others.
+
+
+def _run_task(name, func, args):
+    """
+    Run one task and capture its outcome instead of raising, so that the pool keeps going.
+    """
+    start = time.perf_counter()
+    try:
+        func(*args)
+        return name, True, time.perf_counter() - start, None
+    except Exception:
+        return name, False, time.perf_counter() - start, traceback.format_exc()
+
+
+def run_tasks(tasks, workers=None, initializer=None, initargs=(), cost=None):
+    """
+    Function to run named tasks across a process pool.
+
+    Parameters:
+    -----------
+    tasks : dict
+        Mapping of task name to a module-level function (so it can be pickled), or to a (function, args) tuple.
+
+    workers : int, optional (default: None)
+        Number of worker processes. None uses one per task up to the CPU count; 1 runs everything in this process.
+
+    initializer : callable, optional (default: None)
+        Called once in every worker (and once in-process when workers is 1) to set up shared state.
+
+    initargs : tuple, optional (default: ())
+        Arguments for the initializer.
+
+    cost : dict, optional (default: None)
+        Relative cost of each task. The most expensive tasks are submitted first so the slowest figure starts immediately.
+
+    Returns:
+    --------
+    dict
+        Mapping of task name to (ok, elapsed seconds, traceback or None).
+
+    Example Usage:
+    --------------
+    >>> results = run_tasks({'Figure2': plot_figure2, 'Figure3BC': plot_figure3}, workers=2)
+    """
+    cost = cost or {}
+    order = sorted(tasks, key=lambda name: -cost.get(name, 1))
+    jobs = {name: tasks[name] if isinstance(tasks[name], tuple) else (tasks[name], ()) for name in order}
+    if workers is None:
+        workers = min(len(jobs), os.cpu_count() or 1)
+    workers = max(1, min(workers, len(jobs)))
+
+    results = {}
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for name, (func, args) in jobs.items():
+            _, ok, elapsed, error = _run_task(name, func, args)
+            results[name] = (ok, elapsed, error)
+            _report(name, ok, elapsed, error)
+        return results
+
+    # Spawn instead of fork: forking after polars has started its thread pool can deadlock
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=initializer, initargs=initargs) as pool:
+        futures = {pool.submit(_run_task, name, func, args): name for name, (func, args) in jobs.items()}
+        for future in as_completed(futures):
+            try:
+                name, ok, elapsed, error = future.result()
+            except Exception:
+                # The worker itself died (e.g. OOM-killed); report the task instead of aborting the run
+                name, ok, elapsed, error = futures[future], False, 0.0, traceback.format_exc()
+            results[name] = (ok, elapsed, error)
+            _report(name, ok, elapsed, error)
+    return results
+
+
+def _report(name, ok, elapsed, error):
+    if ok:
+        print(f"[done]   {name} in {elapsed:.1f}s")
+    else:
+        print(f"[failed] {name} after {elapsed:.1f}s\n{error}")
+
+
+def summarize(results, wall_time):
+    """
+    Function to print a summary of a scheduler run.
+
+    Parameters:
+    -----------
+    results : dict
+        Output of `run_tasks`.
+
+    wall_time : float
+        End-to-end time of the run in seconds.
+
+    Returns:
+    --------
+    list
+        Names of the failed tasks.
+    """
+    failed = [name for name, (ok, _, _) in results.items() if not ok]
+    slowest = max((elapsed for _, elapsed, _ in results.values()), default=0.0)
+    print(f"Rendered {len(results) - len(failed)}/{len(results)} figures in {wall_time:.1f}s "
+          f"(slowest single figure: {slowest:.1f}s)")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+    return failed
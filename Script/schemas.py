@@ -0,0 +1,90 @@
+import re
+import polars as pl
+## -------- ##
+## INPUT SCHEMAS AND CHROMOSOME KEYS ##
+# Declared column types for every input format, so nothing is inferred from the headerless files:
+# positions are UInt32 (every macaque chromosome is below 2^32 bp) and counts unsigned. Chromosomes
+# are an Enum whose categories come from Genome_text.tsv in natural order (chr1, chr2, ..., chr10, ..., chrX),
+# so joins run on the integer codes and sorting by chromosome needs neither natsort nor name padding.
+
+GENOME_SCHEMA = {'column_1': pl.Utf8, 'column_3': pl.Utf8}
+WINDOW_SCHEMA = {'column_1': pl.Utf8, 'column_2': pl.UInt32, 'column_3': pl.UInt32, 'column_4': pl.UInt32}
+CENTROMERE_SCHEMA = {'column_1': pl.Utf8, 'column_2': pl.UInt32, 'column_3': pl.UInt32}
+VARIANT_SCHEMA = {'col_1': pl.Categorical, 'col_2': pl.UInt32, 'col_8': pl.Categorical, 'col_14': pl.Categorical}
+# merged_SV_df.tsv window coordinates are in Mbp
+SV_WINDOW_SCHEMA = {'column_1': pl.Utf8, 'column_2': pl.Float64, 'column_3': pl.Float64, 'column_4': pl.UInt32,
+                    'Chromosome': pl.Utf8, 'Type': pl.Utf8}
+SV_LENGTH_SCHEMA = {'SVTYPE': pl.Utf8, 'Metric': pl.Utf8, 'Value': pl.Float64}
+
+
+def headerless_columns(path, separator='\t'):
+    """
+    Function to name the columns of a headerless table column_1, column_2, ..., as the schemas above expect.
+
+    polars 1.x numbers headerless columns from column_1 and 2.0 from column_0, so the names are passed explicitly
+    (as `new_columns`, with the width taken from the first line) to read the same way on both.
+    """
+    with open(path, 'rb') as handle:
+        first = handle.readline()
+    return [f'column_{i}' for i in range(1, first.count(separator.encode()) + 2)]
+
+
+# Names of the mitochondrial genome, which sorts after every nuclear chromosome
+MITOCHONDRIAL = {'MT', 'M', 'CHRM', 'CHRMT'}
+
+
+def natural_key(name):
+    # 'chr10' -> (False, ['chr', 10, '']), so chr2 sorts before chr10; 'MT' -> (True, ['MT']), so MT sorts last
+    text = str(name)
+    return text.upper() in MITOCHONDRIAL, [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', text)]
+
+
+def chromosome_keys(chr_map):
+    """
+    Function to turn the Genome_text.tsv table into integer-keyed chromosome columns.
+
+    Parameters:
+    -----------
+    chr_map : polars.DataFrame
+        Genome_text.tsv: column_1 the sequence name used in the window tables, column_3 the chromosome label.
+
+    Returns:
+    --------
+    polars.DataFrame
+        The same table, sorted naturally by label, with column_1 and column_3 cast to Enums in that order.
+
+    Example Usage:
+    --------------
+    >>> keyed = chromosome_keys(chr_map)
+    >>> keyed.schema['column_3']
+    Enum(categories=['chr1', 'chr2', ..., 'chrX', 'chrY', 'MT'])
+    """
+    labels = sorted(chr_map['column_3'].cast(pl.Utf8).unique().to_list(), key=natural_key)
+    ordered = chr_map.with_columns(pl.col('column_1').cast(pl.Utf8), pl.col('column_3').cast(pl.Enum(labels))).sort('column_3', maintain_order=True)
+    return ordered.with_columns(pl.col('column_1').cast(pl.Enum(ordered['column_1'].unique(maintain_order=True).to_list())))
+
+
+def to_enum(column, dtype):
+    """
+    Expression casting a string column to a chromosome Enum; names outside the Enum become null.
+    """
+    return pl.col(column).cast(pl.Utf8).cast(dtype, strict=False)
+
+
+def chromosome_levels(values):
+    """
+    Function to list the distinct chromosomes of a column in plotting order.
+
+    Enum columns keep their category order; plain strings are sorted naturally.
+    """
+    if isinstance(values.dtype, pl.Enum):
+        return values.drop_nulls().unique().sort().cast(pl.Utf8).to_list()
+    return sorted(values.cast(pl.Utf8).unique().drop_nulls().to_list(), key=natural_key)
+
+
+def plain_labels(df):
+    """
+    Function to cast Enum and Categorical columns back to strings, for chart data and concatenation.
+    """
+    return df.with_columns([pl.col(name).cast(pl.Utf8) for name, dtype in df.schema.items()
+                            if isinstance(dtype, (pl.Enum, pl.Categorical))])
@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import numpy as np
+import polars as pl
+from schemas import natural_key
+## -------- ##
+## REGION-QUERY VARIANT STORE ##
+# A locus-level question ("SV density around chr7:40-60 Mbp") should not re-read a whole table. VariantStore
+# keeps a copy of an input's Arrow sidecar sorted by (chromosome, start), plus a small in-memory index
+# with the chromosome range and the smallest start / largest end of every row group. A query
+# looks up the row groups that can overlap the region and slices them out of the memory-mapped file,
+# so only those pages are read from disk.
+
+ROW_GROUP = 65_536
+# Chromosome, start and end columns of each input, and the bp per unit of its coordinates
+STORE_LAYOUTS = {
+    'Variant.bed': ('col_1', 'col_2', 'col_3', 1),
+    'merged_SV_df.tsv': ('column_1', 'column_2', 'column_3', 10**6),
+}
+# Every *_window_Variant_Count*.bed
+WINDOW_LAYOUT = ('column_1', 'column_2', 'column_3', 1)
+_REGION = re.compile(r'^\s*([^:\s]+)(?::\s*([\d,.]+)\s*([kKmM]?[bB]?[pP]?)\s*-\s*([\d,.]+)\s*([kKmM]?[bB]?[pP]?))?\s*$')
+_UNITS = {'k': 10**3, 'm': 10**6}
+
+
+def layout_of(path):
+    return STORE_LAYOUTS.get(os.path.basename(path), WINDOW_LAYOUT)
+
+
+def parse_region(region):
+    """
+    Function to read a region such as 'chr7', 'chr7:40000000-60000000', 'chr7:40-60Mb' or 'chr7:40,000kb-60,000kb'.
+
+    Parameters:
+    -----------
+    region : str or tuple
+        The region text, or an already parsed (chromosome, start, end) tuple.
+
+    Returns:
+    --------
+    tuple
+        (chromosome, start, end) with start and end in bp (end exclusive); both None for a whole chromosome.
+
+    Example Usage:
+    --------------
+    >>> parse_region('chr7:40-60Mb')
+    ('chr7', 40000000, 60000000)
+    """
+    if isinstance(region, (tuple, list)):
+        chrom, start, end = region
+        return chrom, start, end
+    match = _REGION.match(str(region))
+    if not match:
+        raise ValueError(f"Cannot read region '{region}'; expected e.g. chr7, chr7:40000000-60000000 or chr7:40-60Mb")
+    chrom, start, start_unit, end, end_unit = match.groups()
+    if start is None:
+        return chrom, None, None
+    end_factor = _UNITS.get(end_unit[:1].lower(), 1)
+    # A single unit ('40-60Mb') applies to both bounds
+    start_factor = _UNITS.get(start_unit[:1].lower(), 1) if start_unit else end_factor
+    start, end = round(float(start.replace(',', '')) * start_factor), round(float(end.replace(',', '')) * end_factor)
+    if end <= start:
+        raise ValueError(f"Region '{region}' ends before it starts")
+    return chrom, start, end
+
+
+def format_region(region):
+    chrom, start, end = parse_region(region)
+    return chrom if start is None else f'{chrom}:{start / 10**6:g}-{end / 10**6:g} Mbp'
+
+
+def in_region(region, chrom, start, end=None, unit=1):
+    """
+    Expression selecting the rows of a table that overlap a region.
+
+    Parameters:
+    -----------
+    region : str or tuple
+        Anything `parse_region` accepts.
+
+    chrom, start : str
+        Chromosome and start columns.
+
+    end : str, optional (default: None)
+        End column (exclusive). None treats the rows as single positions.
+
+    unit : int, optional (default: 1)
+        bp per unit of the table's coordinates, e.g. 10**6 for Mbp.
+
+    Example Usage:
+    --------------
+    >>> windows.filter(in_region('chr7:40-60Mb', 'Chromosome', 'column_2', 'column_3', unit=10**6))
+    """
+    name, low, high = parse_region(region)
+    keep = pl.col(chrom).cast(pl.Utf8) == name
+    if low is None:
+        return keep
+    if end is None:
+        return keep & (pl.col(start) >= low / unit) & (pl.col(start) < high / unit)
+    return keep & (pl.col(start) < high / unit) & (pl.col(end) > low / unit)
+
+
+class VariantStore:
+    """
+    Table sorted by (chromosome, start) with a row-group index, for region queries on a memory-mapped file.
+
+    Parameters:
+    -----------
+    path : str
+        Sorted Arrow IPC file written by `VariantStore.build`; its index is `{path}.index.npz`.
+
+    aliases : dict, optional (default: None)
+        Other names of the chromosomes, e.g. {'chr7': 'NC_088381.1'} from Genome_text.tsv, so labels can be queried.
+
+    Example Usage:
+    --------------
+    >>> store = open_store(registry, 'Data/merged_SV_df.tsv', INPUT_FORMATS['merged_SV_df.tsv'])
+    >>> store.query('chr7', 40_000_000, 60_000_000)
+    >>> store.last_rows_read
+    """
+
+    def __init__(self, path, aliases=None):
+        with np.load(f'{path}.index.npz') as arrays:
+            self.index = {key: arrays[key] for key in ('offset', 'chrom_min', 'chrom_max', 'start_min', 'end_max')}
+            meta = json.loads(str(arrays['meta']))
+        self.path = path
+        self.chrom, self.start, self.end, self.unit = meta['chrom'], meta['start'], meta['end'], meta['unit']
+        self.codes = {name: code for code, name in enumerate(meta['chromosomes'])}
+        self.aliases = dict(aliases or {})
+        self.frame = pl.read_ipc(path)
+        self.last_rows_read = 0
+
+    @staticmethod
+    def build(source, path, chrom, start, end=None, unit=1, row_group=ROW_GROUP):
+        """
+        Function to write the sorted copy of an Arrow IPC file and its row-group index.
+
+        Returns:
+        --------
+        str
+            `path`.
+        """
+        lazy = pl.scan_ipc(source)
+        names = lazy.select(pl.col(chrom).cast(pl.Utf8).unique()).collect()[chrom].drop_nulls().to_list()
+        names = sorted(names, key=natural_key)
+        ordered = lazy.with_columns(pl.col(chrom).cast(pl.Utf8).cast(pl.Enum(names))).drop_nulls(chrom).sort(chrom, start, maintain_order=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            ordered.sink_ipc(tmp_path, compression=None)
+        except pl.exceptions.InvalidOperationError:
+            # Only plans the streaming engine cannot sink fall back to an in-memory collect
+            ordered.collect().write_ipc(tmp_path, compression='uncompressed')
+
+        keys = pl.read_ipc(tmp_path, columns=list(dict.fromkeys([chrom, start, end or start])))
+        codes = keys[chrom].to_physical().to_numpy().astype(np.int64)
+        starts = keys[start].cast(pl.Float64).to_numpy()
+        ends = keys[end or start].cast(pl.Float64).to_numpy()
+        offsets = np.arange(0, keys.height, row_group)
+        index = {'offset': np.append(offsets, keys.height), 'chrom_min': codes[offsets],
+                 'chrom_max': codes[np.minimum(offsets + row_group, keys.height) - 1]}
+        if keys.height:
+            index.update(start_min=np.minimum.reduceat(starts, offsets), end_max=np.maximum.reduceat(ends, offsets))
+        else:
+            index.update(start_min=np.empty(0), end_max=np.empty(0))
+        meta = {'chrom': chrom, 'start': start, 'end': end, 'unit': unit, 'chromosomes': names, 'row_group': row_group}
+        np.savez(f'{tmp_path}.index.npz', meta=np.array(json.dumps(meta)), **index)
+        del keys
+        os.replace(f'{tmp_path}.index.npz', f'{path}.index.npz')
+        os.replace(tmp_path, path)
+        return path
+
+    def row_groups(self, code, low, high):
+        # Row groups that can hold rows of chromosome `code` overlapping [low, high) in table units
+        index = self.index
+        hit = (index['chrom_min'] <= code) & (index['chrom_max'] >= code)
+        # Groups spanning a chromosome boundary mix the bounds of two chromosomes; they are always read
+        single = index['chrom_min'] == index['chrom_max']
+        hit &= ~single | ((index['start_min'] < high) & (index['end_max'] >= low))
+        return np.flatnonzero(hit)
+
+    def query(self, chrom, start=None, end=None, columns=None):
+        """
+        Function to return the rows overlapping a region.
+
+        Parameters:
+        -----------
+        chrom : str
+            Chromosome name or alias, or a whole region such as 'chr7:40-60Mb'.
+
+        start, end : int, optional (default: None)
+            Region in bp (end exclusive). None for the whole chromosome.
+
+        columns : list of str, optional (default: None)
+            Columns to return. None returns all of them.
+
+        Returns:
+        --------
+        polars.DataFrame
+            The matching rows in (chromosome, start) order; `last_rows_read` holds the rows sliced from disk.
+        """
+        if start is None and end is None:
+            chrom, start, end = parse_region(chrom)
+        code = self.codes.get(self.aliases.get(chrom, chrom))
+        low = -np.inf if start is None else start / self.unit
+        high = np.inf if end is None else end / self.unit
+        groups = self.row_groups(code, low, high) if code is not None else []
+        if len(groups) == 0:
+            self.last_rows_read = 0
+            return self.frame.clear().select(columns or self.frame.columns)
+        first, last = self.index['offset'][groups[0]], self.index['offset'][groups[-1] + 1]
+        self.last_rows_read = int(last - first)
+        keep = pl.col(self.chrom).to_physical() == code
+        if self.end is None:
+            keep &= (pl.col(self.start) >= low) & (pl.col(self.start) < high)
+        else:
+            keep &= (pl.col(self.start) < high) & (pl.col(self.end) > low)
+        return self.frame.slice(int(first), int(last - first)).filter(keep).select(columns or self.frame.columns)
+
+
+def open_store(registry, path, read_kwargs, layout=None, aliases=None, row_group=ROW_GROUP):
+    """
+    Function to open the VariantStore of an input, building it next to the input's sidecar on first use.
+
+    Parameters:
+    -----------
+    registry : DatasetRegistry
+        Registry providing (and accounting for) the sidecar.
+
+    path : str
+        The input table, e.g. 'Data/500Kb_window_Variant_Count.bed'.
+
+    read_kwargs : dict
+        Read options of the input (see INPUT_FORMATS in main.py).
+
+    layout : tuple, optional (default: None)
+        (chromosome, start, end, bp per unit) columns. None takes them from STORE_LAYOUTS by file name.
+
+    aliases : dict, optional (default: None)
+        Chromosome aliases passed to the store.
+
+    Returns:
+    --------
+    VariantStore
+    """
+    chrom, start, end, unit = layout or layout_of(path)
+    sidecar = registry.sidecar(path, **read_kwargs)
+    store_path = f'{os.path.splitext(sidecar)[0]}.sorted{row_group}.arrow'
+    if not (os.path.exists(store_path) and os.path.exists(f'{store_path}.index.npz')):
+        VariantStore.build(sidecar, store_path, chrom, start, end, unit, row_group)
+    registry.track(store_path)
+    registry.track(f'{store_path}.index.npz')
+    return VariantStore(store_path, aliases)
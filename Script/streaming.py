@@ -0,0 +1,178 @@
+import os
+import argparse
+import polars as pl
+from schemas import headerless_columns
+## -------- ##
+## MEMORY-BUDGETED LOADING ##
+# Tab-separated text expands by roughly this factor once parsed into polars columns,
+# plus working space for the group_by/join that follows the read.
+PARSE_EXPANSION = 4.0
+# Fraction of the budget a single in-memory load is allowed to take before switching to streaming
+BUDGET_FRACTION = 0.5
+
+_UNITS = {'': 1, 'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_memory(value):
+    """
+    Function to convert a human-readable memory size into bytes.
+
+    Parameters:
+    -----------
+    value : str or int or None
+        Memory size such as '512M', '8G', '1.5GB' or a plain number of bytes.
+
+    Returns:
+    --------
+    int or None
+        The size in bytes, or None when no value was given. Sizes of zero or less raise a ValueError.
+
+    Example Usage:
+    --------------
+    >>> parse_memory('8G')
+    8589934592
+    """
+    if value is None:
+        return value
+    if isinstance(value, int):
+        size = value
+    else:
+        text = str(value).strip().upper()
+        if text.endswith('B'):
+            text = text[:-1]
+        unit = text[-1] if text and text[-1] in _UNITS else ''
+        number = text[:-1] if unit else text
+        try:
+            size = int(float(number) * _UNITS[unit])
+        except ValueError:
+            raise ValueError(f"Invalid memory size: {value!r} (expected e.g. 512M, 8G)") from None
+    if size <= 0:
+        # A zero budget would silently stream every table
+        raise ValueError(f"Memory size must be positive, got {value!r}")
+    return size
+
+
+def memory_size(value):
+    # argparse type for --max-memory and --block-memory: reports invalid or non-positive sizes as usage errors
+    try:
+        return parse_memory(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error)) from None
+
+
+def memory_budget(available_ram, max_memory=None):
+    """
+    Function to decide how many bytes the pipeline may use.
+
+    Parameters:
+    -----------
+    available_ram : int
+        Available RAM in bytes, as reported by `system_info()`.
+
+    max_memory : int or str, optional (default: None)
+        User cap from `--max-memory`. The smaller of the cap and the available RAM is used.
+
+    Returns:
+    --------
+    int
+        The memory budget in bytes.
+    """
+    cap = parse_memory(max_memory)
+    if cap is None:
+        return int(available_ram)
+    return int(min(available_ram, cap))
+
+
+def use_streaming(paths, budget):
+    """
+    Function to choose between in-memory and out-of-core execution for a set of input files.
+
+    Parameters:
+    -----------
+    paths : str or list of str
+        Input files that will be read for one query.
+
+    budget : int or None
+        Memory budget in bytes. None disables streaming.
+
+    Returns:
+    --------
+    bool
+        True when the estimated parsed size does not fit in the budget.
+    """
+    if budget is None:
+        return False
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    on_disk = sum(os.path.getsize(p) for p in paths)
+    return on_disk * PARSE_EXPANSION > budget * BUDGET_FRACTION
+
+
+def configure_streaming(budget, row_bytes=64):
+    """
+    Function to size the polars streaming morsels so that every thread's chunk fits in the budget.
+
+    Parameters:
+    -----------
+    budget : int
+        Memory budget in bytes.
+
+    row_bytes : int, optional (default: 64)
+        Approximate size of one parsed row.
+    """
+    threads = pl.thread_pool_size() if hasattr(pl, 'thread_pool_size') else os.cpu_count() or 1
+    # Leave most of the budget for the operator state (group_by tables, join build side)
+    rows = int(budget * 0.1 / (threads * row_bytes))
+    rows = max(10_000, min(rows, 1_000_000))
+    if hasattr(pl.Config, 'set_streaming_chunk_size'):
+        pl.Config.set_streaming_chunk_size(rows)
+    return rows
+
+
+def collect(lazy_df, streaming):
+    """
+    Function to execute a lazy query either in memory or with the polars streaming engine.
+
+    Parameters:
+    -----------
+    lazy_df : polars.LazyFrame
+        The query to execute.
+
+    streaming : bool
+        Whether to run out-of-core.
+
+    Returns:
+    --------
+    polars.DataFrame
+        The materialized result.
+    """
+    if not streaming:
+        return lazy_df.collect()
+    try:
+        return lazy_df.collect(engine='streaming')
+    except TypeError:
+        # polars < 1.23 only exposes the old streaming flag
+        return lazy_df.collect(streaming=True)
+
+
+def scan_table(path, **read_kwargs):
+    """
+    Function to lazily scan a tab-separated file, mirroring the `pl.read_csv` options used in main.py.
+
+    Parameters:
+    -----------
+    path : str
+        Path to the tab-separated file.
+
+    **read_kwargs :
+        Extra options passed on to `pl.scan_csv` (e.g. has_header).
+
+    Returns:
+    --------
+    polars.LazyFrame
+        A lazy frame over the file. Nothing is read until it is collected.
+    """
+    read_kwargs.setdefault('separator', '\t')
+    if read_kwargs.get('has_header') is False and 'new_columns' not in read_kwargs:
+        read_kwargs['new_columns'] = headerless_columns(path, read_kwargs['separator'])
+    return pl.scan_csv(path, **read_kwargs)
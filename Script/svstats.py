@@ -0,0 +1,362 @@
+import io
+import os
+import gzip
+import json
+import argparse
+import numpy as np
+import polars as pl
+## -------- ##
+## STREAMING SV LENGTH STATISTICS ##
+# Figure 3 B-C plots the median and total length of each SV type. Instead of reading a pre-aggregated
+# SV_type_Median_Length.tsv, the statistics are computed from the raw calls (a VCF, or a table with SV type
+# and length columns) in a single pass of fixed-size chunks. Per SV type the lengths are kept exactly while
+# they fit in the value budget; past it every type switches to a t-digest. Both states merge, across chunks
+# and across samples, so a cohort summary never holds all calls at once.
+
+CHUNK_LINES = 1_000_000
+# Lengths kept exactly (over all SV types) before switching to t-digests, ~400 MB of float64
+MAX_EXACT = 50_000_000
+COMPRESSION = 200
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+# Translocations have no length and are left out, as in SV_type_Median_Length.tsv
+NO_LENGTH = ('BND', 'TRA', 'TRN')
+VCF_SUFFIXES = ('.vcf', '.vcf.gz', '.vcf.bgz')
+
+
+class TDigest:
+    """
+    Merging t-digest of a stream of values, for approximate quantiles in bounded memory.
+
+    Values are buffered and folded into at most ~`compression` centroids, sized by the k1 scale function
+    (small at the tails, large around the median). Folding is a sort and a `np.add.reduceat`, so updates
+    are vectorized, and two digests merge by folding the centroids of one into the other.
+
+    Parameters:
+    -----------
+    compression : int, optional (default: 200)
+        Accuracy / size trade-off; the relative rank error is roughly 1 / compression.
+
+    Example Usage:
+    --------------
+    >>> digest = TDigest()
+    >>> digest.update(np.random.lognormal(5, 1, 1_000_000))
+    >>> digest.quantile(0.5)
+    """
+
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min, self.max = np.inf, -np.inf
+        self._buffer, self._buffered = [], 0
+
+    def update(self, values, weights=None):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return self
+        self.min, self.max = min(self.min, values.min()), max(self.max, values.max())
+        self._buffer.append((values, np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)))
+        self._buffered += len(values)
+        if self._buffered > 50 * self.compression:
+            self._fold()
+        return self
+
+    def merge(self, other):
+        other._fold()
+        self.update(other.means, other.weights)
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        return self
+
+    def _fold(self):
+        if not self._buffer:
+            return
+        means = np.concatenate([self.means] + [values for values, _ in self._buffer])
+        weights = np.concatenate([self.weights] + [weights for _, weights in self._buffer])
+        self._buffer, self._buffered = [], 0
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        # k1 scale: each centroid spans at most one unit of k(q) = compression / (2 pi) * asin(2q - 1)
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(np.clip(2 * q - 1, -1, 1)))
+        starts = np.flatnonzero(np.concatenate([[True], np.diff(k) != 0]))
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, q):
+        self._fold()
+        if len(self.means) == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        positions = (np.cumsum(self.weights) - self.weights / 2) / self.weights.sum()
+        return np.interp(q, np.concatenate([[0.0], positions, [1.0]]), np.concatenate([[self.min], self.means, [self.max]]))
+
+
+class SVLengthStats:
+    """
+    Mergeable per-SVTYPE length statistics: count, total, mean, min, max and quantiles.
+
+    Parameters:
+    -----------
+    max_exact : int, optional (default: 50_000_000)
+        Lengths kept exactly over all SV types. Beyond it every type switches to a `TDigest`.
+
+    compression : int, optional (default: 200)
+        Compression of the t-digests.
+
+    Example Usage:
+    --------------
+    >>> stats = SVLengthStats()
+    >>> for chunk in read_sv_chunks('sample.vcf.gz'):
+    ...     stats.update(chunk)
+    >>> stats.table()
+    """
+
+    def __init__(self, max_exact=MAX_EXACT, compression=COMPRESSION):
+        self.max_exact = max_exact
+        self.compression = compression
+        self.counts, self.totals, self.mins, self.maxs = {}, {}, {}, {}
+        self.values = {}    # SV type -> list of length arrays while exact
+        self.digests = None  # SV type -> TDigest once the budget is exceeded
+        self._stored = 0
+
+    @property
+    def exact(self):
+        return self.digests is None
+
+    def update(self, chunk, svtype='SVTYPE', length='SVLEN'):
+        """
+        Function to add one chunk of calls (a polars.DataFrame with SV type and length columns).
+        """
+        chunk = chunk.select(pl.col(svtype).cast(pl.Utf8).alias('SVTYPE'), pl.col(length).cast(pl.Float64).abs().alias('SVLEN'))
+        chunk = chunk.filter(~pl.col('SVTYPE').is_in(NO_LENGTH)).drop_nulls()
+        for key, group in chunk.partition_by('SVTYPE', as_dict=True).items():
+            self._add(key[0] if isinstance(key, tuple) else key, group['SVLEN'].to_numpy())
+        return self
+
+    def _add(self, svtype, lengths):
+        if len(lengths) == 0:
+            return
+        self.counts[svtype] = self.counts.get(svtype, 0) + len(lengths)
+        self.totals[svtype] = self.totals.get(svtype, 0.0) + float(lengths.sum())
+        self.mins[svtype] = min(self.mins.get(svtype, np.inf), float(lengths.min()))
+        self.maxs[svtype] = max(self.maxs.get(svtype, -np.inf), float(lengths.max()))
+        if self.exact and self._stored + len(lengths) > self.max_exact:
+            self._to_digests()
+        if self.exact:
+            self.values.setdefault(svtype, []).append(np.asarray(lengths, dtype=np.float64))
+            self._stored += len(lengths)
+        else:
+            self.digests.setdefault(svtype, TDigest(self.compression)).update(lengths)
+
+    def _to_digests(self):
+        # Out of the exact budget: fold the stored lengths of every type into digests
+        self.digests = {svtype: TDigest(self.compression).update(np.concatenate(arrays)) for svtype, arrays in self.values.items()}
+        self.values, self._stored = {}, 0
+
+    def merge(self, other):
+        """
+        Function to add the statistics of another chunk or sample; stays exact while both are exact and fit the budget.
+        """
+        for svtype, count in other.counts.items():
+            self.counts[svtype] = self.counts.get(svtype, 0) + count
+            self.totals[svtype] = self.totals.get(svtype, 0.0) + other.totals[svtype]
+            self.mins[svtype] = min(self.mins.get(svtype, np.inf), other.mins[svtype])
+            self.maxs[svtype] = max(self.maxs.get(svtype, -np.inf), other.maxs[svtype])
+        if self.exact and other.exact and self._stored + other._stored <= self.max_exact:
+            for svtype, arrays in other.values.items():
+                self.values.setdefault(svtype, []).extend(arrays)
+            self._stored += other._stored
+            return self
+        if self.exact:
+            self._to_digests()
+        if other.exact:
+            incoming = {svtype: TDigest(self.compression).update(np.concatenate(arrays)) for svtype, arrays in other.values.items()}
+        else:
+            incoming = other.digests
+        for svtype, digest in incoming.items():
+            self.digests.setdefault(svtype, TDigest(self.compression)).merge(digest)
+        return self
+
+    def quantiles(self, svtype, qs=QUANTILES):
+        if self.exact:
+            return np.quantile(np.concatenate(self.values[svtype]), qs)
+        return self.digests[svtype].quantile(np.asarray(qs))
+
+    def table(self, quantiles=QUANTILES):
+        """
+        Function to build the Figure 3 table.
+
+        Returns:
+        --------
+        polars.DataFrame
+            Columns SVTYPE, Metric and Value, in the layout of SV_type_Median_Length.tsv: 'Median Length (bp)' and
+            'Total Length (Mbp)', plus 'Count', 'Mean Length (bp)', 'Min Length (bp)', 'Max Length (bp)' and one
+            'Qxx Length (bp)' row per quantile.
+        """
+        rows = []
+        for svtype in self.counts:
+            values = self.quantiles(svtype, [0.5, *quantiles])
+            metrics = [('Median Length (bp)', values[0]), ('Total Length (Mbp)', self.totals[svtype] / 10**6),
+                       ('Count', self.counts[svtype]), ('Mean Length (bp)', self.totals[svtype] / self.counts[svtype]),
+                       ('Min Length (bp)', self.mins[svtype]), ('Max Length (bp)', self.maxs[svtype])]
+            metrics += [(f'Q{round(q * 100):02d} Length (bp)', value) for q, value in zip(quantiles, values[1:]) if q != 0.5]
+            rows += [{'SVTYPE': svtype, 'Metric': metric, 'Value': float(value)} for metric, value in metrics]
+        return pl.DataFrame(rows, schema={'SVTYPE': pl.Utf8, 'Metric': pl.Utf8, 'Value': pl.Float64})
+
+    def save(self, path):
+        """
+        Function to store the state (.npz), to merge samples later with `SVLengthStats.load(path)`.
+        """
+        meta = {'max_exact': self.max_exact, 'compression': self.compression, 'exact': self.exact, 'counts': self.counts,
+                'totals': self.totals, 'mins': self.mins, 'maxs': self.maxs}
+        arrays = {'meta': np.array(json.dumps(meta))}
+        for index, svtype in enumerate(self.counts):
+            if self.exact:
+                arrays[f'values_{index}'] = np.concatenate(self.values[svtype])
+            else:
+                digest = self.digests[svtype]
+                digest._fold()
+                arrays[f'means_{index}'], arrays[f'weights_{index}'] = digest.means, digest.weights
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            meta = json.loads(str(arrays['meta']))
+            stats = cls(meta['max_exact'], meta['compression'])
+            stats.counts, stats.totals, stats.mins, stats.maxs = meta['counts'], meta['totals'], meta['mins'], meta['maxs']
+            if meta['exact']:
+                stats.values = {svtype: [arrays[f'values_{index}']] for index, svtype in enumerate(stats.counts)}
+                stats._stored = sum(len(arrays[f'values_{index}']) for index in range(len(stats.counts)))
+            else:
+                stats.digests = {}
+                for index, svtype in enumerate(stats.counts):
+                    digest = TDigest(stats.compression)
+                    digest.means, digest.weights = arrays[f'means_{index}'], arrays[f'weights_{index}']
+                    digest.min, digest.max = stats.mins[svtype], stats.maxs[svtype]
+                    stats.digests[svtype] = digest
+        return stats
+
+
+def _open(path):
+    with open(path, 'rb') as handle:
+        compressed = handle.read(2) == b'\x1f\x8b'
+    return gzip.open(path, 'rb') if compressed else open(path, 'rb')
+
+
+def _line_chunks(handle, chunk_lines):
+    chunk = []
+    for line in handle:
+        chunk.append(line)
+        if len(chunk) == chunk_lines:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def is_vcf(path):
+    return str(path).lower().endswith(VCF_SUFFIXES)
+
+
+def _vcf_lengths(chunk):
+    # SVTYPE and absolute length from INFO (SVLEN, else END - POS), or from REF/ALT for sequence-resolved calls
+    records = pl.read_csv(io.BytesIO(b''.join(chunk)), separator='\t', has_header=False, columns=[1, 3, 4, 7],
+                          new_columns=['POS', 'REF', 'ALT', 'INFO'], infer_schema=False, quote_char=None)
+    info = pl.col('INFO')
+    alt = pl.col('ALT').str.split(',').list.first()
+    svtype = pl.coalesce(info.str.extract(r'(?:^|;)SVTYPE=([^;]+)', 1), alt.str.extract(r'^<([A-Z]+)', 1))
+    svlen = info.str.extract(r'(?:^|;)SVLEN=(-?\d+)', 1).cast(pl.Int64, strict=False).abs()
+    span = info.str.extract(r'(?:^|;)END=(\d+)', 1).cast(pl.Int64, strict=False) - pl.col('POS').cast(pl.Int64)
+    allele = (alt.str.len_bytes().cast(pl.Int64) - pl.col('REF').str.len_bytes().cast(pl.Int64)).abs()
+    symbolic = alt.str.starts_with('<') | alt.str.contains(r'[\[\]]')
+    length = pl.coalesce(svlen, pl.when(symbolic).then(span).otherwise(allele))
+    return records.select(svtype.alias('SVTYPE'), length.alias('SVLEN')).drop_nulls('SVTYPE')
+
+
+def read_sv_chunks(path, svtype='SVTYPE', length='SVLEN', chunk_lines=CHUNK_LINES):
+    """
+    Function to read raw SV calls in chunks of `chunk_lines` records.
+
+    Parameters:
+    -----------
+    path : str
+        A VCF (plain or gzip/bgzip-compressed), or a tab-separated table with a header row.
+
+    svtype, length : str, optional (default: 'SVTYPE', 'SVLEN')
+        Type and length columns of a table. Ignored for VCFs, where they come from INFO (SVTYPE, SVLEN or END).
+
+    Yields:
+    -------
+    polars.DataFrame
+        Columns SVTYPE and SVLEN (bp), one chunk at a time.
+    """
+    with _open(path) as handle:
+        if is_vcf(path):
+            for line in handle:
+                if line.startswith(b'#CHROM'):
+                    break
+            for chunk in _line_chunks(handle, chunk_lines):
+                yield _vcf_lengths(chunk)
+            return
+        header = handle.readline()
+        for chunk in _line_chunks(handle, chunk_lines):
+            table = pl.read_csv(io.BytesIO(header + b''.join(chunk)), separator='\t', columns=[svtype, length],
+                                schema_overrides={svtype: pl.Utf8, length: pl.Float64}, quote_char=None)
+            yield table.rename({svtype: 'SVTYPE', length: 'SVLEN'})
+
+
+def is_length_summary(path):
+    """
+    Function to tell an aggregated SV_type_Median_Length.tsv (SVTYPE, Metric, Value) from raw calls.
+    """
+    if is_vcf(path):
+        return False
+    with _open(path) as handle:
+        columns = handle.readline().decode().rstrip('\r\n').split('\t')
+    return {'SVTYPE', 'Metric', 'Value'} <= set(columns)
+
+
+def sv_length_stats(path, svtype='SVTYPE', length='SVLEN', max_exact=MAX_EXACT, chunk_lines=CHUNK_LINES):
+    """
+    Function to compute the length statistics of one file of raw SV calls in a single chunked pass.
+
+    Returns:
+    --------
+    SVLengthStats
+        Call `.table()` for the Figure 3 table, `.merge()` to combine samples, `.save()` to store the state.
+
+    Example Usage:
+    --------------
+    >>> stats = sv_length_stats('HiFi_SV.vcf.gz')
+    >>> plot_sv_chart(stats.table())
+    """
+    stats = SVLengthStats(max_exact)
+    for chunk in read_sv_chunks(path, svtype, length, chunk_lines):
+        stats.update(chunk)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-SVTYPE length statistics (median, total, quantiles) from raw SV calls, mergeable across samples")
+    parser.add_argument('inputs', nargs='+', help="SV call files (VCF or table) and/or states saved with --save-state")
+    parser.add_argument('--svtype-col', default='SVTYPE', help="SV type column of tables (default: SVTYPE)")
+    parser.add_argument('--length-col', default='SVLEN', help="Length column of tables (default: SVLEN)")
+    parser.add_argument('--max-exact', type=int, default=MAX_EXACT,
+                        help=f"Lengths kept exactly before switching to t-digests (default: {MAX_EXACT})")
+    parser.add_argument('--output', default='SV_type_Median_Length.tsv', help="Summary table for Figure 3 (default: SV_type_Median_Length.tsv)")
+    parser.add_argument('--save-state', default=None, help="Also store the merged state (.npz) for later merging")
+    args = parser.parse_args()
+
+    total = SVLengthStats(args.max_exact)
+    for path in args.inputs:
+        part = SVLengthStats.load(path) if path.endswith('.npz') else sv_length_stats(path, args.svtype_col, args.length_col, args.max_exact)
+        total.merge(part)
+        print(f"{path}: {sum(part.counts.values())} SVs with a length ({'exact' if part.exact else 't-digest'})")
+    total.table().write_csv(args.output, separator='\t')
+    if args.save_state:
+        total.save(args.save_state)
+    print(f"Wrote {args.output} ({'exact' if total.exact else 't-digest'} quantiles)")
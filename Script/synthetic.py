@@ -0,0 +1,275 @@
+import os
+import json
+import argparse
+import numpy as np
+import polars as pl
+from windowing import window_counts, window_label
+## -------- ##
+## SYNTHETIC INPUT GENERATOR ##
+# The real inputs under Script/Data are not shipped. This writes a complete Data directory with the same
+# file names and layouts main.py reads, at any scale from a single chromosome to a 50M-variant cohort,
+# so the pipeline can be run and benchmarked anywhere. Variants are denser towards chromosome ends and
+# sparse inside centromeres, so Figures 2 and 4 show the end-to-centromere trend they are about.
+
+# (label, approximate length in bp, centromere mid-point as a fraction of the length)
+MFA_CHROMOSOMES = [
+    ('chr1', 223_000_000, 0.55), ('chr2', 192_000_000, 0.40), ('chr3', 198_000_000, 0.50), ('chr4', 170_000_000, 0.45),
+    ('chr5', 188_000_000, 0.30), ('chr6', 180_000_000, 0.48), ('chr7', 170_000_000, 0.35), ('chr8', 147_000_000, 0.30),
+    ('chr9', 134_000_000, 0.38), ('chr10', 99_000_000, 0.45), ('chr11', 134_000_000, 0.40), ('chr12', 107_000_000, 0.35),
+    ('chr13', 138_000_000, 0.25), ('chr14', 130_000_000, 0.42), ('chr15', 112_000_000, 0.30), ('chr16', 80_000_000, 0.48),
+    ('chr17', 95_000_000, 0.25), ('chr18', 75_000_000, 0.35), ('chr19', 60_000_000, 0.45), ('chr20', 78_000_000, 0.40),
+    ('chrX', 153_000_000, 0.40), ('chrY', 12_000_000, 0.30),
+]
+MT_LENGTH = 16_564
+CENTROMERE_BP = 3_000_000
+
+# Named scales; any value can be overridden on the command line
+SCALES = {
+    'chromosome': {'chromosomes': 1, 'variants': 200_000, 'svs': 2_000},
+    'small': {'chromosomes': len(MFA_CHROMOSOMES), 'variants': 1_000_000, 'svs': 10_000},
+    'genome': {'chromosomes': len(MFA_CHROMOSOMES), 'variants': 10_000_000, 'svs': 50_000},
+    'cohort': {'chromosomes': len(MFA_CHROMOSOMES), 'variants': 50_000_000, 'svs': 250_000},
+}
+
+VARIANT_TYPES = (['SNP', 'InDel'], [0.85, 0.15])
+ZYGOSITY = (['Heterozygous', 'Homozygous'], [0.6, 0.4])
+REGIONS = (['Intergene', 'Intron', 'Exon', 'Lnc_RNA', 'Pseudogene'], [0.50, 0.38, 0.02, 0.06, 0.04])
+# SV type, share, median length (bp), lognormal sigma; BND (translocations) has no length
+SV_TYPES = [('DEL', 0.45, 300, 1.2), ('INS', 0.40, 250, 1.0), ('DUP', 0.06, 2_000, 1.4), ('INV', 0.04, 5_000, 1.5), ('BND', 0.05, 0, 0.0)]
+CHUNK_SIZE = 2_000_000
+MANIFEST_NAME = 'synthetic.json'
+
+
+def genome_layout(chromosomes=len(MFA_CHROMOSOMES)):
+    """
+    Function to describe the synthetic genome: the first `chromosomes` nuclear chromosomes plus MT.
+
+    Returns:
+    --------
+    polars.DataFrame
+        Columns name (sequence name used in the variant and window tables), length, label
+        (chromosome label, as in column 3 of Genome_text.tsv) and centromere_start / centromere_end (bp, null for MT).
+    """
+    rows = MFA_CHROMOSOMES[:chromosomes]
+    starts = [int(length * fraction) - CENTROMERE_BP // 2 for _, length, fraction in rows]
+    return pl.DataFrame({
+        'name': [f'synthetic_{label}' for label, _, _ in rows] + ['synthetic_MT'],
+        'length': [length for _, length, _ in rows] + [MT_LENGTH],
+        'label': [label for label, _, _ in rows] + ['MT'],
+        'centromere_start': starts + [None],
+        'centromere_end': [start + CENTROMERE_BP for start in starts] + [None],
+    })
+
+
+def _positions(rng, n, lengths, cen_starts, cen_ends, codes):
+    # A uniform background plus an excess that decays away from both chromosome ends
+    length = lengths[codes]
+    pos = (rng.random(n) * length).astype(np.int64)
+    near_end = rng.random(n) < 0.3
+    offset = np.minimum(rng.exponential(0.05, n) * length, length - 1).astype(np.int64)
+    from_right = rng.random(n) < 0.5
+    pos = np.where(near_end, np.where(from_right, length - 1 - offset, offset), pos)
+    # Most positions drawn inside a centromere are moved elsewhere, leaving it sparse
+    in_centromere = (pos >= cen_starts[codes]) & (pos < cen_ends[codes]) & (rng.random(n) < 0.8)
+    pos[in_centromere] = (rng.random(int(in_centromere.sum())) * length[in_centromere]).astype(np.int64)
+    return pos
+
+
+def _pick(rng, choices, n):
+    labels, weights = choices
+    return pl.Series(labels, dtype=pl.Utf8).gather(rng.choice(len(labels), size=n, p=weights))
+
+
+def simulate_variants(layout, n, rng):
+    """
+    Function to draw `n` small variants over the genome layout.
+
+    Returns:
+    --------
+    polars.DataFrame
+        Columns chrom, pos (0-based), type, zygosity and region.
+    """
+    lengths = layout['length'].to_numpy().astype(np.int64)
+    cen_starts = layout['centromere_start'].fill_null(-1).to_numpy()
+    cen_ends = layout['centromere_end'].fill_null(-1).to_numpy()
+    codes = rng.choice(len(lengths), size=n, p=lengths / lengths.sum())
+    return pl.DataFrame({
+        'chrom': layout['name'].gather(codes),
+        'pos': _positions(rng, n, lengths, cen_starts, cen_ends, codes),
+        'type': _pick(rng, VARIANT_TYPES, n),
+        'zygosity': _pick(rng, ZYGOSITY, n),
+        'region': _pick(rng, REGIONS, n),
+    })
+
+
+def variant_bed(variants, rng):
+    # Variant.bed layout; the pipeline reads col_1, col_2, col_8 and col_14, the other columns are filler
+    n = len(variants)
+    bases = pl.Series(['A', 'C', 'G', 'T'])
+    variants = variants.with_columns(ref=bases.gather(rng.integers(0, 4, n)), alt=bases.gather(rng.integers(0, 4, n)))
+    return variants.select(
+        pl.col('chrom').alias('col_1'),
+        pl.col('pos').alias('col_2'),
+        (pl.col('pos') + 1).alias('col_3'),
+        pl.col('ref').alias('col_4'),
+        pl.when(pl.col('type') == 'SNP').then(pl.col('alt')).otherwise(pl.col('ref') + 'AT').alias('col_5'),
+        pl.Series('col_6', rng.integers(20, 60, n), dtype=pl.Int32),
+        pl.lit('PASS').alias('col_7'),
+        pl.col('type').alias('col_8'),
+        pl.when(pl.col('zygosity') == 'Homozygous').then(pl.lit('1/1')).otherwise(pl.lit('0/1')).alias('col_9'),
+        pl.col('zygosity').alias('col_10'),
+        pl.lit('.').alias('col_11'),
+        pl.lit('.').alias('col_12'),
+        pl.lit('.').alias('col_13'),
+        pl.col('region').alias('col_14'),
+    )
+
+
+def simulate_svs(layout, n, rng):
+    """
+    Function to draw `n` structural variants over the nuclear chromosomes.
+
+    Returns:
+    --------
+    polars.DataFrame
+        Columns chrom, pos, type (SV type) and length (bp, 0 for BND).
+    """
+    nuclear = layout.filter(pl.col('label') != 'MT')
+    lengths = nuclear['length'].to_numpy().astype(np.int64)
+    codes = rng.choice(len(lengths), size=n, p=lengths / lengths.sum())
+    pos = _positions(rng, n, lengths, nuclear['centromere_start'].to_numpy(), nuclear['centromere_end'].to_numpy(), codes)
+    kind = rng.choice(len(SV_TYPES), size=n, p=[share for _, share, _, _ in SV_TYPES])
+    medians = np.array([median for _, _, median, _ in SV_TYPES], dtype=float)
+    sigmas = np.array([sigma for _, _, _, sigma in SV_TYPES])
+    sv_length = np.round(medians[kind] * np.exp(rng.normal(0.0, 1.0, n) * sigmas[kind])).astype(np.int64)
+    return pl.DataFrame({
+        'chrom': nuclear['name'].gather(codes),
+        'pos': pos,
+        'type': pl.Series([name for name, _, _, _ in SV_TYPES]).gather(kind),
+        'length': sv_length,
+    })
+
+
+def sv_window_table(svs, layout, width=500_000):
+    # merged_SV_df.tsv: SV counts per window and type, window coordinates in Mbp
+    types = [name for name, _, _, _ in SV_TYPES]
+    nuclear = layout.filter(pl.col('label') != 'MT')
+    sizes = dict(zip(nuclear['name'].to_list(), nuclear['length'].to_list()))
+    tables = window_counts(svs.with_columns(zygosity=pl.lit(None, pl.Utf8)), [width], sizes,
+                           strata=[(sv_type, (sv_type,), None) for sv_type in types])
+    labels = layout.select(pl.col('name').alias('column_1'), pl.col('length').alias('column_2_right'), pl.col('label').alias('Chromosome'))
+    return pl.concat([
+        tables[(width, sv_type)].with_columns(pl.col('column_2') / 10**6, pl.col('column_3') / 10**6, Type=pl.lit(sv_type))
+        for sv_type in types
+    ]).join(labels, on='column_1').select('column_1', 'column_2', 'column_3', 'column_4', 'column_2_right', 'Chromosome', 'Type')
+
+
+def sv_length_table(svs):
+    # SV_type_Median_Length.tsv: median (bp) and total (Mbp) length per SV type
+    summary = svs.filter(pl.col('type') != 'BND').group_by('type', maintain_order=True).agg(
+        median=pl.col('length').median(), total=pl.col('length').sum() / 10**6)
+    return pl.concat([
+        summary.select(pl.col('type').alias('SVTYPE'), pl.lit('Median Length (bp)').alias('Metric'), pl.col('median').alias('Value')),
+        summary.select(pl.col('type').alias('SVTYPE'), pl.lit('Total Length (Mbp)').alias('Metric'), pl.col('total').alias('Value')),
+    ])
+
+
+def generate(out_dir, chromosomes=1, variants=200_000, svs=2_000, seed=0, resolutions=(10_000, 500_000), chunk_size=CHUNK_SIZE):
+    """
+    Function to write a synthetic Data directory.
+
+    Variants are drawn and written in chunks, so the generated size is limited by disk rather than memory;
+    the window tables are accumulated from the same chunks and are consistent with Variant.bed.
+
+    Parameters:
+    -----------
+    out_dir : str
+        Directory to write to.
+
+    chromosomes : int, optional (default: 1)
+        Number of nuclear chromosomes (1-22), in karyotype order. MT is always added.
+
+    variants, svs : int, optional (default: 200_000, 2_000)
+        Number of small variants and of structural variants.
+
+    seed : int, optional (default: 0)
+        Random seed; the same arguments always produce the same files.
+
+    Returns:
+    --------
+    dict
+        The generation settings, also written to `synthetic.json` in `out_dir`.
+
+    Example Usage:
+    --------------
+    >>> generate('bench_data', **SCALES['genome'])
+    """
+    settings = {'chromosomes': chromosomes, 'variants': variants, 'svs': svs, 'seed': seed, 'resolutions': list(resolutions)}
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    layout = genome_layout(chromosomes)
+    sizes = dict(zip(layout['name'].to_list(), layout['length'].to_list()))
+
+    # Reference tables
+    layout.select('name', 'length', 'label').write_csv(os.path.join(out_dir, 'Genome_text.tsv'), separator='\t', include_header=False)
+    layout.filter(pl.col('label') != 'MT').select('label', 'centromere_start', 'centromere_end').write_csv(
+        os.path.join(out_dir, 'T2T-MFA8v1.0.centromere.bed'), separator='\t', include_header=False)
+
+    # Variant.bed and the window tables, one chunk at a time
+    counts = {}
+    with open(os.path.join(out_dir, 'Variant.bed'), 'wb') as handle:
+        for start in range(0, max(variants, 1), chunk_size):
+            chunk = simulate_variants(layout, min(chunk_size, variants - start), rng)
+            variant_bed(chunk, rng).write_csv(handle, separator='\t', include_header=start == 0)
+            for key, table in window_counts(chunk, list(resolutions), sizes).items():
+                counts[key] = table if key not in counts else counts[key].with_columns(
+                    pl.col('column_4') + table['column_4'])
+    for (width, suffix), table in counts.items():
+        table.write_csv(os.path.join(out_dir, f'{window_label(width)}_window_Variant_Count{suffix}.bed'),
+                        separator='\t', include_header=False)
+
+    # Structural variants
+    sv_calls = simulate_svs(layout, svs, rng)
+    sv_window_table(sv_calls, layout).write_csv(os.path.join(out_dir, 'merged_SV_df.tsv'), separator='\t')
+    sv_length_table(sv_calls).write_csv(os.path.join(out_dir, 'SV_type_Median_Length.tsv'), separator='\t')
+    # The raw calls behind both tables, for `main.py --sv-calls SV_calls.tsv`
+    sv_calls.select(pl.col('chrom').alias('CHROM'), (pl.col('pos') + 1).alias('POS'), pl.col('type').alias('SVTYPE'),
+                    pl.col('length').alias('SVLEN')).write_csv(os.path.join(out_dir, 'SV_calls.tsv'), separator='\t')
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w') as handle:
+        json.dump(settings, handle, indent=1)
+    return settings
+
+
+def ensure_dataset(out_dir, **settings):
+    """
+    Function to generate a synthetic Data directory unless one with the same settings already exists.
+    """
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME)) as handle:
+            existing = json.load(handle)
+    except (OSError, ValueError):
+        existing = None
+    wanted = {'seed': 0, 'resolutions': [10_000, 500_000], **settings}
+    wanted['resolutions'] = list(wanted['resolutions'])
+    if existing == wanted:
+        return existing
+    return generate(out_dir, **settings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic inputs for main.py at a chosen scale")
+    parser.add_argument('--scale', choices=list(SCALES), default='chromosome',
+                        help="Named scale: chromosome (1 chromosome, 200K variants), small (1M), genome (10M) or cohort (50M)")
+    parser.add_argument('--chromosomes', type=int, default=None, help="Number of nuclear chromosomes, overriding the scale")
+    parser.add_argument('--variants', type=int, default=None, help="Number of small variants, overriding the scale")
+    parser.add_argument('--svs', type=int, default=None, help="Number of structural variants, overriding the scale")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out-dir', default='Data', help="Directory to write the inputs to")
+    args = parser.parse_args()
+
+    settings = dict(SCALES[args.scale])
+    settings.update({key: value for key, value in
+                     {'chromosomes': args.chromosomes, 'variants': args.variants, 'svs': args.svs}.items() if value is not None})
+    generate(args.out_dir, seed=args.seed, **settings)
+    print(f"Wrote synthetic inputs to {args.out_dir}: {settings}")
@@ -0,0 +1,199 @@
+import os
+import glob
+import json
+import time
+import threading
+## -------- ##
+## STAGE TRACE ##
+# Every read, Data_processing* call, chart build and save runs inside `stage(...)`. With tracing off,
+# `stage` returns one shared do-nothing context manager; with it on, each stage records wall time,
+# CPU time, peak RSS above its starting level and row counts, as a Chrome trace event
+# (chrome://tracing or https://ui.perfetto.dev). Every process appends its events to its own part
+# file, so pool workers need no locking; the driver merges the parts at the end of the run.
+
+SAMPLE_INTERVAL = 0.005
+_PART_PATH = None
+_SAMPLER = None
+
+
+class _RssSampler:
+    # One background thread per process tracking the peak RSS of every open stage
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        import psutil
+        self.process = psutil.Process()
+        self.interval = interval
+        self.open = set()
+        self.lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def rss(self):
+        return self.process.memory_info().rss
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if self.open:
+                rss = self.rss()
+                with self.lock:
+                    for meter in self.open:
+                        meter.peak = max(meter.peak, rss)
+
+    def register(self, meter):
+        meter.base = meter.peak = self.rss()
+        with self.lock:
+            self.open.add(meter)
+
+    def unregister(self, meter):
+        with self.lock:
+            self.open.discard(meter)
+        meter.peak = max(meter.peak, self.rss())
+
+
+def _sampler():
+    global _SAMPLER
+    if _SAMPLER is None:
+        _SAMPLER = _RssSampler()
+    return _SAMPLER
+
+
+class Stage:
+    """
+    Context manager measuring wall time, CPU time (all threads of the process) and peak RSS of a block.
+
+    Parameters:
+    -----------
+    name : str
+        Stage name, e.g. 'read Variant.bed'.
+
+    category : str, optional (default: 'stage')
+        Group of the stage: read, transform, chart or save.
+
+    sink : callable, optional (default: None)
+        Receives the Chrome trace event when the stage ends.
+
+    Example Usage:
+    --------------
+    >>> with Stage('read Variant.bed', 'read') as meter:
+    ...     df = pl.read_csv(path)
+    ...     meter.rows = df.height
+    >>> meter.wall, meter.cpu, meter.peak_mb
+    """
+
+    def __init__(self, name, category='stage', sink=None):
+        self.name = name
+        self.category = category
+        self.sink = sink
+        self.rows = None
+        self.wall = self.cpu = self.peak_mb = 0.0
+
+    def __enter__(self):
+        _sampler().register(self)
+        self.ts = time.time_ns() // 1000
+        self._start = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall = time.perf_counter() - self._start
+        self.cpu = time.process_time() - self._cpu
+        _sampler().unregister(self)
+        self.peak_mb = (self.peak - self.base) / 1024 ** 2
+        if self.sink:
+            self.sink(self.event(failed=exc_type is not None))
+        return False
+
+    def event(self, failed=False):
+        args = {'cpu_s': round(self.cpu, 6), 'peak_rss_delta_mb': round(self.peak_mb, 3), 'rows': self.rows}
+        if failed:
+            args['failed'] = True
+        return {'name': self.name, 'cat': self.category, 'ph': 'X', 'ts': self.ts, 'dur': round(self.wall * 1e6),
+                'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args}
+
+
+class _NullStage:
+    # Shared stand-in used while tracing is off; assigning rows is harmless
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def _append(event):
+    with open(_PART_PATH, 'a') as handle:
+        handle.write(json.dumps(event) + '\n')
+
+
+def enable_tracing(trace_dir):
+    """
+    Function to turn tracing on in this process; events are appended to `{trace_dir}/{pid}.jsonl`.
+
+    Call it in the driver and in every worker (see `init_worker` in main.py).
+    """
+    global _PART_PATH
+    os.makedirs(trace_dir, exist_ok=True)
+    _PART_PATH = os.path.join(trace_dir, f'{os.getpid()}.jsonl')
+
+
+def tracing_enabled():
+    return _PART_PATH is not None
+
+
+def stage(name, category='stage'):
+    """
+    Function to open a traced stage. Costs one global lookup when tracing is off.
+
+    Example Usage:
+    --------------
+    >>> with stage('Data_processing_fig2', 'transform') as s:
+    ...     df = Data_processing_fig2(df, chr_map, centromere_df)
+    ...     s.rows = df.height
+    """
+    if _PART_PATH is None:
+        return _NULL_STAGE
+    return Stage(name, category, sink=_append)
+
+
+def write_trace(trace_dir, path):
+    """
+    Function to merge the part files of every process into one Chrome trace-event JSON file.
+
+    Returns:
+    --------
+    list of dict
+        The merged events, ordered by start time.
+    """
+    events = []
+    for part in glob.glob(os.path.join(trace_dir, '*.jsonl')):
+        with open(part) as handle:
+            events.extend(json.loads(line) for line in handle if line.strip())
+    events.sort(key=lambda event: event['ts'])
+    with open(path, 'w') as handle:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, handle)
+    return events
+
+
+def summarize_trace(events):
+    """
+    Function to print per-stage totals (calls, wall, CPU, largest peak RSS increase, rows), slowest first.
+    """
+    totals = {}
+    for event in events:
+        entry = totals.setdefault((event['cat'], event['name']), {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak': 0.0, 'rows': 0})
+        entry['calls'] += 1
+        entry['wall'] += event['dur'] / 1e6
+        entry['cpu'] += event['args']['cpu_s']
+        entry['peak'] = max(entry['peak'], event['args']['peak_rss_delta_mb'])
+        entry['rows'] += event['args']['rows'] or 0
+    print(f"\n{'Category':<10} {'Stage':<52} {'Calls':>5} {'Wall (s)':>9} {'CPU (s)':>9} {'Peak (MB)':>10} {'Rows':>12}")
+    for (category, name), entry in sorted(totals.items(), key=lambda item: -item[1]['wall']):
+        print(f"{category:<10} {name[:52]:<52} {entry['calls']:>5} {entry['wall']:>9.3f} {entry['cpu']:>9.3f} "
+              f"{entry['peak']:>10.1f} {entry['rows'] or '':>12}")
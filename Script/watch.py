@@ -0,0 +1,344 @@
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import argparse
+import importlib
+import linecache
+import threading
+import traceback
+import socketserver
+from rebuild import code_files, local_imports
+## -------- ##
+## WATCH MODE ##
+# Every run of main.py pays for starting Python, importing polars and altair, enabling vegafusion and starting
+# the vl-convert engine before any figure is processed. WatchDaemon keeps one process with all of that warm,
+# together with the parsed tables held by the DatasetRegistry. It polls the inputs of the figures and the
+# source of their plotting modules, and rebuilds only the figures that read a changed file. A control socket
+# on localhost accepts JSON requests to render figures, possibly with new plot parameters.
+# Edited plotting code is reloaded together with every module that imports it, dependencies first. Edits to
+# main.py or the modules it imports at start-up restart the process, since the registry, the rebuild graph and
+# the export settings it holds would otherwise keep running the old code.
+
+WATCH_INTERVAL = 0.25  # seconds between polls of the watched files
+CONTROL_PORT = 8765
+# A tiny spec rendered once at start-up, so the vl-convert engine is running before the first real figure
+WARM_SPEC = {'$schema': 'https://vega.github.io/schema/vega/v5.json', 'width': 1, 'height': 1,
+             'marks': [{'type': 'rect', 'encode': {'enter': {'width': {'value': 1}, 'height': {'value': 1}}}}]}
+
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def snapshot(paths):
+    # (mtime, size) of every path; None for files that do not exist (yet)
+    state = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            state[path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            state[path] = None
+    return state
+
+
+class WatchDaemon:
+    """
+    Long-running process that re-renders the figures whose inputs or plotting code change.
+
+    Parameters:
+    -----------
+    pipeline : module
+        The configured main module (its FIGURE_GRAPH, input_path and get_graph are used).
+
+    figures : list of str
+        Figures to keep up to date.
+
+    interval : float, optional (default: 0.25)
+        Seconds between polls of the watched files.
+
+    port : int, optional (default: 8765)
+        Port of the control socket on 127.0.0.1. None disables it.
+
+    Example Usage:
+    --------------
+    >>> WatchDaemon(sys.modules['__main__'], ['Figure2', 'Figure4']).run()
+    """
+
+    def __init__(self, pipeline, figures, interval=WATCH_INTERVAL, port=CONTROL_PORT):
+        self.pipeline, self.figures = pipeline, list(figures)
+        self.interval, self.port = interval, port
+        self.jobs = queue.Queue()
+        self.history = []
+        self.stopped = threading.Event()
+
+    # Watched files
+    def watched(self):
+        """
+        Function to map every watched file to the figures that depend on it.
+
+        Returns:
+        --------
+        dict
+            Input files and the source files of the code each figure runs (as fingerprinted), mapped to figure names.
+        """
+        graph, files = self.pipeline.FIGURE_GRAPH, {}
+        for name in self.figures:
+            node = graph[name]
+            for file, _ in node.inputs:
+                files.setdefault(os.path.abspath(self.pipeline.input_path(file)), set()).add(name)
+            for path in code_files(node.process, node.plot, *node.deps):
+                files.setdefault(path, set()).add(name)
+        return files
+
+    def restart_files(self):
+        """
+        Function to list the source files that cannot be reloaded in place: main.py, this module and everything
+        main.py imports at start-up, with their own imports. Their objects are bound once and live across builds.
+        """
+        pipeline = os.path.abspath(self.pipeline.__file__)
+        files, stack = {pipeline, os.path.abspath(__file__)}, list(local_imports(pipeline, top_level=True))
+        while stack:
+            path = stack.pop()
+            if path not in files:
+                files.add(path)
+                stack.extend(local_imports(path, top_level=True))
+        return files
+
+    def _reload(self, paths):
+        # Reload the changed modules and every module importing them, dependencies first, so that names bound
+        # with `from intervals import ...` point to the new code the fingerprint is taken from
+        skip = {'__main__', 'main', self.pipeline.__name__, __name__}
+        modules = {}
+        for module in list(sys.modules.values()):
+            path = getattr(module, '__file__', None)
+            if path and module.__name__ not in skip:
+                modules.setdefault(os.path.abspath(path), module)
+        imports = {path: local_imports(path) & set(modules) for path in modules if path.endswith('.py')}
+        stale = set(paths) & set(imports)
+        grown = True
+        while grown:
+            dependents = {path for path, used in imports.items() if path not in stale and used & stale}
+            stale |= dependents
+            grown = bool(dependents)
+        ordered, seen = [], set()
+
+        def visit(path):
+            if path not in seen:
+                seen.add(path)
+                for used in sorted(imports[path] & stale):
+                    visit(used)
+                ordered.append(path)
+
+        for path in sorted(stale):
+            visit(path)
+        for path in ordered:
+            linecache.checkcache(path)
+            importlib.reload(modules[path])
+            print(f"reloaded {modules[path].__name__}")
+
+    def restart(self, server=None):
+        # Replace this process with a fresh daemon started with the same command line
+        if server:
+            server.shutdown()
+            server.server_close()
+        # exec skips the exit handlers, so write the registry's access times and counts first
+        self.pipeline.get_registry().flush()
+        sys.stdout.flush()
+        os.execv(sys.executable, getattr(sys, 'orig_argv', [sys.executable] + sys.argv))
+
+    # Rendering
+    def render(self, figures=None, params=None, force=False):
+        """
+        Function to bring figures up to date in this process.
+
+        Parameters:
+        -----------
+        figures : list of str, optional (default: None)
+            Figures to build. None builds every watched figure.
+
+        params : dict, optional (default: None)
+            Plot parameters per figure, e.g. {'Figure4': {'bandwidth': 0.5}}. They stay in effect for later renders.
+
+        force : bool, optional (default: False)
+            Rebuild even if nothing changed.
+
+        Returns:
+        --------
+        dict
+            Mapping of figure name to {'status': ..., 'seconds': ...}; failures carry the error instead of a status.
+        """
+        if params:
+            unknown = sorted(set(params) - set(self.pipeline.FIGURE_GRAPH))
+            if unknown:
+                raise ValueError(f"Unknown figure(s) in params: {', '.join(unknown)}")
+            for name, values in params.items():
+                self.pipeline.FIGURE_GRAPH[name].params.update(values)
+        results = {}
+        for name in figures or self.figures:
+            start = time.perf_counter()
+            try:
+                status = self.pipeline.get_graph().build(name, force=force)
+                results[name] = {'status': status, 'seconds': round(time.perf_counter() - start, 3)}
+            except Exception as error:
+                traceback.print_exc()
+                results[name] = {'error': repr(error), 'seconds': round(time.perf_counter() - start, 3)}
+            print(f"{name}: {results[name].get('status', 'failed')} in {results[name]['seconds']:.2f}s")
+        # Builds run in this process, so nothing else has a sidecar open between them
+        self.pipeline.evict_cache()
+        self.history = (self.history + [{'time': time.time(), 'results': results}])[-20:]
+        return results
+
+    def handle(self, request):
+        """
+        Function to answer one control request: {'command': 'render', 'figures': '2,4', 'params': {...}, 'force': false},
+        {'command': 'status'} or {'command': 'stop'}.
+        """
+        command = request.get('command', 'render')
+        if command == 'status':
+            return {'figures': self.figures, 'plan': self.pipeline.get_graph().plan(self.figures), 'history': self.history}
+        if command == 'stop':
+            self.stopped.set()
+            return {'stopped': True}
+        if command != 'render':
+            raise ValueError(f"Unknown command '{command}'; use render, status or stop")
+        figures = self.pipeline.select_figures(request['figures']) if request.get('figures') else None
+        return self.render(figures, request.get('params'), bool(request.get('force')))
+
+    # Control socket
+    def _serve(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    request = json.loads(self.rfile.readline() or b'{}')
+                except ValueError as error:
+                    reply = {'error': f'invalid request: {error}'}
+                else:
+                    # Renders run on the watch loop's thread, one at a time, never concurrently with a file-triggered one
+                    answer = queue.Queue(maxsize=1)
+                    daemon.jobs.put((request, answer))
+                    reply = answer.get()
+                self.wfile.write(json.dumps(reply, default=str).encode() + b'\n')
+
+        server = ControlServer(('127.0.0.1', self.port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def warm_up(self, force=False):
+        # Parse the inputs, start the renderer and bring every figure up to date once
+        from export import _renderer
+        self.pipeline.prepare_inputs(self.figures)
+        _renderer().vega_to_svg(WARM_SPEC)
+        return self.render(force=force)
+
+    def run(self, force=False):
+        """
+        Function to build once (everything with `force`), then watch and serve control requests until stopped
+        (Ctrl-C or {'command': 'stop'}).
+
+        Returns:
+        --------
+        int
+            Exit status.
+        """
+        self.warm_up(force)
+        server = self._serve() if self.port else None
+        files = self.watched()
+        previous = snapshot(files)
+        pending, broken = set(), set()
+        print(f"Watching {len(files)} files for {', '.join(self.figures)}"
+              + (f"; control socket on 127.0.0.1:{self.port}" if server else ''))
+        try:
+            while not self.stopped.is_set():
+                try:
+                    request, answer = self.jobs.get(timeout=self.interval)
+                except queue.Empty:
+                    pass
+                else:
+                    try:
+                        answer.put(self.handle(request))
+                    except Exception as error:
+                        answer.put({'error': repr(error)})
+                    continue
+
+                current = snapshot(files)
+                changed = {path for path in files if current[path] != previous[path]}
+                previous = current
+                if changed:
+                    # Wait until the files stop changing, so a table is not read half-written
+                    pending |= changed
+                    continue
+                if pending:
+                    pending |= broken
+                    affected = sorted(set().union(*(files.get(path, set()) for path in pending)), key=self.figures.index)
+                    print(f"changed: {', '.join(os.path.basename(path) for path in sorted(pending))}")
+                    if pending & self.restart_files():
+                        print("pipeline code changed; restarting")
+                        self.restart(server)
+                    try:
+                        self._reload(pending)
+                    except Exception:
+                        # e.g. a syntax error in the edited file: keep the old code and retry with the next save
+                        traceback.print_exc()
+                        broken, pending = pending, set()
+                        continue
+                    broken, pending = set(), set()
+                    self.render(affected)
+                    files = self.watched()
+                    previous = snapshot(files)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+        return 0
+
+
+def send(request, port=CONTROL_PORT, timeout=None):
+    """
+    Function to send one request to a running watch daemon and return its reply.
+
+    Example Usage:
+    --------------
+    >>> send({'command': 'render', 'figures': '4', 'params': {'Figure4': {'bandwidth': 0.5}}})
+    """
+    with socket.create_connection(('127.0.0.1', port), timeout=timeout) as connection:
+        connection.sendall(json.dumps(request).encode() + b'\n')
+        with connection.makefile('rb') as reply:
+            return json.loads(reply.readline())
+
+
+def _parse_value(text):
+    # 'Figure4.bandwidth=0.5' values are JSON where possible, plain strings otherwise
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Control a running `main.py --watch` daemon")
+    parser.add_argument('command', choices=['render', 'status', 'stop'])
+    parser.add_argument('--figures', default=None, help="Figures to render, as for main.py --figures (default: all watched)")
+    parser.add_argument('--set', action='append', default=[], metavar='FIGURE.PARAM=VALUE',
+                        help="Plot parameter for this and later renders, e.g. Figure4.bandwidth=0.5 (repeatable)")
+    parser.add_argument('--force', action='store_true', help="Render even if nothing changed")
+    parser.add_argument('--port', type=int, default=CONTROL_PORT, help=f"Control port of the daemon (default: {CONTROL_PORT})")
+    args = parser.parse_args()
+
+    params = {}
+    for item in args.set:
+        key, _, value = item.partition('=')
+        figure, _, param = key.partition('.')
+        if not param:
+            parser.error(f"--set expects FIGURE.PARAM=VALUE, got '{item}'")
+        params.setdefault(figure, {})[param] = _parse_value(value)
+    request = {'command': args.command, 'figures': args.figures, 'params': params, 'force': args.force}
+    print(json.dumps(send(request, args.port), indent=1, default=str))
@@ -0,0 +1,262 @@
+import os
+import gzip
+import argparse
+import warnings
+import numpy as np
+import polars as pl
+from streaming import collect
+## -------- ##
+## WINDOWED VARIANT COUNTING ##
+# Replaces the external per-window intersection runs that produced 10Kb_window_Variant_Count.bed,
+# its _Homozygous/_Heterozygous variants and 500Kb_window_Variant_Count.bed. Variant positions are
+# read once; every (resolution, stratum) table is then one np.bincount over genome-wide window indices.
+
+# Strata written next to the all-variant tables: (file suffix, variant types, zygosity)
+DEFAULT_STRATA = [
+    ('', None, None),
+    ('_SNP_InDel_Homozygous', ('SNP', 'InDel'), 'Homozygous'),
+    ('_SNP_InDel_Heterozygous', ('SNP', 'InDel'), 'Heterozygous'),
+]
+
+
+def vcf_header(path):
+    # Column names of a VCF: the '#CHROM ...' line after the '##' meta-information
+    with (gzip.open(path, 'rt') if path.endswith('.gz') else open(path)) as handle:
+        for line in handle:
+            if not line.startswith('##'):
+                return line.rstrip('\n').split('\t')
+    raise ValueError(f"No #CHROM header line in {path}")
+
+
+def read_vcf_positions(path, sample=None):
+    """
+    Function to read variant positions, types and zygosity from a VCF.
+
+    Only CHROM, POS, REF, ALT, INFO and the one genotype column are parsed, so memory does not grow with the
+    number of samples. Plain VCFs are scanned lazily with the streaming engine; gzip-compressed ones are
+    decompressed in memory by polars, but only the projected columns are parsed.
+
+    Parameters:
+    -----------
+    path : str
+        Path to a VCF (plain or gzip-compressed).
+
+    sample : str, optional (default: None)
+        Sample column used for the genotype. None uses the first sample.
+
+    Returns:
+    --------
+    polars.DataFrame
+        Columns chrom, pos (0-based), type (SNP / InDel / SV) and zygosity (Homozygous / Heterozygous / Reference / Missing).
+    """
+    header = vcf_header(path)
+    sample = sample or (header[9] if len(header) > 9 else None)
+    if sample is not None and sample not in header[9:]:
+        raise ValueError(f"Sample {sample} not found in {path}")
+    needed = [header[0], 'POS', 'REF', 'ALT', 'INFO'] + ([sample] if sample else [])
+    read_kwargs = {'separator': '\t', 'comment_prefix': '##', 'has_header': True, 'infer_schema': False, 'quote_char': None}
+    if path.endswith('.gz'):
+        vcf = pl.read_csv(path, columns=needed, **read_kwargs).lazy()
+    else:
+        vcf = pl.scan_csv(path, **read_kwargs).select(needed)
+    vcf = vcf.rename({header[0]: 'CHROM'})
+
+    alt = pl.col('ALT').str.split(',').list.first()
+    variant_type = (
+        pl.when(alt.str.starts_with('<') | pl.col('INFO').str.contains('SVTYPE='))
+        .then(pl.lit('SV'))
+        .when((pl.col('REF').str.len_bytes() == 1) & (alt.str.len_bytes() == 1))
+        .then(pl.lit('SNP'))
+        .otherwise(pl.lit('InDel'))
+    )
+    columns = [
+        pl.col('CHROM').alias('chrom'),
+        (pl.col('POS').cast(pl.Int64) - 1).alias('pos'),
+        variant_type.alias('type'),
+    ]
+    if sample is None:
+        columns.append(pl.lit('Missing').alias('zygosity'))
+    else:
+        alleles = pl.col(sample).str.split(':').list.first().str.replace_all('|', '/', literal=True).str.split('/')
+        first, second = alleles.list.first(), alleles.list.last()
+        columns.append(
+            pl.when(first.is_in(['.', '']) | second.is_in(['.', ''])).then(pl.lit('Missing'))
+            .when(first != second).then(pl.lit('Heterozygous'))
+            .when(first == '0').then(pl.lit('Reference'))
+            .otherwise(pl.lit('Homozygous'))
+            .alias('zygosity')
+        )
+    return collect(vcf.select(columns), streaming=True)
+
+
+def read_bed_positions(path, chrom='col_1', pos='col_2', type_col=None, zygosity_col=None):
+    """
+    Function to read variant positions from `Variant.bed`.
+
+    Parameters:
+    -----------
+    path : str
+        Path to the BED file with a header row.
+
+    chrom, pos : str, optional (default: 'col_1', 'col_2')
+        Columns holding the chromosome and the 0-based start.
+
+    type_col, zygosity_col : str, optional (default: None)
+        Columns holding the variant type and zygosity, when the file has them.
+
+    Returns:
+    --------
+    polars.DataFrame
+        Columns chrom, pos, type and zygosity.
+    """
+    bed = pl.scan_csv(path, separator='\t', has_header=True)
+    return bed.select(
+        pl.col(chrom).cast(pl.Utf8).alias('chrom'),
+        pl.col(pos).cast(pl.Int64).alias('pos'),
+        (pl.col(type_col).cast(pl.Utf8) if type_col else pl.lit(None, pl.Utf8)).alias('type'),
+        (pl.col(zygosity_col).cast(pl.Utf8) if zygosity_col else pl.lit(None, pl.Utf8)).alias('zygosity'),
+    ).collect()
+
+
+def read_chrom_sizes(path):
+    """
+    Function to read chromosome lengths from a genome file or a .fai index (name and length in the first two columns).
+    """
+    sizes = pl.read_csv(path, separator='\t', has_header=False, columns=[0, 1], new_columns=['chrom', 'length'])
+    return dict(zip(sizes['chrom'].cast(pl.Utf8).to_list(), sizes['length'].cast(pl.Int64).to_list()))
+
+
+def window_counts(variants, resolutions, chrom_sizes=None, strata=DEFAULT_STRATA):
+    """
+    Function to count variants per window at several resolutions and strata from a single set of positions.
+
+    Parameters:
+    -----------
+    variants : polars.DataFrame
+        Output of `read_vcf_positions` or `read_bed_positions`.
+
+    resolutions : list of int
+        Window widths in bp, e.g. [10_000, 500_000].
+
+    chrom_sizes : dict, optional (default: None)
+        Chromosome lengths. Without them each chromosome ends at its last variant, rounded up to a whole window.
+        With them, variants outside 0..length-1 are dropped with a warning instead of being counted in a window.
+
+    strata : list of tuple, optional (default: DEFAULT_STRATA)
+        (suffix, variant types or None, zygosity or None) for each table to produce. Strata needing a type or
+        zygosity the variants do not have are skipped with a warning.
+
+    Returns:
+    --------
+    dict
+        Mapping of (resolution, suffix) to a polars.DataFrame with columns column_1 (chromosome),
+        column_2 (start), column_3 (end) and column_4 (count), in the same layout as the window BED files.
+
+    Example Usage:
+    --------------
+    >>> tables = window_counts(read_vcf_positions('HiFi.vcf.gz'), [10_000, 500_000], read_chrom_sizes('genome.fai'))
+    """
+    # Genome-wide chromosome codes in order of first appearance
+    chroms = variants['chrom'].unique(maintain_order=True).to_list()
+    if chrom_sizes:
+        # Chromosomes without any variant still get their (empty) windows, as with a genome-file windowing tool
+        chroms = list(chrom_sizes) + [c for c in chroms if c not in chrom_sizes]
+    code_of = {c: i for i, c in enumerate(chroms)}
+    codes = variants['chrom'].replace_strict(code_of, return_dtype=pl.UInt32).to_numpy()
+    positions = variants['pos'].to_numpy().astype(np.int64)
+    max_pos = np.zeros(len(chroms), dtype=np.int64)
+    np.maximum.at(max_pos, codes, np.maximum(positions, 0))
+    lengths = np.array([(chrom_sizes or {}).get(c, max_pos[i] + 1) for i, c in enumerate(chroms)], dtype=np.int64)
+
+    types = variants['type'].to_numpy()
+    zygosity = variants['zygosity'].to_numpy()
+    outside = (positions < 0) | (positions >= lengths[codes])
+    if outside.any():
+        # Positions past the end of the chromosome would otherwise be counted in its last window
+        per_chrom = np.bincount(codes[outside], minlength=len(chroms))
+        listed = ', '.join(f'{chroms[i]} ({per_chrom[i]})' for i in np.flatnonzero(per_chrom))
+        warnings.warn(f"Dropped {int(outside.sum())} variants outside the chromosome lengths: {listed}")
+        inside = ~outside
+        codes, positions, types, zygosity = codes[inside], positions[inside], types[inside], zygosity[inside]
+    masks = {}
+    skipped = []
+    for suffix, wanted_types, wanted_zygosity in strata:
+        # Skip strata the input cannot resolve (e.g. zygosity from a BED file without genotypes)
+        if (wanted_types is not None and variants['type'].null_count() == len(variants)) or \
+                (wanted_zygosity is not None and variants['zygosity'].null_count() == len(variants)):
+            skipped.append(suffix)
+            continue
+        mask = np.ones(len(positions), dtype=bool)
+        if wanted_types is not None:
+            mask &= np.isin(types, list(wanted_types))
+        if wanted_zygosity is not None:
+            mask &= zygosity == wanted_zygosity
+        masks[suffix] = mask
+    if skipped:
+        warnings.warn(f"Skipped {', '.join(skipped)}: the input has no variant type or zygosity for them")
+
+    tables = {}
+    for width in resolutions:
+        n_windows = (lengths + width - 1) // width
+        offsets = np.concatenate([[0], np.cumsum(n_windows)[:-1]])
+        # One global window index per variant; each table is then a single bincount
+        window_index = offsets[codes] + positions // width
+        total = int(n_windows.sum())
+        window_chrom = np.repeat(np.arange(len(chroms)), n_windows)
+        window_start = (np.arange(total) - offsets[window_chrom]) * width
+        window_end = np.minimum(window_start + width, lengths[window_chrom])
+        frame = pl.DataFrame({
+            'column_1': pl.Series(chroms, dtype=pl.Utf8).gather(window_chrom),
+            'column_2': window_start,
+            'column_3': window_end,
+        })
+        for suffix, mask in masks.items():
+            counts = np.bincount(window_index[mask], minlength=total)
+            tables[(width, suffix)] = frame.with_columns(column_4=pl.Series(counts, dtype=pl.Int64))
+    return tables
+
+
+def window_label(width):
+    # 10000 -> '10Kb', 500000 -> '500Kb'
+    return f'{width // 1000}Kb' if width % 1000 == 0 else f'{width}bp'
+
+
+def write_window_tables(tables, out_dir):
+    """
+    Function to write window tables as headerless BED files named like the ones main.py reads.
+
+    Returns:
+    --------
+    list
+        Paths of the written files.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for (width, suffix), table in tables.items():
+        path = os.path.join(out_dir, f'{window_label(width)}_window_Variant_Count{suffix}.bed')
+        table.write_csv(path, separator='\t', include_header=False)
+        written.append(path)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count variants per window at several resolutions in one pass")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--vcf', help="Variant calls (VCF, optionally gzip-compressed)")
+    source.add_argument('--bed', help="Variant.bed with a header row")
+    parser.add_argument('--sample', default=None, help="VCF sample used for zygosity (default: first sample)")
+    parser.add_argument('--type-col', default='col_8', help="--bed column with the variant type (SNP / InDel); '' for none")
+    parser.add_argument('--zygosity-col', default='col_10', help="--bed column with the zygosity (Homozygous / Heterozygous); '' for none")
+    parser.add_argument('--chrom-sizes', default=None, help="Genome file or .fai with chromosome lengths")
+    parser.add_argument('--resolutions', default='10000,500000', help="Comma-separated window widths in bp")
+    parser.add_argument('--out-dir', default='Data', help="Directory for the window BED files")
+    args = parser.parse_args()
+
+    if args.vcf:
+        variants = read_vcf_positions(args.vcf, args.sample)
+    else:
+        variants = read_bed_positions(args.bed, type_col=args.type_col or None, zygosity_col=args.zygosity_col or None)
+    sizes = read_chrom_sizes(args.chrom_sizes) if args.chrom_sizes else None
+    resolutions = [int(r) for r in args.resolutions.split(',')]
+    for path in write_window_tables(window_counts(variants, resolutions, sizes), args.out_dir):
+        print(f"Wrote {path}")
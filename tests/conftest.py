@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The pipeline modules import each other by name from Script/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Script'))
@@ -0,0 +1,102 @@
+import gzip
+import pytest
+
+np = pytest.importorskip('numpy')
+pl = pytest.importorskip('polars')
+
+from annotation import REGION_PRIORITY, RegionIndex, _merge, annotate_variants, count_regions, read_gene_model
+
+GFF = """##gff-version 3
+chr1\tsrc\tgene\t11\t60\t.\t+\t.\tID=g1;gene_biotype=protein_coding
+chr1\tsrc\tmRNA\t11\t60\t.\t+\t.\tID=t1;Parent=g1
+chr1\tsrc\texon\t11\t20\t.\t+\t.\tParent=t1
+chr1\tsrc\tCDS\t41\t60\t.\t+\t0\tParent=t1
+chr1\tsrc\tlnc_RNA\t71\t90\t.\t-\t.\tID=t2
+chr2\tsrc\tpseudogene\t1\t30\t.\t+\t.\tID=g3
+chr2\tsrc\tgene\t21\t50\t12.5\t+\t.\tID=g4;gene_biotype=lncRNA
+chr2\tsrc\tregion\t1\t1000\t.\t+\t.\tID=chr2
+"""
+FASTA = """##FASTA
+>chr1
+ACGTACGTACGT
+>chr2
+ACGTNNNN
+"""
+EXPECTED = [('chr1', 10, 60, 'Intron'), ('chr1', 10, 60, 'Intron'), ('chr1', 10, 20, 'Exon'), ('chr1', 40, 60, 'Exon'),
+            ('chr1', 70, 90, 'Lnc_RNA'), ('chr2', 0, 30, 'Pseudogene'), ('chr2', 20, 50, 'Lnc_RNA')]
+
+
+def brute_classify(features, chrom, pos):
+    for region in REGION_PRIORITY[:-1]:
+        if any(c == chrom and start <= pos < end and r == region for c, start, end, r in features):
+            return region
+    return REGION_PRIORITY[-1]
+
+
+def random_features(seed, n=60):
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, 500, n)
+    return pl.DataFrame({'chrom': rng.choice(['chr1', 'chr2', 'chr3'], n), 'start': starts,
+                         'end': starts + rng.integers(1, 60, n), 'region': rng.choice(REGION_PRIORITY[:-1], n)})
+
+
+@pytest.mark.parametrize('suffix', ['.gff3', '.gff3.gz'])
+def test_gene_model_stops_at_fasta(tmp_path, suffix):
+    path = str(tmp_path / f'genes{suffix}')
+    with (gzip.open(path, 'wt') if suffix.endswith('.gz') else open(path, 'w')) as handle:
+        handle.write(GFF + FASTA)
+    features = read_gene_model(path)
+    assert features.rows() == EXPECTED
+    assert features.schema['start'] == pl.Int64 and features.schema['end'] == pl.Int64
+
+
+def test_gene_model_without_fasta(tmp_path):
+    path = tmp_path / 'genes.gff3'
+    path.write_text(GFF)
+    assert read_gene_model(str(path)).rows() == EXPECTED
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_merge_matches_coverage(seed):
+    rng = np.random.default_rng(seed)
+    starts = np.sort(rng.integers(0, 200, 30))
+    ends = starts + rng.integers(1, 25, 30)
+    merged_starts, merged_ends = _merge(starts, ends)
+    covered = np.zeros(250, dtype=bool)
+    for start, end in zip(starts, ends):
+        covered[start:end] = True
+    # Maximal runs of covered positions
+    edges = np.diff(np.concatenate([[0], covered.astype(int), [0]]))
+    np.testing.assert_array_equal(merged_starts, np.flatnonzero(edges == 1))
+    np.testing.assert_array_equal(merged_ends, np.flatnonzero(edges == -1))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_classify_matches_brute_force(seed):
+    features = random_features(seed)
+    index = RegionIndex.build(features)
+    rng = np.random.default_rng(100 + seed)
+    chroms = rng.choice(['chr1', 'chr2', 'chr3', 'chrUn'], 400)
+    positions = rng.integers(0, 600, 400)
+    labels = index.classify(pl.Series(chroms), positions)
+    rows = list(features.iter_rows())
+    assert labels.tolist() == [brute_classify(rows, c, p) for c, p in zip(chroms, positions)]
+
+
+def test_cached_index_and_batched_counts(tmp_path):
+    features = random_features(7)
+    index = RegionIndex.build(features)
+    index.save(str(tmp_path / 'regions.npz'))
+    loaded = RegionIndex.load(str(tmp_path / 'regions.npz'))
+    rng = np.random.default_rng(8)
+    variants = pl.DataFrame({'col_1': rng.choice(['chr1', 'chr2', 'chr3'], 300), 'col_2': rng.integers(0, 600, 300),
+                             'col_8': rng.choice(['SNP', 'InDel'], 300)})
+    rows = list(features.iter_rows())
+    expected = [brute_classify(rows, c, p) for c, p in variants.select('col_1', 'col_2').iter_rows()]
+    assert annotate_variants(variants, loaded)['col_14'].to_list() == expected
+
+    counts = count_regions(variants, loaded)
+    brute = {}
+    for region, kind in zip(expected, variants['col_8']):
+        brute[(region, kind)] = brute.get((region, kind), 0) + 1
+    assert {(region, kind): count for region, kind, count in counts.iter_rows()} == brute
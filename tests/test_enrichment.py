@@ -0,0 +1,111 @@
+import itertools
+import pytest
+
+np = pytest.importorskip('numpy')
+pl = pytest.importorskip('polars')
+
+from enrichment import GENOME, _bh, _p_value, enrichment_test, meta_profile, relative_distance
+
+PERMUTATIONS = 20_000
+
+
+def brute_bh(p):
+    # q of the i-th smallest p: min over k >= i of p_(k) * n / k, capped at 1
+    n = len(p)
+    order = sorted(range(n), key=lambda i: p[i])
+    q = [0.0] * n
+    for rank, i in enumerate(order, 1):
+        q[i] = min(1.0, min(p[order[k - 1]] * n / k for k in range(rank, n + 1)))
+    return q
+
+
+def exact_statistics(groups):
+    # Every combination of within-chromosome shuffles: the exact p-value and null mean / SD of the pooled x.r
+    centred = [(x - x.mean(), r - r.mean()) for x, r in groups]
+    observed = sum(x @ r for x, r in centred)
+    per_group = [np.array([x[list(order)] @ r for order in itertools.permutations(range(len(x)))]) for x, r in centred]
+    null = per_group[0]
+    for sums in per_group[1:]:
+        null = (null[:, None] + sums[None, :]).ravel()
+    extreme = np.count_nonzero(np.abs(null) >= np.abs(observed) * (1 - 1e-12))
+    return extreme / len(null), (observed - null.mean()) / null.std()
+
+
+def window_table(groups):
+    return pl.DataFrame({'Chromosome': [c for c, (x, _) in groups.items() for _ in x],
+                         'Rel_centromere': np.concatenate([r for _, r in groups.values()]),
+                         'Percent_den': np.concatenate([x for x, _ in groups.values()])})
+
+
+def test_bh_matches_definition():
+    rng = np.random.default_rng(0)
+    for p in (rng.uniform(0, 1, 12), rng.uniform(0, 0.05, 7), np.array([0.01, 0.04, 0.04, 0.2, 0.01, 0.9])):
+        np.testing.assert_allclose(_bh(p), brute_bh(p.tolist()))
+    assert len(_bh([])) == 0
+
+
+def test_p_value_counts_the_observed_arrangement():
+    rng = np.random.default_rng(1)
+    null = rng.normal(size=500)
+    for observed in (0.0, 0.5, -1.7, 3.5):
+        expected = (1 + sum(abs(value) >= abs(observed) for value in null)) / (len(null) + 1)
+        assert _p_value(observed, null) == pytest.approx(expected)
+
+
+def test_permutation_p_values_match_exact_enumeration():
+    groups = {'chr1': (np.array([1.0, 2.5, 2.0, 4.0, 6.5, 5.0]), np.array([0.9, 0.1, 0.3, 0.5, 1.0, 0.7])),
+              'chr2': (np.array([3.0, 1.0, 2.0, 7.0]), np.array([0.2, 0.4, 0.6, 0.8]))}
+    stats = enrichment_test(window_table(groups), permutations=PERMUTATIONS, seed=3, n_jobs=2)
+    for chrom, (x, r) in groups.items():
+        row = stats.filter(pl.col('Chromosome') == chrom).row(0, named=True)
+        p, z = exact_statistics([(x, r)])
+        assert row['Windows'] == len(x)
+        assert row['Correlation'] == pytest.approx(np.corrcoef(x, r)[0, 1])
+        assert row['P_value'] == pytest.approx(p, abs=0.02)
+        assert row['Z_score'] == pytest.approx(z, abs=0.05)
+
+    genome = stats.filter(pl.col('Chromosome') == GENOME).row(0, named=True)
+    p, z = exact_statistics(list(groups.values()))
+    assert genome['Windows'] == 10
+    assert genome['P_value'] == pytest.approx(p, abs=0.02)
+    assert genome['Z_score'] == pytest.approx(z, abs=0.05)
+    chromosomes = stats.filter(pl.col('Chromosome') != GENOME)
+    np.testing.assert_allclose(chromosomes['Q_value'].to_numpy(), brute_bh(chromosomes['P_value'].to_list()))
+
+
+def test_result_does_not_depend_on_threads():
+    rng = np.random.default_rng(4)
+    groups = {f'chr{i}': (rng.normal(size=30), rng.uniform(size=30)) for i in range(1, 4)}
+    single = enrichment_test(window_table(groups), permutations=6_000, seed=5, n_jobs=1)
+    threaded = enrichment_test(window_table(groups), permutations=6_000, seed=5, n_jobs=4)
+    assert single.equals(threaded)
+
+
+def test_meta_profile_matches_brute_force():
+    rng = np.random.default_rng(6)
+    groups = {f'chr{i}': (rng.uniform(0, 5, 25), rng.uniform(0, 1, 25)) for i in range(1, 4)}
+    profile = meta_profile(window_table(groups), bins=4)
+    rows = [(c, x, r) for c, (xs, rs) in groups.items() for x, r in zip(xs, rs)]
+    chrom_mean = {c: xs.mean() for c, (xs, _) in groups.items()}
+    for row in profile.iter_rows(named=True):
+        members = [(c, x) for c, x, r in rows if min(int(r * 4), 3) == row['Bin']]
+        values = np.array([x for _, x in members])
+        expected = np.mean([chrom_mean[c] for c, _ in members])
+        assert row['Windows'] == len(members)
+        assert row['Mean'] == pytest.approx(values.mean())
+        assert row['Expected'] == pytest.approx(expected)
+        assert row['Enrichment'] == pytest.approx(values.mean() / expected)
+    assert profile['Windows'].sum() == len(rows)
+
+
+def test_relative_distance_uses_the_chromosome_length():
+    centromere = pl.DataFrame({'Chromosome': ['chr1', 'chr2'], 'Start': [40.0, 10.0], 'End': [45.0, 12.0]})
+    windows = pl.DataFrame({'Chromosome': ['chr1'] * 4 + ['chr2', 'chr3'], 'general_pos': [10.0, 42.0, 60.0, 90.0, 20.0, 5.0],
+                            'Dist_centromere': [30.0, 0.0, 15.0, 45.0, 8.0, None], 'Chr_length': [100.0] * 4 + [30.0, 6.0]})
+    result = relative_distance(windows, centromere)
+    assert result['Arm'].to_list() == ['p', 'cen', 'q', 'q', 'q', None]
+    np.testing.assert_allclose(result['Rel_centromere'].to_numpy()[:5], [0.75, 0.0, 15 / 55, 45 / 55, 8 / 18])
+    assert result['Rel_centromere'][5] is None
+    # The windows of a region keep their position relative to the whole arm
+    region = relative_distance(windows.filter(pl.col('general_pos') < 65), centromere)
+    assert region['Rel_centromere'].to_list() == result.filter(pl.col('general_pos') < 65)['Rel_centromere'].to_list()
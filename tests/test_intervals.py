@@ -0,0 +1,80 @@
+import math
+import pytest
+
+np = pytest.importorskip('numpy')
+pl = pytest.importorskip('polars')
+
+from intervals import IntervalIndex, add_centromere_distance, centromere_layer
+
+
+def brute_distance(intervals, chrom, pos):
+    # Distance to the closest interval on the same chromosome, 0 inside one, NaN without any
+    same = [(start, end) for c, start, end in intervals if c == chrom]
+    if not same:
+        return math.nan
+    return min(max(start - pos, pos - end, 0.0) for start, end in same)
+
+
+def random_intervals(seed):
+    rng = np.random.default_rng(seed)
+    intervals = []
+    for chrom in ('chr1', 'chr2', 'chr10'):
+        for _ in range(rng.integers(1, 6)):
+            start = float(rng.integers(0, 100))
+            intervals.append((chrom, start, start + float(rng.integers(0, 40))))
+    return intervals
+
+
+def check(intervals, chroms, positions):
+    index = IntervalIndex(*zip(*intervals))
+    result = index.distance(pl.Series(chroms), np.asarray(positions, dtype=float))
+    expected = [brute_distance(intervals, c, p) for c, p in zip(chroms, positions)]
+    np.testing.assert_allclose(result, expected, equal_nan=True)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_distance_matches_brute_force(seed):
+    intervals = random_intervals(seed)
+    rng = np.random.default_rng(100 + seed)
+    chroms = rng.choice(['chr1', 'chr2', 'chr10', 'chrY'], 200).tolist()
+    check(intervals, chroms, rng.uniform(-20, 160, 200))
+
+
+def test_nested_intervals():
+    # [20, 30] starts last before 40, but 40 is still inside [10, 50]
+    intervals = [('chr1', 10.0, 50.0), ('chr1', 20.0, 30.0), ('chr1', 60.0, 70.0), ('chr2', 5.0, 8.0)]
+    check(intervals, ['chr1'] * 6 + ['chr2'] * 2, [40, 25, 52, 58, 75, 0, 3, 9])
+
+
+def test_positions_far_beyond_the_intervals():
+    # Queries much larger than any interval coordinate must not land on the next chromosome
+    intervals = [('chr1', 10.0, 20.0), ('chr2', 1.0, 2.0), ('chr3', 5.0, 6.0)]
+    check(intervals, ['chr1', 'chr1', 'chr2', 'chr3'], [500, 10_000, 300, -400])
+
+
+def test_unknown_chromosome_is_nan():
+    index = IntervalIndex(['chr1'], [10.0], [20.0])
+    result = index.distance(['chrUn', 'chr1'], [15, 25])
+    assert math.isnan(result[0]) and result[1] == 5
+
+
+def test_centromere_layer_and_distances():
+    centromere_df = pl.DataFrame({'column_1': ['chr1', 'chr1', 'chr2'], 'column_2': [40_000_000] * 2 + [10_000_000],
+                                  'column_3': [45_000_000] * 2 + [12_000_000]})
+    layer = centromere_layer(centromere_df)
+    assert layer.rows() == [('chr1', 40.0, 45.0), ('chr2', 10.0, 12.0)]
+
+    length = {'chr1': 100.0, 'chr2': 31.0, 'chr3': 6.0}
+    chroms = ['chr1'] * 4 + ['chr2'] * 3 + ['chr3']
+    windows = pl.DataFrame({'Chromosome': chroms, 'general_pos': [1.0, 42.0, 60.0, 99.5, 0.5, 11.0, 30.0, 5.0],
+                            'Chr_length': [length[c] for c in chroms]})
+    result = add_centromere_distance(windows, layer)
+    intervals = list(layer.iter_rows())
+    rows = list(windows.iter_rows())
+    np.testing.assert_allclose(result['Dist_centromere'].to_numpy(), [brute_distance(intervals, c, p) for c, p, _ in rows],
+                               equal_nan=True)
+    np.testing.assert_allclose(result['Dist_telomere'].to_numpy(), [max(min(p, length[c] - p), 0.0) for c, p, _ in rows])
+    # A region keeps only some windows; their distances to the chromosome end do not change
+    subset = windows.filter(pl.col('general_pos').is_between(10, 65))
+    np.testing.assert_allclose(add_centromere_distance(subset, layer)['Dist_telomere'].to_numpy(),
+                               result.filter(pl.col('general_pos').is_between(10, 65))['Dist_telomere'].to_numpy())
@@ -0,0 +1,93 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pl = pytest.importorskip('polars')
+
+from loess import grouped_loess, loess_fit
+
+EPSILON = 1e-12
+
+
+def local_fit(x, y, robust, at, k):
+    # One weighted least-squares line per point, over its k nearest observations (tricube weights)
+    fitted = np.empty(len(at))
+    for i, point in enumerate(at):
+        near = np.argsort(np.abs(x - point), kind='stable')[:k]
+        dist = np.abs(x[near] - point)
+        w = (1 - (dist / (dist.max() or 1.0)) ** 3) ** 3 * robust[near]
+        xm, ym = np.average(x[near], weights=w), np.average(y[near], weights=w)
+        slope = np.sum(w * (x[near] - xm) * (y[near] - ym)) / np.sum(w * (x[near] - xm) ** 2)
+        fitted[i] = ym + slope * (point - xm)
+    return fitted
+
+
+def vega_loess(x, y, bandwidth=0.3, iterations=2, grid=None):
+    # Vega's transform_loess (vega-statistics loess.js) written out point by point: a fit, then `iterations`
+    # bisquare reweightings of the residuals, each followed by a refit
+    order = np.argsort(x, kind='stable')
+    x, y = x[order], y[order]
+    k = max(2, int(bandwidth * len(x)))
+    robust = np.ones(len(x))
+    for _ in range(iterations):
+        residuals = np.abs(y - local_fit(x, y, robust, x, k))
+        median = np.median(residuals)
+        if median < EPSILON:
+            break
+        arg = residuals / (6 * median)
+        robust = np.where(arg >= 1, EPSILON, (1 - arg ** 2) ** 2)
+    at = x if grid is None else grid
+    return at, local_fit(x, y, robust, at, k)
+
+
+def noisy_sine(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(0, 10, n)
+    y = np.sin(x) + rng.normal(0, 0.2, n)
+    # A few gross outliers for the robustness iterations to down-weight
+    y[[n // 12, n // 3, 2 * n // 3]] += [4.0, -5.0, 6.0]
+    return x, y
+
+
+@pytest.mark.parametrize('bandwidth', [0.1, 0.3, 0.75])
+@pytest.mark.parametrize('iterations', [0, 1, 2])
+def test_matches_vega_at_data_points(bandwidth, iterations):
+    x, y = noisy_sine()
+    grid, fitted = loess_fit(x, y, bandwidth=bandwidth, iterations=iterations)
+    expected_x, expected = vega_loess(x, y, bandwidth, iterations)
+    np.testing.assert_array_equal(grid, expected_x)
+    np.testing.assert_allclose(fitted, expected, rtol=1e-6, atol=1e-6)
+
+
+def test_matches_brute_force_on_a_grid():
+    x, y = noisy_sine(seed=1)
+    grid = np.linspace(-1, 11, 37)
+    _, fitted = loess_fit(x, y, grid=grid)
+    _, expected = vega_loess(x, y, grid=grid)
+    np.testing.assert_allclose(fitted, expected, rtol=1e-6, atol=1e-6)
+
+
+def test_input_order_and_missing_values_do_not_matter():
+    x, y = noisy_sine(seed=2)
+    shuffled = np.random.default_rng(3).permutation(len(x))
+    _, fitted = loess_fit(np.append(x[shuffled], np.nan), np.append(y[shuffled], 1.0))
+    _, expected = loess_fit(x, y)
+    np.testing.assert_allclose(fitted, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_reproduces_a_straight_line():
+    x = np.arange(30, dtype=float)
+    grid, fitted = loess_fit(x, 3 - 0.5 * x, iterations=0)
+    np.testing.assert_allclose(fitted, 3 - 0.5 * grid, atol=1e-9)
+
+
+def test_grouped_matches_one_fit_per_group():
+    x1, y1 = noisy_sine(40, seed=4)
+    x2, y2 = noisy_sine(25, seed=5)
+    df = pl.DataFrame({'Chromosome': ['chr1'] * 40 + ['chr2'] * 25, 'Type': ['DEL'] * 65,
+                       'x': np.concatenate([x1, x2]), 'y': np.concatenate([y1, y2])})
+    trend = grouped_loess(df, 'x', 'y', ['Chromosome', 'Type'], grid_size=11, n_jobs=2)
+    for chrom, (x, y) in {'chr1': (x1, y1), 'chr2': (x2, y2)}.items():
+        curve = trend.filter(pl.col('Chromosome') == chrom)
+        grid = np.linspace(x.min(), x.max(), 11)
+        np.testing.assert_allclose(curve['x'].to_numpy(), grid)
+        np.testing.assert_allclose(curve['y'].to_numpy(), vega_loess(x, y, grid=grid)[1], rtol=1e-6, atol=1e-6)
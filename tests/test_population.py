@@ -0,0 +1,150 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pl = pytest.importorskip('polars')
+
+from population import MAD_SCALE, DensityMatrix, build_matrix
+
+RESOLUTION = 10_000
+# Genome_text.tsv order is not the natural order of the labels
+CHR_MAP = {'column_1': ['NC_2', 'NC_1', 'NC_X'], 'column_2': [35_000, 95_000, 20_000], 'column_3': ['chr2', 'chr1', 'chrX']}
+# (sequence, window start, window end) in matrix order
+WINDOWS = [(seq, start, min(start + RESOLUTION, length))
+           for seq, length in (('NC_1', 95_000), ('NC_2', 35_000), ('NC_X', 20_000)) for start in range(0, length, RESOLUTION)]
+SAMPLES = ['S1', 'S2', 'S3', 'S4', 'S5']
+
+
+def random_counts(seed):
+    # samples x windows counts with an empty window, a constant one and one where most samples agree (MAD 0)
+    counts = np.random.default_rng(seed).poisson(20, (len(SAMPLES), len(WINDOWS)))
+    counts[:, 3] = 0
+    counts[:, 7] = 12
+    counts[:, 11] = [4, 4, 4, 4, 30]
+    counts[1, 5] = 300
+    return counts
+
+
+def sample_table(row, seed):
+    # The sample's non-zero windows in random order, plus a sequence missing from Genome_text.tsv
+    rng = np.random.default_rng(seed)
+    present = [i for i in rng.permutation(len(WINDOWS)) if row[i]]
+    return pl.DataFrame({'column_1': [WINDOWS[i][0] for i in present] + ['NC_unplaced'],
+                         'column_2': [WINDOWS[i][1] for i in present] + [0],
+                         'column_3': [WINDOWS[i][2] for i in present] + [RESOLUTION],
+                         'column_4': [int(row[i]) for i in present] + [99]})
+
+
+def make_matrix(path, counts, block_bytes):
+    matrix = DensityMatrix.create(str(path), pl.DataFrame(CHR_MAP), RESOLUTION, block_bytes)
+    for index, (sample, row) in enumerate(zip(SAMPLES, counts)):
+        assert matrix.append(sample, sample_table(row, index)) == index
+    return matrix
+
+
+def densities(counts):
+    widths = np.array([end - start for _, start, end in WINDOWS], dtype=float)
+    return counts * 100 / widths
+
+
+def brute_z(values):
+    # Robust z-scores of one window across samples, falling back to the SD when the MAD is 0
+    median = np.median(values)
+    spread = MAD_SCALE * np.median(np.abs(values - median))
+    if spread == 0:
+        spread = values.std()
+    return (values - median) / spread if spread > 0 else np.zeros(len(values))
+
+
+# Two block-sized arrays of 5 samples x 3 windows: most reductions run over several blocks
+@pytest.fixture(params=[2 * 8 * len(SAMPLES) * 3, 1 << 20], ids=['tiny-blocks', 'one-block'])
+def matrix_and_counts(tmp_path, request):
+    counts = random_counts(0)
+    return make_matrix(tmp_path / 'matrix', counts, request.param), counts
+
+
+def test_append_places_every_window(matrix_and_counts):
+    matrix, counts = matrix_and_counts
+    windows = matrix.windows.select(pl.col('column_1').cast(pl.Utf8), pl.col('Start').cast(pl.Int64), pl.col('End').cast(pl.Int64))
+    assert windows.rows() == WINDOWS
+    assert matrix.windows['Chromosome'].cast(pl.Utf8).unique(maintain_order=True).to_list() == ['chr1', 'chr2', 'chrX']
+    np.testing.assert_array_equal(matrix.counts, counts)
+    reopened = DensityMatrix(matrix.path)
+    assert reopened.samples == SAMPLES
+    np.testing.assert_array_equal(reopened.counts, counts)
+
+
+def test_append_rejects_duplicates_and_off_grid_windows(matrix_and_counts):
+    matrix, _ = matrix_and_counts
+    with pytest.raises(ValueError):
+        matrix.append('S1', sample_table(np.ones(len(WINDOWS)), 0))
+    shifted = sample_table(np.ones(len(WINDOWS)), 0).with_columns(pl.col('column_2') + 5)
+    with pytest.raises(ValueError):
+        matrix.append('S6', shifted)
+    assert matrix.samples == SAMPLES
+
+
+def test_window_stats_match_dense_matrix(matrix_and_counts):
+    matrix, counts = matrix_and_counts
+    stats = matrix.window_stats()
+    dense = densities(counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        count_mean, count_var = counts.mean(axis=0), counts.var(axis=0, ddof=1)
+        dispersion = np.where(count_mean > 0, count_var / count_mean, np.nan)
+        log_dispersion = np.where(dispersion > 0, np.log(dispersion), np.nan)
+        centre = np.nanmedian(log_dispersion)
+        hyper = (log_dispersion - centre) / (MAD_SCALE * np.nanmedian(np.abs(log_dispersion - centre)))
+        cv = dense.std(axis=0, ddof=1) / dense.mean(axis=0)
+    np.testing.assert_allclose(stats['Mean'].to_numpy(), dense.mean(axis=0))
+    np.testing.assert_allclose(stats['Variance'].to_numpy(), dense.var(axis=0, ddof=1))
+    np.testing.assert_allclose(stats['CV'].to_numpy(), cv, equal_nan=True)
+    np.testing.assert_allclose(stats['Dispersion'].to_numpy(), dispersion, equal_nan=True)
+    np.testing.assert_allclose(stats['Hypervariable_z'].to_numpy(), hyper, equal_nan=True)
+    assert stats['Dispersion'][3] is None and stats['Hypervariable_z'][7] is None
+
+
+def test_outlier_scores_match_dense_matrix(matrix_and_counts, tmp_path):
+    matrix, counts = matrix_and_counts
+    dense = densities(counts)
+    z = np.column_stack([brute_z(dense[:, window]) for window in range(len(WINDOWS))])
+    out = str(tmp_path / 'scores.f32')
+    hits = matrix.outlier_scores(threshold=1.5, out=out)
+    expected = sorted((SAMPLES[s], WINDOWS[w][0], WINDOWS[w][1], dense[s, w], z[s, w])
+                      for s, w in zip(*np.nonzero(np.abs(z) >= 1.5)))
+    found = sorted(hits.select('Sample', 'column_1', pl.col('Start').cast(pl.Int64), 'Value', 'Z').rows())
+    assert [row[:3] for row in found] == [row[:3] for row in expected]
+    np.testing.assert_allclose([row[3:] for row in found], [row[3:] for row in expected])
+    scores = np.memmap(out, dtype=np.float32, mode='r', shape=(len(SAMPLES), len(WINDOWS)))
+    np.testing.assert_allclose(scores, z, rtol=1e-6, atol=1e-6)
+    # The spike is an outlier, and so is the odd sample of the window where four samples agree (scored with the SD)
+    assert ('S2', 'NC_1', 50_000) in [row[:3] for row in found]
+    assert ('S5', 'NC_2', 10_000) in [row[:3] for row in found]
+
+
+@pytest.mark.parametrize('metric', ['euclidean', 'correlation'])
+def test_distances_match_dense_matrix(matrix_and_counts, metric):
+    matrix, counts = matrix_and_counts
+    dense = densities(counts)
+    if metric == 'euclidean':
+        expected = np.sqrt(((dense[:, None, :] - dense[None, :, :]) ** 2).sum(axis=2))
+    else:
+        expected = 1 - np.corrcoef(dense)
+    np.fill_diagonal(expected, 0)
+    result = matrix.distances(metric)
+    assert result['Sample'].to_list() == SAMPLES
+    np.testing.assert_allclose(result.select(SAMPLES).to_numpy(), expected, atol=1e-9)
+
+
+def test_build_matrix_resumes_and_reports_progress(tmp_path):
+    counts = random_counts(1)
+    cohort = []
+    for index, (sample, row) in enumerate(zip(SAMPLES, counts)):
+        data_dir = tmp_path / sample
+        data_dir.mkdir()
+        sample_table(row, index).write_csv(data_dir / 'table.bed', separator='\t', include_header=False)
+        cohort.append((sample, str(data_dir)))
+    added = []
+    build_matrix(cohort[:2], str(tmp_path / 'matrix'), 'table.bed', pl.DataFrame(CHR_MAP), RESOLUTION,
+                 progress=lambda sample, row: added.append((sample, row)))
+    matrix = build_matrix(cohort, str(tmp_path / 'matrix'), 'table.bed', progress=lambda sample, row: added.append((sample, row)))
+    assert added == [(sample, row) for row, sample in enumerate(SAMPLES)]
+    np.testing.assert_array_equal(matrix.counts, counts)
@@ -0,0 +1,108 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pl = pytest.importorskip('polars')
+
+from store import VariantStore, in_region, parse_region
+
+CHROMS = ['chr1', 'chr2', 'chr10']
+
+
+def random_table(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, 1_000, n)
+    return pl.DataFrame({'chrom': rng.choice(CHROMS, n), 'start': starts, 'end': starts + rng.integers(1, 50, n),
+                         'value': np.arange(n)})
+
+
+def build(tmp_path, table, end='end', unit=1, row_group=16):
+    source = str(tmp_path / 'source.arrow')
+    table.write_ipc(source)
+    return VariantStore(VariantStore.build(source, str(tmp_path / 'sorted.arrow'), 'chrom', 'start', end, unit, row_group))
+
+
+def brute_query(table, chrom, low, high, end='end', unit=1):
+    # Rows of `chrom` overlapping [low, high) bp, or at a position inside it when there is no end column
+    rows = []
+    for row in table.iter_rows(named=True):
+        if row['chrom'] != chrom:
+            continue
+        if low is None:
+            rows.append(row['value'])
+        elif end is None and low / unit <= row['start'] < high / unit:
+            rows.append(row['value'])
+        elif end is not None and row['start'] < high / unit and row[end] > low / unit:
+            rows.append(row['value'])
+    return sorted(rows)
+
+
+def random_regions(seed, count=40):
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        low = int(rng.integers(-50, 1_050))
+        yield str(rng.choice(CHROMS)), low, low + int(rng.integers(1, 300))
+
+
+@pytest.mark.parametrize('end', ['end', None])
+def test_query_matches_brute_force(tmp_path, end):
+    table = random_table()
+    store = build(tmp_path, table, end)
+    for chrom, low, high in [*random_regions(1), *((c, None, None) for c in CHROMS), ('chrUn', 0, 10)]:
+        result = store.query(chrom, low, high)
+        assert sorted(result['value'].to_list()) == brute_query(table, chrom, low, high, end)
+        assert result['chrom'].cast(pl.Utf8).is_in([chrom]).all()
+        # Rows come back in (chromosome, start) order
+        assert result['start'].is_sorted()
+
+
+def test_row_groups_never_prune_a_match(tmp_path):
+    table = random_table(seed=2)
+    store = build(tmp_path, table)
+    frame = pl.read_ipc(store.path).with_columns(pl.col('chrom').cast(pl.Utf8))
+    offsets = store.index['offset']
+    pruned = 0
+    for chrom, low, high in random_regions(3, 100):
+        kept = set(store.row_groups(store.codes[chrom], low, high).tolist())
+        for group in range(len(offsets) - 1):
+            rows = frame.slice(int(offsets[group]), int(offsets[group + 1] - offsets[group]))
+            if group not in kept:
+                pruned += 1
+                assert rows.filter(in_region((chrom, low, high), 'chrom', 'start', 'end')).height == 0
+    # A region is much narrower than a chromosome, so row groups are skipped
+    assert pruned > 0
+
+
+def test_narrow_query_reads_few_rows(tmp_path):
+    table = random_table(2_000, seed=4)
+    store = build(tmp_path, table, row_group=64)
+    result = store.query('chr2', 400, 420)
+    assert sorted(result['value'].to_list()) == brute_query(table, 'chr2', 400, 420)
+    assert result.height <= store.last_rows_read < table.height // 2
+
+
+def test_units_and_aliases(tmp_path):
+    # Coordinates in kbp, queried in bp through a sequence name alias
+    table = random_table(seed=5).with_columns(pl.col('start', 'end') / 1_000)
+    store = build(tmp_path, table, unit=1_000)
+    store.aliases = {'NC_000002': 'chr2'}
+    result = store.query('NC_000002', 100, 300)
+    assert sorted(result['value'].to_list()) == brute_query(table, 'chr2', 100, 300, unit=1_000)
+    assert sorted(store.query('chr10:0.1-0.3kb')['value'].to_list()) == brute_query(table, 'chr10', 100, 300, unit=1_000)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('chr7', ('chr7', None, None)),
+    ('chr7:40000000-60000000', ('chr7', 40_000_000, 60_000_000)),
+    ('chr7:40-60Mb', ('chr7', 40_000_000, 60_000_000)),
+    ('chr7:40,000kb-60,000kb', ('chr7', 40_000_000, 60_000_000)),
+    ('chr7:500kb-1.5Mb', ('chr7', 500_000, 1_500_000)),
+    (' NC_088381.1:10 - 20 ', ('NC_088381.1', 10, 20)),
+])
+def test_parse_region(text, expected):
+    assert parse_region(text) == expected
+
+
+@pytest.mark.parametrize('text', ['chr7:60-40Mb', 'chr7:40-', 'chr7:a-b'])
+def test_parse_region_rejects(text):
+    with pytest.raises(ValueError):
+        parse_region(text)
@@ -0,0 +1,103 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pl = pytest.importorskip('polars')
+
+from svstats import QUANTILES, SVLengthStats, TDigest
+
+LEVELS = [0.001, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 0.999]
+# The k1 scale bounds a centroid to ~pi / compression of the ranks around the median, less at the tails
+RANK_ERROR = 0.01
+
+
+def rank_error(values, estimates, levels):
+    # How far the rank of each estimate is from the requested quantile level
+    ordered = np.sort(values)
+    ranks = (np.searchsorted(ordered, estimates, side='left') + np.searchsorted(ordered, estimates, side='right')) / (2 * len(values))
+    return np.abs(ranks - np.asarray(levels))
+
+
+def lengths(n, seed):
+    return np.random.default_rng(seed).lognormal(6, 1.5, n).round()
+
+
+def test_quantiles_within_rank_error():
+    values = lengths(50_000, 0)
+    digest = TDigest()
+    for chunk in np.array_split(values, 50):
+        digest.update(chunk)
+    estimates = digest.quantile(np.array(LEVELS))
+    assert rank_error(values, estimates, LEVELS).max() <= RANK_ERROR
+    assert digest.quantile(0.0) == values.min() and digest.quantile(1.0) == values.max()
+    assert len(digest.means) <= digest.compression
+    assert digest.weights.sum() == pytest.approx(len(values))
+
+
+def test_merged_digests_match_one_digest():
+    values = lengths(40_000, 1)
+    parts = [TDigest().update(part) for part in np.array_split(values, 4)]
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+    estimates = merged.quantile(np.array(LEVELS))
+    assert rank_error(values, estimates, LEVELS).max() <= RANK_ERROR
+    assert (merged.min, merged.max) == (values.min(), values.max())
+    assert merged.weights.sum() == pytest.approx(len(values))
+
+
+def test_empty_digest():
+    assert np.isnan(TDigest().quantile(0.5))
+    assert np.isnan(TDigest().quantile(np.array([0.1, 0.9]))).all()
+
+
+def sv_chunk(n, seed):
+    rng = np.random.default_rng(seed)
+    svlen = rng.lognormal(6, 1.5, n).round() * rng.choice([-1, 1], n)
+    frame = pl.DataFrame({'SVTYPE': rng.choice(['DEL', 'INS', 'DUP', 'BND'], n), 'SVLEN': svlen})
+    # Calls without a length are skipped
+    return frame.with_columns(pl.when(pl.int_range(pl.len()) % 17 == 0).then(None).otherwise(pl.col('SVLEN')).alias('SVLEN'))
+
+
+def brute_lengths(chunks):
+    table = pl.concat(chunks).drop_nulls().filter(pl.col('SVTYPE') != 'BND')
+    return {svtype: np.abs(table.filter(pl.col('SVTYPE') == svtype)['SVLEN'].to_numpy()) for svtype in ('DEL', 'INS', 'DUP')}
+
+
+def test_exact_statistics_match_brute_force():
+    chunks = [sv_chunk(300, seed) for seed in range(3)]
+    stats = SVLengthStats()
+    for chunk in chunks:
+        stats.update(chunk)
+    assert stats.exact
+    expected = brute_lengths(chunks)
+    assert set(stats.counts) == set(expected)
+    for svtype, values in expected.items():
+        assert stats.counts[svtype] == len(values)
+        assert stats.totals[svtype] == pytest.approx(values.sum())
+        assert (stats.mins[svtype], stats.maxs[svtype]) == (values.min(), values.max())
+        np.testing.assert_allclose(stats.quantiles(svtype), np.quantile(values, QUANTILES))
+    table = stats.table()
+    median = table.filter((pl.col('SVTYPE') == 'DEL') & (pl.col('Metric') == 'Median Length (bp)'))['Value'].item()
+    assert median == pytest.approx(np.median(expected['DEL']))
+
+
+def test_budget_switch_and_merge_keep_the_counts(tmp_path):
+    chunks = [sv_chunk(2_000, seed) for seed in range(10, 14)]
+    small = SVLengthStats(max_exact=1_000)
+    for chunk in chunks[:2]:
+        small.update(chunk)
+    assert not small.exact
+    exact = SVLengthStats()
+    for chunk in chunks[2:]:
+        exact.update(chunk)
+    assert exact.exact
+
+    # An exact state merged into a digest state, after a save / load round trip
+    merged = SVLengthStats.load(small.save(str(tmp_path / 'small.npz'))).merge(exact)
+    expected = brute_lengths(chunks)
+    for svtype, values in expected.items():
+        assert merged.counts[svtype] == len(values)
+        assert merged.totals[svtype] == pytest.approx(values.sum())
+        assert rank_error(values, merged.quantiles(svtype, LEVELS[2:-2]), LEVELS[2:-2]).max() <= RANK_ERROR
+        # quantiles() folded the buffered centroids, so every call is in a centroid
+        assert merged.digests[svtype].weights.sum() == pytest.approx(len(values))
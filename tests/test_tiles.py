@@ -0,0 +1,80 @@
+import os
+import pytest
+
+np = pytest.importorskip('numpy')
+pl = pytest.importorskip('polars')
+alt = pytest.importorskip('altair')
+
+from dataset_cache import DatasetRegistry
+from export import EXPORT_SETTINGS
+from tiles import facet_tiles, grid_layout
+
+CHROMS = ['chr1', 'chr2', 'chr10']
+
+
+def windows(seed=0, shift=None):
+    # 500 kbp windows of three chromosomes, with their centromere Start/End (Mbp) as in Data_processing_fig2
+    rng = np.random.default_rng(seed)
+    frames = []
+    for index, chrom in enumerate(CHROMS):
+        starts = np.arange(0, 20_000_000, 500_000)
+        density = rng.uniform(0, 5, len(starts)) + (1.0 if chrom == shift else 0.0)
+        frames.append(pl.DataFrame({'Chromosome': chrom, 'column_2': starts / 10**6, 'column_3': (starts + 500_000) / 10**6,
+                                    'general_pos': (starts + 250_000) / 10**6, 'Percent_den': density,
+                                    'Start': 8.0 + index, 'End': 9.0 + index}))
+    return pl.concat(frames)
+
+
+@pytest.fixture
+def export_dir(tmp_path, monkeypatch):
+    for key, value in {'formats': ['svg'], 'ppi': None, 'out_dir': str(tmp_path), 'tile_workers': 1,
+                       'tile_cache': str(tmp_path / 'tiles')}.items():
+        monkeypatch.setitem(EXPORT_SETTINGS, key, value)
+    return tmp_path
+
+
+def test_legend_keeps_the_full_domain():
+    color = alt.Color('Chromosome', scale=alt.Scale(scheme='category20b', domain=CHROMS), sort=CHROMS, title=None)
+    data = windows().filter(pl.col('Chromosome') != 'chr2')
+    layered = alt.layer(alt.Chart(data).mark_circle().encode(x='general_pos:Q', y='Percent_den:Q', color=color))
+    pieces = facet_tiles(layered, data, 'Chromosome', CHROMS, title='Figure', legend=color)
+    # A level without rows gets no tile, but keeps its legend entry
+    assert [level for level, _ in pieces['tiles']] == ['chr1', 'chr10']
+    assert pieces['legend'].data['Chromosome'].to_list() == CHROMS
+    assert all(tile.data.height == 40 for _, tile in pieces['tiles'])
+
+
+def test_grid_layout_places_title_and_legend():
+    places, title_at, legend_at, size = grid_layout([(100, 50)] * 4, 3, title=(80, 30), legend=(40, 60))
+    assert places == [(0, 30), (120, 30), (240, 30), (0, 100)]
+    assert title_at == (130.0, 0.0) and legend_at == (360, 30)
+    assert size == (400, 150)
+
+
+def test_tiled_figure_renders_and_reuses_tiles(export_dir):
+    pytest.importorskip('vl_convert')
+    pytest.importorskip('vegafusion')
+    from Figure2 import Plot_VarPerChr
+    Plot_VarPerChr(windows(), CHROMS, tiles=True)
+    svg = (export_dir / 'Figure2.svg').read_text()
+    assert svg.startswith('<svg') and all(f'>{chrom}<' in svg for chrom in CHROMS)
+    # One tile per chromosome, the title and the legend
+    cached = set(os.listdir(export_dir / 'tiles'))
+    assert len(cached) == len(CHROMS) + 2
+
+    # New data for one chromosome re-renders only its tile
+    Plot_VarPerChr(windows(shift='chr2'), CHROMS, tiles=True)
+    assert len(set(os.listdir(export_dir / 'tiles')) - cached) == 1
+
+
+def test_tile_cache_counts_towards_the_disk_limit(tmp_path):
+    tiles = tmp_path / 'tiles'
+    tiles.mkdir()
+    registry = DatasetRegistry(str(tmp_path), max_disk=2_500)
+    for age, name in enumerate(['old.svg', 'mid.svg', 'new.svg']):
+        path = tiles / name
+        path.write_bytes(b'x' * 1_000)
+        os.utime(path, (1_000 + age, 1_000 + age))
+        registry.track(str(path), path.stat().st_mtime)
+    assert registry.evict() == [os.path.join('tiles', 'old.svg')]
+    assert sorted(os.listdir(tiles)) == ['mid.svg', 'new.svg']
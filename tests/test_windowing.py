@@ -0,0 +1,84 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pl = pytest.importorskip('polars')
+
+from windowing import DEFAULT_STRATA, read_bed_positions, window_counts
+
+SIZES = {'chr1': 95, 'chr2': 40, 'chr3': 7}
+TYPES = ['SNP', 'InDel', 'SV']
+ZYGOSITY = ['Homozygous', 'Heterozygous', 'Reference', 'Missing']
+
+
+def random_variants(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    # chr3 gets no variants, so its windows are all empty
+    chroms = rng.choice(['chr1', 'chr2'], n)
+    positions = np.array([rng.integers(0, SIZES[c]) for c in chroms])
+    return pl.DataFrame({'chrom': chroms, 'pos': positions, 'type': rng.choice(TYPES, n),
+                         'zygosity': rng.choice(ZYGOSITY, n)})
+
+
+def brute_counts(variants, sizes, width, types=None, zygosity=None):
+    rows = []
+    for chrom, length in sizes.items():
+        for start in range(0, length, width):
+            end = min(start + width, length)
+            count = sum(1 for c, p, t, z in variants.iter_rows()
+                        if c == chrom and start <= p < end and (types is None or t in types) and (zygosity is None or z == zygosity))
+            rows.append((chrom, start, end, count))
+    return rows
+
+
+def table_rows(table):
+    return [(c, int(s), int(e), int(n)) for c, s, e, n in table.select('column_1', 'column_2', 'column_3', 'column_4').iter_rows()]
+
+
+@pytest.mark.parametrize('width', [1, 10, 25, 100])
+def test_counts_match_brute_force(width):
+    variants = random_variants()
+    tables = window_counts(variants, [width], SIZES)
+    assert set(tables) == {(width, suffix) for suffix, _, _ in DEFAULT_STRATA}
+    for suffix, types, zygosity in DEFAULT_STRATA:
+        assert table_rows(tables[(width, suffix)]) == brute_counts(variants, SIZES, width, types, zygosity)
+
+
+def test_resolutions_share_one_pass():
+    variants = random_variants(seed=1)
+    tables = window_counts(variants, [10, 25], SIZES)
+    for width in (10, 25):
+        assert table_rows(tables[(width, '')]) == brute_counts(variants, SIZES, width)
+
+
+def test_without_sizes_chromosomes_end_at_last_variant():
+    variants = random_variants(seed=2)
+    sizes = {c: int(variants.filter(pl.col('chrom') == c)['pos'].max()) + 1 for c in variants['chrom'].unique(maintain_order=True)}
+    tables = window_counts(variants, [10])
+    assert table_rows(tables[(10, '')]) == brute_counts(variants, sizes, 10)
+
+
+def test_positions_outside_chromosome_are_dropped():
+    variants = random_variants(seed=3)
+    outside = pl.DataFrame({'chrom': ['chr1', 'chr2', 'chr2'], 'pos': [-1, SIZES['chr2'], SIZES['chr2'] + 50],
+                            'type': ['SNP'] * 3, 'zygosity': ['Homozygous'] * 3})
+    with pytest.warns(UserWarning, match=r'Dropped 3 variants.*chr1 \(1\).*chr2 \(2\)'):
+        tables = window_counts(pl.concat([variants, outside]), [10], SIZES)
+    for suffix, types, zygosity in DEFAULT_STRATA:
+        assert table_rows(tables[(10, suffix)]) == brute_counts(variants, SIZES, 10, types, zygosity)
+
+
+def test_strata_without_genotypes_are_skipped():
+    variants = random_variants(seed=4).with_columns(pl.lit(None, pl.Utf8).alias('type'), pl.lit(None, pl.Utf8).alias('zygosity'))
+    with pytest.warns(UserWarning, match=r'Skipped _SNP_InDel_Homozygous, _SNP_InDel_Heterozygous'):
+        tables = window_counts(variants, [10], SIZES)
+    assert set(tables) == {(10, '')}
+    assert table_rows(tables[(10, '')]) == brute_counts(variants, SIZES, 10)
+
+
+def test_bed_type_and_zygosity_columns_give_every_stratum(tmp_path):
+    variants = random_variants(seed=5)
+    path = tmp_path / 'Variant.bed'
+    variants.select(col_1='chrom', col_2='pos', col_3=pl.col('pos') + 1, col_8='type', col_10='zygosity').write_csv(path, separator='\t')
+    tables = window_counts(read_bed_positions(str(path), type_col='col_8', zygosity_col='col_10'), [10], SIZES)
+    for suffix, types, zygosity in DEFAULT_STRATA:
+        assert table_rows(tables[(10, suffix)]) == brute_counts(variants, SIZES, 10, types, zygosity)